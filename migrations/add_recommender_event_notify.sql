@@ -0,0 +1,42 @@
+-- Publish new plays, likes and skips on the recommender_events channel so a resident
+-- recommender (RECOMMENDER_EVENTS=postgres) can update its counters without
+-- re-reading the tables. Payloads match event_ingest.parse_event().
+-- The timestamp is the transaction's now() as created_at/played_at store it, so it
+-- equals the row's own timestamp and a skip_history snapshot can tell which
+-- events it already holds.
+CREATE OR REPLACE FUNCTION notify_recommender_event() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('recommender_events', json_build_object(
+        'type', TG_ARGV[0],
+        'user_id', NEW.user_id,
+        'song_id', NEW.song_id,
+        'skip_type', CASE WHEN TG_ARGV[0] = 'skip' THEN to_jsonb(NEW) ->> 'skip_type' END,
+        'timestamp', EXTRACT(EPOCH FROM now()::timestamp)
+    )::text);
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DO $$
+BEGIN
+    IF to_regclass('recently_played') IS NOT NULL THEN
+        DROP TRIGGER IF EXISTS recently_played_notify ON recently_played;
+        CREATE TRIGGER recently_played_notify
+        AFTER INSERT ON recently_played
+        FOR EACH ROW EXECUTE FUNCTION notify_recommender_event('play');
+    END IF;
+
+    IF to_regclass('skip_history') IS NOT NULL THEN
+        DROP TRIGGER IF EXISTS skip_history_notify ON skip_history;
+        CREATE TRIGGER skip_history_notify
+        AFTER INSERT ON skip_history
+        FOR EACH ROW EXECUTE FUNCTION notify_recommender_event('skip');
+    END IF;
+
+    IF to_regclass('user_favorite_songs') IS NOT NULL THEN
+        DROP TRIGGER IF EXISTS user_favorite_songs_notify ON user_favorite_songs;
+        CREATE TRIGGER user_favorite_songs_notify
+        AFTER INSERT ON user_favorite_songs
+        FOR EACH ROW EXECUTE FUNCTION notify_recommender_event('like');
+    END IF;
+END $$;
@@ -16,6 +16,12 @@ import time
 from contextlib import contextmanager
 import soundfile as sf
 import sys
+import argparse
+import multiprocessing
+import metrics
+from recognition_index import (CHROMA_SEQUENCE_FRAMES, SEQUENCE_INDEX_DIR, SEQUENCE_KINDS, SegmentedIndex,
+                               feature_sequence, file_lock, rank_matches, resample_sequence)
+from segment_features import segment_matrix
 
 # Load environment variables
 load_dotenv()
@@ -30,24 +36,49 @@ logger = logging.getLogger(__name__)
 @contextmanager
 def timer(name: str):
     start = time.time()
-    yield
+    with metrics.stage(name, component='recognizer'):
+        yield
     logger.info(f"{name} took {time.time() - start:.2f} seconds")
 
+# Feature extraction trade-offs, selected with AudioRecognizer(profile=...) or
+# AUDIO_FEATURE_PROFILE:
+#   accurate - native rate, CQT chroma, full HPSS for harmonic content. The reference.
+#   balanced - 22.05 kHz, CQT chroma, DC-based harmonic proxy.
+#   fast     - 11.025 kHz, STFT chroma, DC-based harmonic proxy.
+# On 30 synthetic 8 s melodies (1 CPU), with 5 s noisy crops as queries:
+#   profile    process_audio  from_path  top-1  pitch_mean drift  chroma drift
+#   accurate   410 ms         1325 ms    29/30  -                 -
+#   balanced   174 ms          176 ms    28/30  ~35 Hz            <0.001
+#   fast        53 ms           45 ms    30/30  ~35 Hz            ~0.03
+# Pitch drift is piptrack's coarser bins at lower rates; tonnetz reuses the chroma
+# in every profile, so it no longer costs a second CQT.
+# All profiles pick the per-frame pitch with one vectorised argmax. Features from
+# different profiles aren't interchangeable: index and query with the same one.
+EXTRACTION_PROFILES = {
+    'fast': {'sample_rate': 11025, 'chroma': 'stft', 'harmonic': 'proxy'},
+    'balanced': {'sample_rate': 22050, 'chroma': 'cqt', 'harmonic': 'proxy'},
+    'accurate': {'sample_rate': None, 'chroma': 'cqt', 'harmonic': 'hpss'},
+}
+DEFAULT_PROFILE = os.getenv('AUDIO_FEATURE_PROFILE', 'accurate')
+
+SUPPORTED_FORMATS = ['.wav', '.mp3', '.webm', '.ogg']
+
+# Audio read for a stored song's summary features; its segments cover the rest of the track
+SUMMARY_SECONDS = 30
+
 class AudioRecognizer:
-    def __init__(self, temp_dir: Optional[str] = None):
+    def __init__(self, temp_dir: Optional[str] = None, profile: str = DEFAULT_PROFILE):
+        if profile not in EXTRACTION_PROFILES:
+            raise ValueError(f"Unknown extraction profile '{profile}', expected one of {sorted(EXTRACTION_PROFILES)}")
+        self.profile_name = profile
+        self.profile = EXTRACTION_PROFILES[profile]
+
         self.temp_dir = temp_dir or tempfile.gettempdir()
         Path(self.temp_dir).mkdir(parents=True, exist_ok=True)
+        self._sequence_indexes = None
 
-        # Initialize connection pool
-        self.connection_pool = pool.ThreadedConnectionPool(
-            minconn=1,
-            maxconn=10,
-            dbname=os.getenv('DB_NAME'),
-            user=os.getenv('DB_USER'),
-            password=os.getenv('DB_PASSWORD'),
-            host=os.getenv('DB_HOST'),
-            port=os.getenv('DB_PORT')
-        )
+        # Connection pool, opened on first use so feature extraction works without a database
+        self.connection_pool = None
 
         # Initialize yt-dlp options
         self.ydl_opts = {
@@ -71,9 +102,19 @@ class AudioRecognizer:
             'mfcc': (-100, 100)  # MFCCs for timbre
         }
 
-        self.supported_formats = ['.wav', '.mp3', '.webm', '.ogg']
+        self.supported_formats = list(SUPPORTED_FORMATS)
 
     def get_db_connection(self):
+        if self.connection_pool is None:
+            self.connection_pool = pool.ThreadedConnectionPool(
+                minconn=1,
+                maxconn=10,
+                dbname=os.getenv('DB_NAME'),
+                user=os.getenv('DB_USER'),
+                password=os.getenv('DB_PASSWORD'),
+                host=os.getenv('DB_HOST'),
+                port=os.getenv('DB_PORT')
+            )
         return self.connection_pool.getconn()
 
     def put_db_connection(self, conn):
@@ -105,16 +146,11 @@ class AudioRecognizer:
             )
             
             # Get the dominant pitch for each frame with confidence threshold
-            pitch_track = []
-            for i in range(pitches.shape[1]):
-                index = magnitudes[:, i].argmax()
-                pitch_value = pitches[index, i]
-                magnitude = magnitudes[index, i]
-                if pitch_value > 0 and magnitude > 0.1:  # Only include confident pitches
-                    pitch_track.append(pitch_value)
-            
-            # Convert to numpy array for easier calculations
-            pitch_track = np.array(pitch_track)
+            frames = np.arange(pitches.shape[1])
+            index = magnitudes.argmax(axis=0)
+            pitch_values = pitches[index, frames]
+            confident = (pitch_values > 0) & (magnitudes[index, frames] > 0.1)  # Only include confident pitches
+            pitch_track = pitch_values[confident]
             
             # Return default values if no valid pitches found
             if len(pitch_track) == 0:
@@ -145,16 +181,15 @@ class AudioRecognizer:
     def extract_melodic_features(self, y: np.ndarray, sr: int) -> Dict[str, Any]:
         """Extract melodic features important for humming recognition."""
         # Chroma features for pitch class
-        chroma = librosa.feature.chroma_cqt(y=y, sr=sr)
+        chroma = self.compute_chroma(y, sr)
         chroma_mean = np.mean(chroma, axis=1)
         
-        # Tonal centroid features
-        tonnetz = librosa.feature.tonnetz(y=y, sr=sr)
+        # Tonal centroid features, from the same chroma instead of a second CQT
+        tonnetz = librosa.feature.tonnetz(y=y, sr=sr, chroma=chroma)
         tonnetz_mean = np.mean(tonnetz, axis=1)
         
         # Harmonic content
-        harmonic = librosa.effects.harmonic(y)
-        harmonic_content = float(np.mean(harmonic))
+        harmonic_content = self.harmonic_content(y)
         
         return {
             'chroma': chroma_mean.tolist(),
@@ -162,6 +197,30 @@ class AudioRecognizer:
             'harmonic_content': harmonic_content
         }
 
+    def resample_for_profile(self, audio: np.ndarray, sr: int) -> Tuple[np.ndarray, int]:
+        """Downsample to the profile's analysis rate; never upsample."""
+        target = self.profile['sample_rate']
+        if target is None or sr <= target:
+            return audio, sr
+        return librosa.resample(audio, orig_sr=sr, target_sr=target), target
+
+    def compute_chroma(self, y: np.ndarray, sr: int) -> np.ndarray:
+        if self.profile['chroma'] == 'stft':
+            return librosa.feature.chroma_stft(y=y, sr=sr)
+        return librosa.feature.chroma_cqt(y=y, sr=sr)
+
+    def harmonic_content(self, y: np.ndarray) -> float:
+        """Mean of the harmonic component of the signal.
+
+        HPSS masks split each STFT bin between the two components, and the DC bin is
+        perfectly stable in time, so it goes almost entirely to the harmonic part.
+        The mean of the harmonic signal is therefore close to the mean of the signal,
+        which the cheaper profiles use in place of a full HPSS.
+        """
+        if self.profile['harmonic'] == 'hpss':
+            return float(np.mean(librosa.effects.harmonic(y)))
+        return float(np.mean(y))
+
     def normalize_features(self, features: Dict[str, Any]) -> Dict[str, Any]:
         """Normalize features to a common scale."""
         normalized = {}
@@ -179,7 +238,7 @@ class AudioRecognizer:
         try:
             with timer("feature_extraction"):
                 # Try different audio loading methods
-                y = None
+                audio = None
                 sr = None
                 
                 # First try with soundfile
@@ -192,10 +251,10 @@ class AudioRecognizer:
                     logger.warning(f"SoundFile failed: {str(e)}, trying librosa...")
                 
                 # If soundfile failed, try librosa
-                if y is None:
+                if audio is None:
                     try:
                         # Try librosa with different backends
-                        audio, sr = librosa.load(audio_path, sr=44100, mono=True, duration=30, res_type='kaiser_fast')
+                        audio, sr = librosa.load(audio_path, sr=self.profile['sample_rate'] or 44100, mono=True, duration=30, res_type='kaiser_fast')
                         logger.info("Successfully loaded audio with librosa")
                     except Exception as e:
                         logger.error(f"Librosa loading failed: {str(e)}")
@@ -216,11 +275,12 @@ class AudioRecognizer:
                             return None
 
                 # Ensure we have valid audio data
-                if y is None or len(y) == 0:
+                if audio is None or len(audio) == 0:
                     logger.error("No valid audio data loaded")
                     return None
 
-                # Normalize audio
+                # Normalize audio at the profile's analysis rate
+                audio, sr = self.resample_for_profile(np.asarray(audio, dtype=np.float32), sr)
                 audio = librosa.util.normalize(audio)
 
                 # Extract pitch features with error handling
@@ -320,13 +380,16 @@ class AudioRecognizer:
             conn = self.get_db_connection()
             cursor = conn.cursor()
             cursor.execute(
-                "UPDATE songs SET features = %s WHERE id = %s",
+                "UPDATE songs SET features = %s WHERE id = %s RETURNING hashtext(features::text)",
                 (json.dumps(features), song_id)
             )
+            row = cursor.fetchone()
             conn.commit()
             cursor.close()
             self.put_db_connection(conn)
             logger.info(f"[DB Update] Features updated for song ID: {song_id}")
+            if row:
+                self.index_song(song_id, features, row[0])
         except Exception as e:
             logger.error(f"[DB Update Error] {str(e)}")
             if conn:
@@ -340,7 +403,7 @@ class AudioRecognizer:
             batch = songs[processed:processed + batch_size]
             for song_id, youtube_url in batch:
                 try:
-                    with timer(f"processing_song_{song_id}"):
+                    with timer("process_song"):
                         features = self.extract_features(youtube_url)
                         if features:
                             self.update_song_features(song_id, features)
@@ -354,7 +417,7 @@ class AudioRecognizer:
 
     def find_matching_song(self, features: Dict[str, Any], threshold: float = 0.8, batch_size: int = 1000) -> Optional[Dict[str, Any]]:
         try:
-            with timer("find_matching_song"):
+            with timer("match"):
                 conn = self.get_db_connection()
                 cursor = conn.cursor()
                 
@@ -411,6 +474,160 @@ class AudioRecognizer:
                 self.put_db_connection(conn)
             return None
 
+    def sequence_indexes(self) -> Dict[str, SegmentedIndex]:
+        if self._sequence_indexes is None:
+            self._sequence_indexes = {kind: SegmentedIndex(os.path.join(SEQUENCE_INDEX_DIR, kind))
+                                      for kind in SEQUENCE_KINDS}
+        return self._sequence_indexes
+
+    def load_sequence_indexes(self) -> Dict[str, SegmentedIndex]:
+        """Per-kind segmented sequence indexes, synced with the songs table.
+
+        update_song_features() writes each song straight into the indexes. To catch
+        writes made any other way, Postgres computes count, id sum and a summed
+        hash of the features column and compares them with the sync state.
+        Only on a mismatch are the per-song hashes fetched and the changed rows
+        re-indexed. Nothing is rebuilt from scratch.
+        """
+        conn = self.get_db_connection()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("""
+                    SELECT COUNT(*), COALESCE(SUM(id), 0), COALESCE(SUM(hashtext(features::text)), 0)
+                    FROM songs
+                    WHERE features IS NOT NULL
+                """)
+                signature = tuple(int(value) for value in cursor.fetchone())
+                song_ids, hashes = self.read_sync_state()
+                if signature != (len(song_ids), int(song_ids.sum()), int(hashes.sum())):
+                    with file_lock(os.path.join(SEQUENCE_INDEX_DIR, 'sync.lock')):
+                        self.sync_sequence_indexes(cursor)
+        finally:
+            self.put_db_connection(conn)
+
+        indexes = self.sequence_indexes()
+        for index in indexes.values():
+            index.refresh()
+        return {kind: index for kind, index in indexes.items() if index.length is not None}
+
+    def read_sync_state(self) -> Tuple[np.ndarray, np.ndarray]:
+        """Song ids the indexes reflect, sorted, with the feature hash each was indexed at."""
+        path = os.path.join(SEQUENCE_INDEX_DIR, 'sync.npz')
+        if not os.path.exists(path):
+            return np.array([], dtype=np.int64), np.array([], dtype=np.int64)
+        with np.load(path) as data:
+            return data['song_ids'], data['hashes']
+
+    def write_sync_state(self, song_ids: np.ndarray, hashes: np.ndarray):
+        path = os.path.join(SEQUENCE_INDEX_DIR, 'sync.npz')
+        tmp_path = f'{path}.{os.getpid()}.tmp.npz'
+        order = np.argsort(song_ids, kind='stable')
+        np.savez(tmp_path, song_ids=song_ids[order], hashes=hashes[order])
+        os.replace(tmp_path, path)
+
+    def sync_sequence_indexes(self, cursor, chunk_size: int = 10000):
+        """Re-index songs whose features changed since the last sync; call under sync.lock."""
+        with timer("sequence_index_sync"):
+            song_ids, hashes = self.read_sync_state()
+            cursor.execute("SELECT id, hashtext(features::text) FROM songs WHERE features IS NOT NULL ORDER BY id")
+            rows = np.array(cursor.fetchall(), dtype=np.int64).reshape(-1, 2)
+            current_ids, current_hashes = rows[:, 0], rows[:, 1]
+
+            indexed = dict(zip(song_ids.tolist(), hashes.tolist()))
+            changed = [song_id for song_id, feature_hash in zip(current_ids.tolist(), current_hashes.tolist())
+                       if indexed.get(song_id) != feature_hash]
+            removed = np.setdiff1d(song_ids, current_ids)
+            for start in range(0, len(changed), chunk_size):
+                cursor.execute("SELECT id, features FROM songs WHERE id = ANY(%s)", (changed[start:start + chunk_size],))
+                self.index_songs(cursor.fetchall())
+            for index in self.sequence_indexes().values():
+                index.refresh()
+                index.delete(np.intersect1d(removed, index.live_ids()))
+            self.write_sync_state(current_ids, current_hashes)
+            logger.info(f"Sequence index sync: {len(changed)} songs indexed, {len(removed)} removed")
+
+        # Whole-index caches from before segments existed
+        for stale in [*Path(SEQUENCE_INDEX_DIR).glob('*-*.npz'), *Path(SEQUENCE_INDEX_DIR).glob('manifest-*.json')]:
+            stale.unlink()
+        for index in self.sequence_indexes().values():
+            index.request_compaction()
+
+    def index_songs(self, rows: List[Tuple[int, Any]]):
+        """Write one new segment per kind for these (song_id, features) rows.
+
+        Songs whose features no longer yield a sequence of some kind are
+        tombstoned in that kind's index.
+        """
+        items = {kind: [] for kind in SEQUENCE_KINDS}
+        missing = {kind: [] for kind in SEQUENCE_KINDS}
+        for song_id, song_features in rows:
+            song_features = json.loads(song_features) if isinstance(song_features, str) else song_features
+            for kind, extract in SEQUENCE_KINDS.items():
+                sequence = extract(song_features) if isinstance(song_features, dict) else None
+                if sequence is None:
+                    missing[kind].append(song_id)
+                else:
+                    items[kind].append((song_id, sequence))
+        for kind, index in self.sequence_indexes().items():
+            index.add(items[kind])
+            if missing[kind]:
+                index.refresh()
+                index.delete(np.intersect1d(missing[kind], index.live_ids()))
+
+    def index_song(self, song_id: int, features: Dict[str, Any], feature_hash: int):
+        """Make one song's new features searchable and record them in the sync state."""
+        try:
+            with file_lock(os.path.join(SEQUENCE_INDEX_DIR, 'sync.lock')):
+                self.index_songs([(song_id, features)])
+                song_ids, hashes = self.read_sync_state()
+                position = int(np.searchsorted(song_ids, song_id))
+                if position < len(song_ids) and song_ids[position] == song_id:
+                    hashes = hashes.copy()
+                    hashes[position] = feature_hash
+                else:
+                    song_ids = np.insert(song_ids, position, song_id)
+                    hashes = np.insert(hashes, position, feature_hash)
+                self.write_sync_state(song_ids, hashes)
+            for index in self.sequence_indexes().values():
+                index.request_compaction()
+        except (OSError, ValueError) as e:
+            # The next load_sequence_indexes() sees the mismatch and re-syncs
+            logger.warning(f"Could not index features for song {song_id}: {str(e)}")
+
+    def match_sequences(self, features: Dict[str, Any], top_n: int = 5,
+                        min_similarity: float = 0.5) -> List[Dict[str, Any]]:
+        """Top-N songs by DTW similarity to the query (see rank_matches), with display fields."""
+        with timer("match"):
+            ranked, stats = rank_matches(self.load_sequence_indexes(), features, top_n, min_similarity)
+            for kind, kind_stats in stats.items():
+                logger.info(f"{kind} DTW: {kind_stats['candidates']} candidates, {kind_stats['pruned']} pruned by lower bounds, "
+                            f"{kind_stats['abandoned']} abandoned early, {kind_stats['full_dtw']} full DTW")
+                metrics.inc('dtw_pruned_total', kind_stats['pruned'], component='recognizer', kind=kind)
+                metrics.inc('dtw_full_total', kind_stats['full_dtw'], component='recognizer', kind=kind)
+            if not ranked:
+                return []
+
+            conn = self.get_db_connection()
+            try:
+                with conn.cursor() as cursor:
+                    cursor.execute("""
+                        SELECT s.id, s.title, a.name, s.image_url
+                        FROM songs s
+                        LEFT JOIN artists a ON s.artist_id = a.id
+                        WHERE s.id = ANY(%s)
+                    """, ([song_id for _, song_id in ranked],))
+                    rows = {row[0]: row for row in cursor.fetchall()}
+            finally:
+                self.put_db_connection(conn)
+
+            return [{
+                'id': song_id,
+                'title': rows[song_id][1],
+                'artist_name': rows[song_id][2],
+                'image_url': rows[song_id][3],
+                'similarity': similarity
+            } for similarity, song_id in ranked if song_id in rows]
+
     def cleanup(self):
         try:
             for file in Path(self.temp_dir).glob('*.wav'):
@@ -423,14 +640,15 @@ class AudioRecognizer:
 
     def __del__(self):
         self.cleanup()
-        if hasattr(self, 'connection_pool'):
+        if getattr(self, 'connection_pool', None):
             self.connection_pool.closeall()
 
-    def load_audio(self, file_path: str) -> tuple:
-        """Load audio file using soundfile or librosa."""
+    def load_audio(self, file_path: str, max_seconds: Optional[float] = None) -> tuple:
+        """Load audio file using soundfile or librosa, only its first `max_seconds` if set."""
         try:
             # Try soundfile first
-            audio, sr = sf.read(file_path)
+            frames = -1 if max_seconds is None else int(max_seconds * sf.info(file_path).samplerate)
+            audio, sr = sf.read(file_path, frames=frames)
             if len(audio.shape) > 1:
                 audio = audio.mean(axis=1)  # Convert stereo to mono
             logger.info(f"Successfully loaded audio using soundfile: {file_path}")
@@ -439,7 +657,7 @@ class AudioRecognizer:
             logger.warning(f"Failed to load with soundfile: {str(e)}")
             try:
                 # Try librosa as fallback
-                audio, sr = librosa.load(file_path, sr=44100)
+                audio, sr = librosa.load(file_path, sr=self.profile['sample_rate'] or 44100, duration=max_seconds)
                 logger.info(f"Successfully loaded audio using librosa: {file_path}")
                 return audio, sr
             except Exception as e:
@@ -449,6 +667,8 @@ class AudioRecognizer:
     def extract_features(self, audio: np.ndarray, sr: int) -> dict:
         """Extract audio features matching the database schema."""
         try:
+            audio, sr = self.resample_for_profile(np.asarray(audio, dtype=np.float32), sr)
+
             # Extract MFCC features
             mfccs = librosa.feature.mfcc(y=audio, sr=sr, n_mfcc=20)
             mfcc_mean = np.mean(mfccs, axis=1)
@@ -458,14 +678,18 @@ class AudioRecognizer:
 
             # Extract tempo
             tempo, _ = librosa.beat.beat_track(y=audio, sr=sr)
+            # Newer librosa returns a one-element array
+            tempo = float(np.atleast_1d(tempo)[0])
             # Normalize tempo (assuming typical range 60-180 BPM)
             tempo = (tempo - 60) / 120
 
             # Extract chroma features
-            chroma = librosa.feature.chroma_cqt(y=audio, sr=sr)
+            chroma = self.compute_chroma(audio, sr)
             chroma_mean = np.mean(chroma, axis=1)
             # Normalize chroma features
             chroma_mean = (chroma_mean - np.min(chroma_mean)) / (np.max(chroma_mean) - np.min(chroma_mean))
+            # Fixed-length chroma sequence for DTW matching
+            chroma_frames = resample_sequence(chroma.T, CHROMA_SEQUENCE_FRAMES)
 
             # Extract spectral features
             spectral_rolloff = np.mean(librosa.feature.spectral_rolloff(y=audio, sr=sr))
@@ -481,6 +705,7 @@ class AudioRecognizer:
                 "mfcc": mfcc_mean.tolist(),
                 "tempo": float(tempo),
                 "chroma": chroma_mean.tolist(),
+                "chroma_sequence": np.round(chroma_frames, 3).tolist(),
                 "spectral_rolloff": float(spectral_rolloff),
                 "spectral_centroid": float(spectral_centroid),
                 "zero_crossing_rate": float(zero_crossing_rate)
@@ -493,14 +718,35 @@ class AudioRecognizer:
             logger.error(f"Error extracting features: {str(e)}")
             return None
 
-    def process_audio(self, file_path: str) -> dict:
-        """Process audio file and return features."""
+    def extract_segments(self, file_path: str) -> Optional[List[List[float]]]:
+        """Summary vectors for every 10 s segment (5 s apart) of the whole track.
+
+        The file is streamed a segment at a time, so long tracks cost no more
+        memory than short ones. Stored as the features' "segments" matrix, which
+        lets a recording from anywhere in the song match it.
+        """
+        def featurize(audio: np.ndarray, sr: int) -> Optional[np.ndarray]:
+            features = self.extract_features(audio, sr)
+            sequence = feature_sequence(features) if features else None
+            return None if sequence is None else sequence[:, 0]
+
+        with timer("segments"):
+            matrix = segment_matrix(file_path, featurize)
+        return None if matrix is None else np.round(matrix, 3).tolist()
+
+    def process_audio(self, file_path: str, max_seconds: Optional[float] = None) -> dict:
+        """Process audio file and return features, from its first `max_seconds` if set."""
+        with metrics.request('process_audio', component='recognizer'):
+            return self._process_audio(file_path, max_seconds)
+
+    def _process_audio(self, file_path: str, max_seconds: Optional[float] = None) -> dict:
         if not os.path.exists(file_path):
             return {'error': 'File not found'}
 
         try:
             # Load audio with minimum duration of 7 seconds
-            audio, sr = self.load_audio(file_path)
+            with timer("decode"):
+                audio, sr = self.load_audio(file_path, max_seconds)
             if audio is None:
                 return {'error': 'Failed to load audio file'}
 
@@ -510,7 +756,8 @@ class AudioRecognizer:
                 return {'error': 'Audio too short. Please record at least 7 seconds.'}
 
             # Extract features
-            features = self.extract_features(audio, sr)
+            with timer("dsp"):
+                features = self.extract_features(audio, sr)
             if features is None:
                 return {'error': 'Failed to extract features'}
 
@@ -520,15 +767,132 @@ class AudioRecognizer:
             logger.error(f"Error processing audio: {str(e)}")
             return {'error': str(e)}
 
-def main():
-    if len(sys.argv) != 2:
-        print(json.dumps({'error': 'Usage: python audio_recognizer.py <audio_file_path>'}))
+class JsonArgumentParser(argparse.ArgumentParser):
+    """Usage errors go to stdout as JSON, which is what the Node server reads."""
+
+    def error(self, message):
+        print(json.dumps({'error': f'{message}. {self.format_usage().strip()}'}))
         sys.exit(1)
 
-    file_path = sys.argv[1]
-    recognizer = AudioRecognizer()
-    result = recognizer.process_audio(file_path)
-    print(json.dumps(result))
+def collect_batch_inputs(paths: List[str], manifest: Optional[str]) -> List[Dict[str, Any]]:
+    """Batch entries from files, directories and a manifest, in a stable order.
+
+    Directories are walked recursively for supported formats and for files with
+    no extension, which is how multer names uploads. A manifest has one entry per
+    line: a bare path, or a JSON object with a "path" and optionally a "song_id".
+    """
+    entries = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for name in sorted(files):
+                    extension = os.path.splitext(name)[1].lower()
+                    if not name.startswith('.') and (extension in SUPPORTED_FORMATS or not extension):
+                        entries.append({'path': os.path.join(root, name)})
+        else:
+            entries.append({'path': path})
+    if manifest:
+        with open(manifest) as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    entries.append(json.loads(line) if line.startswith('{') else {'path': line})
+    return entries
+
+# One recognizer per batch worker process, set up by _init_batch_worker()
+_batch = {}
+
+def _init_batch_worker(profile: str, match: bool, top_n: int, store: bool):
+    # Workers already run in parallel; stop each one's BLAS from spawning a thread per core too
+    from threadpoolctl import threadpool_limits
+    threadpool_limits(1)
+    _batch.update(recognizer=AudioRecognizer(profile=profile), match=match, top_n=top_n, store=store)
+
+def _analyse_batch_entry(entry: Dict[str, Any]) -> Dict[str, Any]:
+    recognizer = _batch['recognizer']
+    start = time.perf_counter()
+    store = _batch['store'] and entry.get('song_id') is not None
+    try:
+        # A stored song is read in full only by the streamed segment pass, so memory stays bounded
+        result = recognizer.process_audio(entry['path'], SUMMARY_SECONDS if store else None)
+        if 'error' not in result:
+            if store:
+                segments = recognizer.extract_segments(entry['path'])
+                if segments:
+                    result['segments'] = segments
+                recognizer.update_song_features(int(entry['song_id']), result)
+            if _batch['match']:
+                result = {'matches': recognizer.match_sequences(result, _batch['top_n'])}
+            else:
+                result = {'features': result}
+    except Exception as e:
+        result = {'error': str(e)}
+    return {**entry, **result, 'seconds': round(time.perf_counter() - start, 4)}
+
+def run_batch(entries: List[Dict[str, Any]], workers: int, profile: str, match: bool, top_n: int,
+              store: bool) -> Dict[str, Any]:
+    """Analyse entries across a process pool, printing one JSON line per file as it finishes."""
+    start = time.perf_counter()
+    latencies = []
+    errors: Dict[str, int] = {}
+    context = multiprocessing.get_context('fork' if 'fork' in multiprocessing.get_all_start_methods() else 'spawn')
+    with context.Pool(workers, initializer=_init_batch_worker, initargs=(profile, match, top_n, store)) as workers_pool:
+        for result in workers_pool.imap_unordered(_analyse_batch_entry, entries, chunksize=1):
+            latencies.append(result['seconds'])
+            if 'error' in result:
+                errors[result['error']] = errors.get(result['error'], 0) + 1
+            print(json.dumps(result), flush=True)
+
+    elapsed = time.perf_counter() - start
+    failed = sum(errors.values())
+    return {
+        'files': len(entries),
+        'succeeded': len(entries) - failed,
+        'failed': failed,
+        'errors': dict(sorted(errors.items(), key=lambda item: -item[1])[:10]),
+        'workers': workers,
+        'wall_seconds': round(elapsed, 3),
+        'files_per_second': round(len(entries) / elapsed, 3) if elapsed > 0 else 0.0,
+        'file_seconds_p50': round(float(np.percentile(latencies, 50)), 4) if latencies else 0.0,
+        'file_seconds_p95': round(float(np.percentile(latencies, 95)), 4) if latencies else 0.0,
+    }
+
+def main():
+    parser = JsonArgumentParser(prog='audio_recognizer.py',
+                                description='Extract recognition features, or match against the catalog.')
+    parser.add_argument('paths', nargs='*', help='audio files, or directories in batch mode')
+    parser.add_argument('--match', action='store_true', help='return the top catalog matches instead of features')
+    parser.add_argument('--top', type=int, default=5)
+    parser.add_argument('--profile', choices=list(EXTRACTION_PROFILES), default=DEFAULT_PROFILE)
+    parser.add_argument('--batch', action='store_true',
+                        help='stream one JSON line per file, then a summary line')
+    parser.add_argument('--manifest', help='file listing one path or JSON entry per line (implies --batch)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--store', action='store_true',
+                        help='batch mode: save features, with full-track segments, for manifest entries that carry a song_id')
+    args = parser.parse_args()
+
+    batch = args.batch or args.manifest or len(args.paths) > 1 or any(os.path.isdir(path) for path in args.paths)
+    if not batch:
+        if len(args.paths) != 1:
+            parser.error('expected one audio file')
+        recognizer = AudioRecognizer(profile=args.profile)
+        result = recognizer.process_audio(args.paths[0])
+        if args.match and 'error' not in result:
+            # Sequence matching happens here, so feature rows never leave Python
+            result = {'matches': recognizer.match_sequences(result, args.top)}
+        print(json.dumps(result))
+        return
+
+    entries = collect_batch_inputs(args.paths, args.manifest)
+    if not entries:
+        parser.error('no input files')
+    summary = run_batch(entries, max(1, min(args.workers, len(entries))), args.profile, args.match, args.top,
+                        args.store)
+    print(json.dumps({'summary': summary}), flush=True)
+    if summary['failed']:
+        sys.exit(2)
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,322 @@
+import argparse
+import json
+import logging
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import librosa
+import numpy as np
+import soundfile as sf
+
+from audio_recognizer import DEFAULT_PROFILE, EXTRACTION_PROFILES, SUPPORTED_FORMATS, AudioRecognizer
+from recognition_index import SEQUENCE_KINDS, SegmentedIndex, rank_matches
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+SOURCES = ['tones', 'melody', 'noise']
+TRANSFORMS = ['crop', 'noise', 'pitch', 'tempo']
+STAGES = ['decode', 'features', 'match', 'total']
+
+# Signal-to-noise ratio of the 'noise' query transform
+QUERY_SNR_DB = 10.0
+
+
+def tone_sequence(rng: np.random.Generator, seconds: float, sr: int) -> np.ndarray:
+    """Pure tones at random pitches, each held for 0.25-1 s."""
+    parts, total = [], 0
+    while total < seconds * sr:
+        length = int(rng.uniform(0.25, 1.0) * sr)
+        t = np.arange(length) / sr
+        parts.append(np.sin(2 * np.pi * librosa.midi_to_hz(rng.integers(48, 84)) * t))
+        total += length
+    return np.concatenate(parts)[:int(seconds * sr)]
+
+
+def melody(rng: np.random.Generator, seconds: float, sr: int) -> np.ndarray:
+    """Decaying notes with three harmonics from one scale, over a sustained root."""
+    root = int(rng.integers(45, 57))
+    scale = root + np.array([0, 2, 4, 5, 7, 9, 11, 12, 14, 16])
+    beat = 60 / rng.uniform(80, 160)
+    parts, total = [], 0
+    while total < seconds * sr:
+        length = int(beat * rng.choice([0.5, 1, 1, 2]) * sr)
+        t = np.arange(length) / sr
+        frequency = librosa.midi_to_hz(rng.choice(scale))
+        note = sum(amplitude * np.sin(2 * np.pi * frequency * harmonic * t)
+                   for harmonic, amplitude in ((1, 1.0), (2, 0.5), (3, 0.25)))
+        parts.append(note * np.exp(-3 * t / max(t[-1], 1e-3)))
+        total += length
+    signal = np.concatenate(parts)[:int(seconds * sr)]
+    t = np.arange(len(signal)) / sr
+    return signal + 0.3 * np.sin(2 * np.pi * librosa.midi_to_hz(root - 12) * t)
+
+
+def noise_texture(rng: np.random.Generator, seconds: float, sr: int) -> np.ndarray:
+    """Band-limited noise, amplitude-modulated at a slow random rate."""
+    n = int(seconds * sr)
+    spectrum = np.fft.rfft(rng.normal(size=n))
+    frequencies = np.fft.rfftfreq(n, 1 / sr)
+    low = rng.uniform(100, 2000)
+    spectrum[(frequencies < low) | (frequencies > low * rng.uniform(1.5, 4))] = 0
+    t = np.arange(n) / sr
+    return np.fft.irfft(spectrum, n) * (1 + 0.8 * np.sin(2 * np.pi * rng.uniform(0.5, 4) * t))
+
+
+GENERATORS: Dict[str, Callable[[np.random.Generator, float, int], np.ndarray]] = {
+    'tones': tone_sequence,
+    'melody': melody,
+    'noise': noise_texture,
+}
+
+
+def normalize(audio: np.ndarray) -> np.ndarray:
+    peak = np.max(np.abs(audio))
+    return (0.5 * audio / peak if peak > 0 else audio).astype(np.float32)
+
+
+def generate_catalog(n_songs: int, seconds: float, sr: int, seed: int = 0) -> List[Dict[str, Any]]:
+    """Reference songs cycling through the synthetic sources."""
+    rng = np.random.default_rng(seed)
+    songs = []
+    for song_id in range(1, n_songs + 1):
+        source = SOURCES[(song_id - 1) % len(SOURCES)]
+        songs.append({'id': song_id, 'source': source, 'sr': sr,
+                      'audio': normalize(GENERATORS[source](rng, seconds, sr))})
+    return songs
+
+
+def load_catalog(directory: str, recognizer: AudioRecognizer) -> List[Dict[str, Any]]:
+    """Reference songs from local audio files, in path order."""
+    songs = []
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        for name in sorted(files):
+            if os.path.splitext(name)[1].lower() not in SUPPORTED_FORMATS:
+                continue
+            audio, sr = recognizer.load_audio(os.path.join(root, name))
+            if audio is not None:
+                songs.append({'id': len(songs) + 1, 'source': name, 'sr': sr,
+                              'audio': normalize(np.asarray(audio, dtype=np.float32))})
+    return songs
+
+
+def make_query(song: Dict[str, Any], transform: str, seconds: float, rng: np.random.Generator) -> np.ndarray:
+    """A `seconds`-long excerpt of the song, distorted by `transform`."""
+    audio, sr = song['audio'], song['sr']
+    # Cut a little extra so a slowed-down excerpt still fills the query
+    window = min(len(audio), int(seconds * 1.25 * sr))
+    start = int(rng.integers(0, len(audio) - window + 1))
+    excerpt = audio[start:start + window]
+    if transform == 'noise':
+        noise_power = np.mean(excerpt ** 2) / (10 ** (QUERY_SNR_DB / 10))
+        excerpt = excerpt + rng.normal(0, np.sqrt(noise_power), len(excerpt)).astype(np.float32)
+    elif transform == 'pitch':
+        excerpt = librosa.effects.pitch_shift(excerpt, sr=sr, n_steps=float(rng.choice([-1, 1])))
+    elif transform == 'tempo':
+        excerpt = librosa.effects.time_stretch(excerpt, rate=float(rng.choice([0.9, 1.1])))
+    return normalize(excerpt[:int(seconds * sr)])
+
+
+def percentiles(values: List[float]) -> Dict[str, float]:
+    if not values:
+        return {}
+    values = np.asarray(values) * 1000
+    return {
+        'p50_ms': float(np.percentile(values, 50)),
+        'p95_ms': float(np.percentile(values, 95)),
+        'p99_ms': float(np.percentile(values, 99)),
+        'mean_ms': float(values.mean()),
+    }
+
+
+def accuracy(hits: List[Tuple[bool, bool]]) -> Dict[str, Any]:
+    return {
+        'queries': len(hits),
+        'top1': sum(top1 for top1, _ in hits) / len(hits) if hits else 0.0,
+        'top5': sum(top5 for _, top5 in hits) / len(hits) if hits else 0.0,
+    }
+
+
+def run_profile(profile: str, songs: List[Dict[str, Any]], queries: List[Dict[str, Any]], workdir: str,
+                min_similarity: float) -> Dict[str, Any]:
+    """Index the catalog with one extraction profile, then recognise every query file."""
+    recognizer = AudioRecognizer(temp_dir=os.path.join(workdir, 'tmp'), profile=profile)
+    index_dir = os.path.join(workdir, f'index-{profile}')
+    indexes = {kind: SegmentedIndex(os.path.join(index_dir, kind)) for kind in SEQUENCE_KINDS}
+
+    # The first extraction pays for librosa's JIT compilation; keep it out of the timings
+    recognizer.extract_features(songs[0]['audio'], songs[0]['sr'])
+
+    logger.info(f"[{profile}] Indexing {len(songs)} reference songs")
+    start = time.perf_counter()
+    items: Dict[str, List[Tuple[int, np.ndarray]]] = {kind: [] for kind in SEQUENCE_KINDS}
+    failed_songs = 0
+    for song in songs:
+        features = recognizer.extract_features(song['audio'], song['sr'])
+        if features is None:
+            failed_songs += 1
+            continue
+        for kind, extract in SEQUENCE_KINDS.items():
+            sequence = extract(features)
+            if sequence is not None:
+                items[kind].append((song['id'], sequence))
+    for kind, index in indexes.items():
+        index.add(items[kind])
+        index.refresh()
+    index_seconds = time.perf_counter() - start
+
+    logger.info(f"[{profile}] Recognising {len(queries)} queries")
+    timings: Dict[str, List[float]] = {stage: [] for stage in STAGES}
+    hits: Dict[str, List[Tuple[bool, bool]]] = {}
+    failures = 0
+    start = time.perf_counter()
+    for query in queries:
+        began = time.perf_counter()
+        audio, sr = recognizer.load_audio(query['path'])
+        decoded = time.perf_counter()
+        features = recognizer.extract_features(audio, sr) if audio is not None else None
+        extracted = time.perf_counter()
+        ranked = []
+        if features is not None:
+            ranked, _ = rank_matches(indexes, features, 5, min_similarity)
+        else:
+            failures += 1
+        finished = time.perf_counter()
+
+        timings['decode'].append(decoded - began)
+        timings['features'].append(extracted - decoded)
+        timings['match'].append(finished - extracted)
+        timings['total'].append(finished - began)
+        song_ids = [song_id for _, song_id in ranked]
+        hit = (song_ids[:1] == [query['song_id']], query['song_id'] in song_ids)
+        for group in ('overall', f"transform:{query['transform']}", f"source:{query['source']}"):
+            hits.setdefault(group, []).append(hit)
+    elapsed = time.perf_counter() - start
+
+    return {
+        'catalog': {
+            'songs': len(songs),
+            'failed': failed_songs,
+            'seconds': index_seconds,
+            'songs_per_second': len(songs) / index_seconds if index_seconds > 0 else 0.0,
+        },
+        'stages': {stage: percentiles(values) for stage, values in timings.items()},
+        'queries_per_second': len(queries) / elapsed if elapsed > 0 else 0.0,
+        'failed_queries': failures,
+        'accuracy': {group: accuracy(group_hits) for group, group_hits in sorted(hits.items())},
+    }
+
+
+def run_benchmark(profiles: List[str], n_songs: int, song_seconds: float, query_seconds: float,
+                  queries_per_transform: int, transforms: List[str], sr: int, seed: int = 0,
+                  audio_dir: Optional[str] = None, min_similarity: float = 0.5) -> Dict[str, Any]:
+    """Build one reference catalog and query set, then measure every profile against them."""
+    rng = np.random.default_rng(seed)
+    workdir = tempfile.mkdtemp(prefix='recognition-benchmark-')
+    try:
+        if audio_dir:
+            songs = load_catalog(audio_dir, AudioRecognizer(temp_dir=os.path.join(workdir, 'tmp')))
+        else:
+            logger.info(f"Generating {n_songs} synthetic songs of {song_seconds}s")
+            songs = generate_catalog(n_songs, song_seconds, sr, seed)
+        if not songs:
+            raise ValueError('No reference songs to benchmark against')
+
+        # Queries are written out so decoding is timed like an upload
+        queries = []
+        for transform in transforms:
+            for song in rng.choice(songs, size=min(queries_per_transform, len(songs)), replace=False):
+                path = os.path.join(workdir, f"query-{transform}-{song['id']}.wav")
+                sf.write(path, make_query(song, transform, query_seconds, rng), song['sr'])
+                queries.append({'path': path, 'song_id': song['id'], 'source': song['source'],
+                                'transform': transform})
+
+        results = {profile: run_profile(profile, songs, queries, workdir, min_similarity) for profile in profiles}
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    return {
+        'created_at': datetime.now().isoformat(),
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'numpy': np.__version__,
+        'librosa': librosa.__version__,
+        'config': {
+            'profiles': profiles,
+            'songs': len(songs),
+            'audio_dir': audio_dir,
+            'song_seconds': song_seconds,
+            'query_seconds': query_seconds,
+            'queries_per_transform': queries_per_transform,
+            'transforms': transforms,
+            'sample_rate': sr,
+            'min_similarity': min_similarity,
+            'seed': seed,
+        },
+        'profiles': results,
+    }
+
+
+def print_summary(report: Dict[str, Any]):
+    for profile, result in report['profiles'].items():
+        catalog = result['catalog']
+        print(f"\n{profile}: indexed {catalog['songs']} songs at {catalog['songs_per_second']:.1f} songs/s, "
+              f"{result['queries_per_second']:.2f} queries/s")
+        for stage in STAGES:
+            timing = result['stages'][stage]
+            if timing:
+                print(f"  {stage:<9} p50 {timing['p50_ms']:8.1f} ms  p95 {timing['p95_ms']:8.1f} ms  "
+                      f"p99 {timing['p99_ms']:8.1f} ms")
+        for group, scores in result['accuracy'].items():
+            print(f"  {group:<18} top-1 {scores['top1']:6.1%}  top-5 {scores['top5']:6.1%}  "
+                  f"({scores['queries']} queries)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark recognition latency and accuracy on synthetic audio.')
+    parser.add_argument('--profiles', default=DEFAULT_PROFILE,
+                        help=f"Comma-separated extraction profiles ({', '.join(EXTRACTION_PROFILES)})")
+    parser.add_argument('--songs', type=int, default=60, help='Synthetic reference songs')
+    parser.add_argument('--audio-dir', default=None, help='Use local audio files as the reference catalog instead')
+    parser.add_argument('--song-seconds', type=float, default=20.0)
+    parser.add_argument('--query-seconds', type=float, default=8.0,
+                        help='Query length; the recognizer rejects recordings under 7s')
+    parser.add_argument('--queries-per-transform', type=int, default=20)
+    parser.add_argument('--transforms', default=','.join(TRANSFORMS),
+                        help=f"Comma-separated query distortions ({', '.join(TRANSFORMS)})")
+    parser.add_argument('--sample-rate', type=int, default=22050)
+    parser.add_argument('--min-similarity', type=float, default=0.5)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='recognition_benchmark_results.json',
+                        help='Where to write the JSON report')
+    args = parser.parse_args()
+
+    profiles = [profile for profile in args.profiles.split(',') if profile]
+    transforms = [transform for transform in args.transforms.split(',') if transform]
+    unknown = [name for name in profiles if name not in EXTRACTION_PROFILES] + \
+              [name for name in transforms if name not in TRANSFORMS]
+    if unknown:
+        parser.error(f"Unknown profile or transform: {', '.join(unknown)}")
+
+    report = run_benchmark(profiles, args.songs, args.song_seconds, args.query_seconds,
+                           args.queries_per_transform, transforms, args.sample_rate, args.seed,
+                           args.audio_dir, args.min_similarity)
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print_summary(report)
+    print(f"\nResults written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,531 @@
+import argparse
+import gc
+import json
+import logging
+import os
+import platform
+import resource
+import statistics
+import tempfile
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+import catalog
+import matrix_factorization
+import recommender
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+GENRES = ['pop', 'rock', 'hip hop', 'jazz', 'classical', 'electronic', 'country',
+          'r&b', 'metal', 'folk', 'blues', 'reggae', 'latin', 'indie', 'soul']
+MOODS = ['happy', 'sad', 'energetic', 'calm', 'angry', 'romantic', 'dark', 'chill']
+WORDS = ['love', 'night', 'fire', 'heart', 'dream', 'rain', 'summer', 'dance',
+         'light', 'home', 'river', 'gold', 'ghost', 'city', 'sky', 'road', 'wild',
+         'blue', 'storm', 'echo', 'shadow', 'sun', 'moon', 'time', 'forever',
+         'broken', 'young', 'lost', 'electric', 'silver', 'ocean', 'paper']
+
+DEFAULT_SIZES = [10_000, 100_000, 1_000_000]
+MAX_SKIPS = 10_000_000
+
+# Share of synthetic skips from logged-out listeners (user_id NULL), which every user's
+# skip patterns include
+ANONYMOUS_SKIP_FRACTION = 0.2
+
+# Matrix factorization sweep: users x songs at this many interactions per user
+DEFAULT_MF_SIZES = [10_000, 100_000, 1_000_000]
+DEFAULT_MF_NNZ_PER_USER = 30
+
+
+def generate_catalog(n_songs: int, seed: int = 0) -> pd.DataFrame:
+    """Build a synthetic catalog with the same columns as recommender.get_songs_data()."""
+    rng = np.random.default_rng(seed)
+    words = np.array(WORDS, dtype=object)
+    n_artists = max(1, n_songs // 10)
+    n_albums = max(1, n_songs // 8)
+
+    title = words[rng.integers(0, len(words), n_songs)] + ' ' + words[rng.integers(0, len(words), n_songs)]
+    artist_ids = rng.integers(0, n_artists, n_songs)
+    album_ids = rng.integers(0, n_albums, n_songs)
+
+    df = pd.DataFrame({
+        'id': np.arange(1, n_songs + 1, dtype=np.int64),
+        'title': title,
+        'genre_name': np.array(GENRES, dtype=object)[rng.integers(0, len(GENRES), n_songs)],
+        'mood': np.array(MOODS, dtype=object)[rng.integers(0, len(MOODS), n_songs)],
+        'tempo': rng.normal(120, 25, n_songs).clip(50, 220),
+        'danceability': rng.random(n_songs),
+        'energy': rng.random(n_songs),
+        'valence': rng.random(n_songs),
+        'acousticness': rng.random(n_songs),
+        'instrumentalness': rng.beta(0.5, 2, n_songs),
+        'liveness': rng.beta(1, 5, n_songs),
+        'speechiness': rng.beta(1, 8, n_songs),
+        'artist_name': pd.Series(artist_ids).map('artist {}'.format).to_numpy(dtype=object),
+        'album_title': pd.Series(album_ids).map('album {}'.format).to_numpy(dtype=object),
+        'year': rng.integers(1960, 2025, n_songs),
+        # Heavy-tailed play counts, like a real catalog
+        'plays': rng.zipf(1.6, n_songs).clip(max=10_000_000),
+        'image_url': None,
+        'audio_url': None,
+        'created_at': pd.Timestamp(datetime.now()) - pd.to_timedelta(rng.integers(0, 3 * 365, n_songs), unit='D'),
+    })
+    return df
+
+
+def generate_skips(song_ids: np.ndarray, n_skips: int, n_users: Optional[int] = None,
+                   seed: int = 0, anonymous_fraction: float = ANONYMOUS_SKIP_FRACTION) -> pd.DataFrame:
+    """Build a synthetic skip_history table. Popular songs collect most of the skips.
+
+    user_id is float with NaN for anonymous skips, as a frame read from Postgres has it.
+    """
+    rng = np.random.default_rng(seed + 1)
+    n_users = n_users or max(1, len(song_ids) // 5)
+
+    # Zipf-distributed song choice so skip counts are skewed like real traffic
+    ranks = rng.zipf(1.3, n_skips) - 1
+    song_idx = ranks % len(song_ids)
+    skip_time = rng.integers(1, 240, n_skips)
+    skip_type = np.where(skip_time < 30, 'quick', np.where(skip_time < 120, 'mid', 'late'))
+
+    return pd.DataFrame({
+        'song_id': song_ids[song_idx],
+        'skip_type': skip_type.astype(object),
+        'skip_time': skip_time,
+        'created_at': pd.Timestamp(datetime.now()) - pd.to_timedelta(rng.integers(0, 180 * 24 * 3600, n_skips), unit='s'),
+        'user_id': np.where(rng.random(n_skips) < anonymous_fraction, np.nan,
+                            rng.integers(1, n_users + 1, n_skips)),
+    })
+
+
+def generate_history(song_ids: np.ndarray, n_events: int, n_users: Optional[int] = None,
+                     seed: int = 0) -> pd.DataFrame:
+    """Build synthetic plays and likes in the (user_id, song_id, event, timestamp) shape of
+    user_profiles.load_history_events()."""
+    rng = np.random.default_rng(seed + 2)
+    n_users = n_users or max(1, len(song_ids) // 5)
+    ranks = rng.zipf(1.3, n_events) - 1
+    return pd.DataFrame({
+        'user_id': rng.integers(1, n_users + 1, n_events),
+        'song_id': song_ids[ranks % len(song_ids)],
+        # About one like for every nine plays
+        'event': np.where(rng.random(n_events) < 0.1, 'like', 'play').astype(object),
+        'timestamp': time.time() - rng.integers(0, 180 * 24 * 3600, n_events).astype(np.float64),
+    })
+
+
+class InMemoryDataProvider:
+    """Serves a synthetic catalog, skip table and listening history to the recommender in place of Postgres."""
+
+    def __init__(self, songs: pd.DataFrame, skips: pd.DataFrame, history: Optional[pd.DataFrame] = None):
+        self.songs = songs
+        self.skips = skips
+        self.history = history if history is not None else generate_history(songs['id'].to_numpy(), len(skips))
+        self.arrays = catalog.arrays_from_frame(songs[catalog.SCORING_COLUMNS])
+        self.display = songs.set_index('id', drop=False)[catalog.DISPLAY_COLUMNS]
+
+    def get_catalog_arrays(self) -> catalog.CatalogArrays:
+        return self.arrays
+
+    def get_display_fields(self, song_ids) -> List[Dict[str, Any]]:
+        rows = self.display.loc[list(song_ids)].copy()
+        rows['created_at'] = rows['created_at'].map(lambda value: value.isoformat())
+        return rows.to_dict('records')
+
+    def get_skip_patterns(self, user_id=None) -> pd.DataFrame:
+        # Same rows as recommender.SKIP_PATTERNS_QUERY: WHERE user_id = $1 OR user_id IS NULL
+        mask = self.skips['user_id'].isna()
+        if user_id is not None:
+            mask |= self.skips['user_id'] == user_id
+        return self.skips.loc[mask, ['song_id', 'skip_type', 'skip_time', 'created_at']].copy()
+
+    def get_skip_history(self) -> pd.DataFrame:
+        history = self.skips[['user_id', 'song_id', 'skip_type']].copy()
+        history['timestamp'] = self.skips['created_at'].astype('datetime64[s]').astype(np.int64).astype(np.float64)
+        return history
+
+    def get_history_events(self) -> pd.DataFrame:
+        return self.history.copy()
+
+
+def measure(fn: Callable[[], Any], repeats: int, track_memory: bool = True) -> Dict[str, Any]:
+    """Time fn() `repeats` times, then run it once more under tracemalloc for peak memory."""
+    timings = []
+    for _ in range(repeats):
+        gc.collect()
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+
+    result = {
+        'seconds_min': min(timings),
+        'seconds_median': statistics.median(timings),
+        'seconds_max': max(timings),
+        'repeats': repeats,
+    }
+
+    if track_memory:
+        gc.collect()
+        tracemalloc.start()
+        try:
+            fn()
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        result['peak_memory_mb'] = peak / (1024 * 1024)
+
+    return result
+
+
+def build_cases(songs: pd.DataFrame, skips: pd.DataFrame, rng: np.random.Generator,
+                collaborative_calls: int) -> Dict[str, Callable[[], Any]]:
+    """Set up the callables to benchmark for one catalog size."""
+    seed_song_id = int(songs['id'].iloc[rng.integers(0, len(songs))])
+    query = f"{WORDS[rng.integers(0, len(WORDS))]} {GENRES[rng.integers(0, len(GENRES))]}"
+
+    # calculate_content_score works on prepared features, so prepare them once outside the timer
+    prepared = recommender.create_song_features(recommender.normalize_audio_features(songs.copy()))
+    target_song = prepared[prepared['id'] == seed_song_id].iloc[0]
+    candidates = prepared[prepared['id'] != seed_song_id]
+
+    skip_patterns = skips[['song_id', 'skip_type', 'skip_time', 'created_at']]
+    sample_ids = songs['id'].to_numpy()[rng.integers(0, len(songs), collaborative_calls)]
+
+    def collaborative():
+        for song_id in sample_ids:
+            recommender.calculate_collaborative_score(song_id, skip_patterns)
+
+    def cold_seed():
+        recommender.refresh_catalog()
+        return recommender.get_hybrid_recommendations(song_id=seed_song_id, num_recommendations=10)
+
+    return {
+        'get_hybrid_recommendations[seed,cold]': cold_seed,
+        'get_hybrid_recommendations[seed]': lambda: recommender.get_hybrid_recommendations(
+            song_id=seed_song_id, num_recommendations=10),
+        'get_hybrid_recommendations[initial]': lambda: recommender.get_hybrid_recommendations(
+            num_recommendations=10),
+        'search_songs': lambda: recommender.search_songs(query),
+        'calculate_content_score': lambda: recommender.calculate_content_score(target_song, candidates),
+        f'calculate_collaborative_score[x{collaborative_calls}]': collaborative,
+    }
+
+
+def scaling_exponent(points: List[Dict[str, Any]]) -> Optional[float]:
+    """Least-squares slope of log(seconds) against log(n_songs); 1.0 means linear."""
+    measured = [p for p in points if 'seconds_median' in p and p['seconds_median'] > 0]
+    if len(measured) < 2:
+        return None
+    x = np.log([p['n_songs'] for p in measured])
+    y = np.log([p['seconds_median'] for p in measured])
+    return float(np.polyfit(x, y, 1)[0])
+
+
+def run_benchmarks(sizes: List[int], skips: List[int], repeats: int = 3, seed: int = 0,
+                   collaborative_calls: int = 100, max_case_seconds: float = 60.0,
+                   track_memory: bool = True) -> Dict[str, Any]:
+    """Run every case at every size, smallest first.
+
+    A case whose median run exceeded `max_case_seconds` is not run at larger sizes, so
+    the quadratic paths don't stall a 1M-song sweep; those entries are marked skipped.
+    """
+    rng = np.random.default_rng(seed)
+    curves: Dict[str, List[Dict[str, Any]]] = {}
+    over_budget = set()
+    memory: List[Dict[str, Any]] = []
+
+    try:
+        for n_songs, n_skips in zip(sizes, skips):
+            logger.info(f"Generating catalog with {n_songs} songs and {n_skips} skips")
+            start = time.perf_counter()
+            songs = generate_catalog(n_songs, seed)
+            skip_table = generate_skips(songs['id'].to_numpy(), n_skips, seed=seed)
+            logger.info(f"Synthetic data ready in {time.perf_counter() - start:.2f}s")
+
+            recommender.set_data_provider(InMemoryDataProvider(songs, skip_table))
+            cases = build_cases(songs, skip_table, rng, collaborative_calls)
+
+            # Resident size of the compact catalog against the prepared pandas frame it replaces
+            prepared = recommender.create_song_features(recommender.normalize_audio_features(recommender.get_songs_data()))
+            memory.append({
+                'n_songs': n_songs,
+                'compact_catalog_mb': recommender.get_catalog().nbytes() / (1024 * 1024),
+                'dataframe_mb': prepared.memory_usage(deep=True).sum() / (1024 * 1024),
+            })
+            del prepared
+
+            for name, fn in cases.items():
+                point = {'n_songs': n_songs, 'n_skips': n_skips}
+                if name in over_budget:
+                    point['skipped'] = f'over {max_case_seconds}s budget at a smaller size'
+                else:
+                    logger.info(f"Running {name} at n_songs={n_songs}")
+                    try:
+                        point.update(measure(fn, repeats, track_memory))
+                        if point['seconds_median'] > max_case_seconds:
+                            over_budget.add(name)
+                    except Exception as e:
+                        logger.error(f"{name} failed at n_songs={n_songs}: {str(e)}")
+                        point['error'] = str(e)
+                curves.setdefault(name, []).append(point)
+
+            del songs, skip_table, cases
+            gc.collect()
+    finally:
+        recommender.set_data_provider(None)
+
+    return {
+        'created_at': datetime.now().isoformat(),
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'config': {
+            'sizes': sizes,
+            'skips': skips,
+            'repeats': repeats,
+            'seed': seed,
+            'collaborative_calls': collaborative_calls,
+            'max_case_seconds': max_case_seconds,
+        },
+        'catalog_memory': memory,
+        'results': {
+            name: {'points': points, 'scaling_exponent': scaling_exponent(points)}
+            for name, points in curves.items()
+        },
+    }
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def run_mf_benchmarks(sizes: List[int], nnz_per_user: int = DEFAULT_MF_NNZ_PER_USER,
+                      factors: int = 64, iterations: int = 3, threads: Optional[int] = None,
+                      seed: int = 0) -> Dict[str, Any]:
+    """Time implicit-ALS training, saving and scoring on square users x songs matrices.
+
+    Peak memory is the process's resident high-water mark after each size, so it
+    only grows across the sweep; run one size per process for exact per-size figures.
+    """
+    points = []
+    for n in sizes:
+        logger.info(f"Generating {n} x {n} interaction matrix with {nnz_per_user} interactions per user")
+        start = time.perf_counter()
+        matrix = matrix_factorization.synthetic_matrix(n, n, nnz_per_user, seed)
+        point = {'n_users': n, 'n_songs': n, 'nnz': int(matrix.nnz),
+                 'generate_seconds': time.perf_counter() - start}
+
+        model = matrix_factorization.ImplicitALS(factors=factors, iterations=iterations,
+                                                 threads=threads, seed=seed)
+        start = time.perf_counter()
+        model.fit(matrix)
+        point['train_seconds'] = time.perf_counter() - start
+        point['seconds_per_iteration'] = point['train_seconds'] / max(iterations, 1)
+
+        with tempfile.TemporaryDirectory() as directory:
+            store = matrix_factorization.FactorStore(directory)
+            ids = np.arange(n, dtype=np.int64)
+            start = time.perf_counter()
+            store.save(model.user_factors, model.item_factors, ids, ids, {'factors': factors})
+            point['save_seconds'] = time.perf_counter() - start
+
+            start = time.perf_counter()
+            loaded = store.load()
+            rows = loaded.item_rows(ids)
+            point['load_seconds'] = time.perf_counter() - start
+
+            users = np.random.default_rng(seed).integers(0, n, 20)
+            timings = []
+            for user in users:
+                start = time.perf_counter()
+                loaded.scores(user, rows)
+                timings.append(time.perf_counter() - start)
+            point['score_seconds_median'] = statistics.median(timings)
+            del loaded, rows
+
+        point['factor_mb'] = (model.user_factors.nbytes + model.item_factors.nbytes) / (1024 * 1024)
+        point['peak_rss_mb'] = peak_rss_mb()
+        points.append(point)
+        del matrix, model
+        gc.collect()
+
+    return {
+        'created_at': datetime.now().isoformat(),
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'numpy': np.__version__,
+        'cpus': os.cpu_count(),
+        'config': {
+            'sizes': sizes,
+            'nnz_per_user': nnz_per_user,
+            'factors': factors,
+            'iterations': iterations,
+            'threads': threads,
+            'seed': seed,
+        },
+        'matrix_factorization': points,
+    }
+
+
+def print_mf_summary(report: Dict[str, Any]):
+    for point in report['matrix_factorization']:
+        print(f"{point['n_users']:>10} users x {point['n_songs']:>10} songs {point['nnz']:>12} nnz  "
+              f"train {point['train_seconds']:8.1f} s ({point['seconds_per_iteration']:.1f} s/iter)  "
+              f"score {point['score_seconds_median'] * 1000:7.1f} ms  "
+              f"factors {point['factor_mb']:8.1f} MB  peak RSS {point['peak_rss_mb']:8.1f} MB")
+
+
+def run_sharded_benchmarks(sizes: List[int], workers: List[int], batch_size: int = 32,
+                           repeats: int = 3, seed: int = 0) -> Dict[str, Any]:
+    """Seed-query latency and batch throughput for each worker count.
+
+    One worker is the in-process path; more run ShardedScorer over shared memory.
+    """
+    rng = np.random.default_rng(seed)
+    points = []
+    try:
+        for n_songs in sizes:
+            songs = generate_catalog(n_songs, seed)
+            skip_table = generate_skips(songs['id'].to_numpy(), min(10 * n_songs, MAX_SKIPS), seed=seed)
+            recommender.set_data_provider(InMemoryDataProvider(songs, skip_table))
+            song_ids = [int(song_id) for song_id in rng.choice(songs['id'].to_numpy(), batch_size)]
+            for n_workers in workers:
+                recommender.close_sharded_scorer()
+                recommender.RECOMMENDER_WORKERS = n_workers
+                # First call builds the catalog and, for n_workers > 1, the shared memory and pool
+                recommender.get_hybrid_recommendations(song_id=song_ids[0])
+                logger.info(f"Running sharded scoring at n_songs={n_songs} with {n_workers} workers")
+                single = measure(lambda: recommender.get_hybrid_recommendations(song_id=song_ids[0]),
+                                 repeats, track_memory=False)
+                batch = measure(lambda: recommender.get_batch_recommendations(song_ids), repeats,
+                                track_memory=False)
+                points.append({
+                    'n_songs': n_songs,
+                    'workers': n_workers,
+                    'single_seconds_median': single['seconds_median'],
+                    'batch_seconds_median': batch['seconds_median'],
+                    'batch_queries_per_second': batch_size / batch['seconds_median'],
+                })
+            del songs, skip_table
+            gc.collect()
+    finally:
+        recommender.close_sharded_scorer()
+        recommender.RECOMMENDER_WORKERS = 1
+        recommender.set_data_provider(None)
+
+    return {
+        'created_at': datetime.now().isoformat(),
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'config': {'sizes': sizes, 'workers': workers, 'batch_size': batch_size,
+                   'repeats': repeats, 'seed': seed},
+        'sharded': points,
+    }
+
+
+def print_sharded_summary(report: Dict[str, Any]):
+    for point in report['sharded']:
+        print(f"{point['n_songs']:>10} songs {point['workers']:>3} workers  "
+              f"single {point['single_seconds_median'] * 1000:8.1f} ms  "
+              f"batch {point['batch_queries_per_second']:8.1f} queries/s")
+
+
+def print_summary(report: Dict[str, Any]):
+    for point in report.get('catalog_memory', []):
+        print(f"catalog at {point['n_songs']:>10} songs: compact {point['compact_catalog_mb']:8.1f} MB, "
+              f"pandas {point['dataframe_mb']:8.1f} MB")
+    for name, result in report['results'].items():
+        exponent = result['scaling_exponent']
+        print(f"\n{name}  (scaling exponent: {'n/a' if exponent is None else f'{exponent:.2f}'})")
+        for point in result['points']:
+            if 'seconds_median' in point:
+                memory = point.get('peak_memory_mb')
+                memory_text = f"  peak {memory:8.1f} MB" if memory is not None else ''
+                print(f"  {point['n_songs']:>10} songs {point['n_skips']:>10} skips  "
+                      f"{point['seconds_median'] * 1000:10.1f} ms{memory_text}")
+            else:
+                print(f"  {point['n_songs']:>10} songs  {point.get('skipped') or point.get('error')}")
+
+
+def parse_int_list(value: str) -> List[int]:
+    return [int(float(v)) for v in value.split(',') if v]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the recommender against synthetic catalogs.')
+    parser.add_argument('--sizes', type=parse_int_list, default=DEFAULT_SIZES,
+                        help='Comma-separated catalog sizes (default: 10000,100000,1000000)')
+    parser.add_argument('--skips', type=parse_int_list, default=None,
+                        help='Comma-separated skip_history sizes, one per catalog size '
+                             f'(default: 10 per song, capped at {MAX_SKIPS})')
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--collaborative-calls', type=int, default=100,
+                        help='calculate_collaborative_score calls timed per size')
+    parser.add_argument('--max-case-seconds', type=float, default=60.0,
+                        help='Stop growing a case once one run takes longer than this')
+    parser.add_argument('--no-memory', action='store_true', help='Skip the tracemalloc peak-memory pass')
+    parser.add_argument('--output', default='benchmark_results.json', help='Where to write the JSON report')
+    parser.add_argument('--sharded', action='store_true',
+                        help='Benchmark multi-process sharded scoring across --workers counts')
+    parser.add_argument('--workers', type=parse_int_list, default=[1, 2, 4],
+                        help='Comma-separated worker counts for --sharded (default: 1,2,4)')
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--mf', action='store_true',
+                        help='Benchmark implicit-ALS training instead of the recommendation paths')
+    parser.add_argument('--mf-sizes', type=parse_int_list, default=DEFAULT_MF_SIZES,
+                        help='Comma-separated user (and song) counts for --mf (default: 10000,100000,1000000)')
+    parser.add_argument('--mf-nnz-per-user', type=int, default=DEFAULT_MF_NNZ_PER_USER)
+    parser.add_argument('--mf-factors', type=int, default=64)
+    parser.add_argument('--mf-iterations', type=int, default=3)
+    parser.add_argument('--mf-threads', type=int, default=None)
+    args = parser.parse_args()
+
+    if args.sharded:
+        report = run_sharded_benchmarks(args.sizes, args.workers, args.batch_size, args.repeats, args.seed)
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print_sharded_summary(report)
+        print(f"\nResults written to {args.output}")
+        return
+
+    if args.mf:
+        report = run_mf_benchmarks(args.mf_sizes, args.mf_nnz_per_user, args.mf_factors,
+                                   args.mf_iterations, args.mf_threads, args.seed)
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print_mf_summary(report)
+        print(f"\nResults written to {args.output}")
+        return
+
+    skips = args.skips or [min(10 * n, MAX_SKIPS) for n in args.sizes]
+    if len(skips) != len(args.sizes):
+        parser.error('--skips must have one entry per --sizes entry')
+
+    report = run_benchmarks(args.sizes, skips, repeats=args.repeats, seed=args.seed,
+                            collaborative_calls=args.collaborative_calls,
+                            max_case_seconds=args.max_case_seconds,
+                            track_memory=not args.no_memory)
+
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print_summary(report)
+    print(f"\nResults written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
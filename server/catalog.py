@@ -0,0 +1,485 @@
+from __future__ import annotations
+
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Sequence
+
+import numpy as np
+
+import db_pool
+from feature_stats import FeatureStats
+from prefix_index import PrefixIndex
+from startup import lazy_module
+from versioned_store import VersionedArrayStore
+
+# Only needed to build a catalog from the database; a saved catalog loads without them
+pd = lazy_module('pandas')
+sparse = lazy_module('scipy.sparse')
+sklearn_text = lazy_module('sklearn.feature_extraction.text')
+
+AUDIO_FEATURES = ['tempo', 'danceability', 'energy', 'valence',
+                  'acousticness', 'instrumentalness', 'liveness', 'speechiness']
+
+# Only the columns the scoring needs. Display fields are fetched for the final
+# top-k ids by fetch_display_fields().
+SCORING_QUERY = """
+SELECT
+    s.id,
+    s.title,
+    g.name,
+    a.name,
+    s.mood,
+    s.tempo,
+    s.danceability,
+    s.energy,
+    s.valence,
+    s.acousticness,
+    s.instrumentalness,
+    s.liveness,
+    s.speechiness,
+    COALESCE(s.plays, 0),
+    EXTRACT(EPOCH FROM s.created_at)
+FROM songs s
+LEFT JOIN artists a ON s.artist_id = a.id
+LEFT JOIN genres g ON s.genre_id = g.id
+ORDER BY s.id
+"""
+
+SCORING_COLUMNS = ['id', 'title', 'genre_name', 'artist_name', 'mood',
+                   *AUDIO_FEATURES, 'plays', 'created_at']
+
+SCORING_DTYPES = {
+    'id': np.int64,
+    'title': object,
+    'genre_name': 'category',
+    'artist_name': 'category',
+    'mood': 'category',
+    **{feature: np.float32 for feature in AUDIO_FEATURES},
+    'plays': np.int64,
+    'created_at': np.float64,
+}
+
+DISPLAY_QUERY = """
+SELECT
+    s.id,
+    s.title,
+    g.name as genre_name,
+    s.mood,
+    a.name as artist_name,
+    al.title as album_title,
+    s.year,
+    s.plays,
+    s.image_url,
+    s.audio_url,
+    s.created_at
+FROM songs s
+LEFT JOIN artists a ON s.artist_id = a.id
+LEFT JOIN albums al ON s.album_id = al.id
+LEFT JOIN genres g ON s.genre_id = g.id
+WHERE s.id = ANY($1)
+"""
+
+DISPLAY_COLUMNS = ['id', 'title', 'genre_name', 'mood', 'artist_name', 'album_title',
+                   'year', 'plays', 'image_url', 'audio_url', 'created_at']
+
+# Cheap check that a saved catalog still has the same songs
+SIGNATURE_QUERY = "SELECT COUNT(*), COALESCE(MAX(id), 0) FROM songs"
+
+# Arrays CompactCatalog.save() writes and load() memory-maps
+SAVED_ARRAYS = ('ids', 'genre_codes', 'artist_codes', 'mood_codes', 'plays', 'created_days',
+                'features', 'feature_norms', 'feature_mean', 'feature_std')
+
+
+class CatalogArrays(NamedTuple):
+    """Column-oriented scoring data for the whole catalog, one row per song."""
+    ids: np.ndarray           # int64
+    titles: np.ndarray        # object, only used to build text features
+    features: np.ndarray      # float32, (n_songs, len(AUDIO_FEATURES)), NaN where missing
+    plays: np.ndarray         # int64
+    created_at: np.ndarray    # datetime64[s], NaT where missing
+    genre_codes: np.ndarray   # int32 index into genres, -1 where missing
+    artist_codes: np.ndarray  # int32 index into artists, -1 where missing
+    mood_codes: np.ndarray    # int32 index into moods, -1 where missing
+    genres: List[str]
+    artists: List[str]
+    moods: List[str]
+
+    def __len__(self):
+        return len(self.ids)
+
+
+def _copy_to_frame(conn, query: str, names: List[str], dtype: Dict[str, Any]) -> pd.DataFrame:
+    """Stream `COPY (query) TO STDOUT` straight into pandas' C CSV parser.
+
+    The COPY runs on a helper thread writing into a pipe, so parsing overlaps the
+    transfer and the raw CSV is never held in memory as a whole.
+    """
+    read_fd, write_fd = os.pipe()
+    reader = os.fdopen(read_fd, 'rb')
+    writer = os.fdopen(write_fd, 'wb')
+    errors = []
+
+    def produce():
+        try:
+            with conn.cursor() as cursor:
+                cursor.copy_expert(f"COPY ({query}) TO STDOUT WITH (FORMAT csv)", writer)
+        except Exception as e:
+            errors.append(e)
+        finally:
+            writer.close()
+
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+    try:
+        df = pd.read_csv(reader, names=names, dtype=dtype, header=None, engine='c')
+    finally:
+        # Closing the read end unblocks the producer if parsing stopped early
+        reader.close()
+        producer.join()
+
+    if errors:
+        raise errors[0]
+    return df
+
+
+def _codes(column: pd.Series):
+    return column.cat.codes.to_numpy(dtype=np.int32), [str(c) for c in column.cat.categories]
+
+
+def arrays_from_frame(df: pd.DataFrame) -> CatalogArrays:
+    """Convert a frame with SCORING_COLUMNS into CatalogArrays."""
+    df = df.sort_values('id', kind='stable')
+    categorical = {c: df[c].astype('category') for c in ('genre_name', 'artist_name', 'mood')}
+    genre_codes, genres = _codes(categorical['genre_name'])
+    artist_codes, artists = _codes(categorical['artist_name'])
+    mood_codes, moods = _codes(categorical['mood'])
+
+    created_at = df['created_at']
+    if not pd.api.types.is_datetime64_any_dtype(created_at):
+        created_at = pd.to_datetime(created_at, unit='s')
+
+    return CatalogArrays(
+        ids=df['id'].to_numpy(dtype=np.int64),
+        titles=df['title'].to_numpy(dtype=object),
+        features=np.ascontiguousarray(df[AUDIO_FEATURES].to_numpy(dtype=np.float32)),
+        plays=df['plays'].fillna(0).to_numpy(dtype=np.int64),
+        created_at=created_at.to_numpy(dtype='datetime64[s]'),
+        genre_codes=genre_codes,
+        artist_codes=artist_codes,
+        mood_codes=mood_codes,
+        genres=genres,
+        artists=artists,
+        moods=moods,
+    )
+
+
+def load_catalog_arrays(conn) -> CatalogArrays:
+    """Bulk-load the scoring columns for every song via COPY."""
+    df = _copy_to_frame(conn, SCORING_QUERY, SCORING_COLUMNS, SCORING_DTYPES)
+    return arrays_from_frame(df)
+
+
+def arrays_to_frame(arrays: CatalogArrays) -> pd.DataFrame:
+    """Build the scoring DataFrame the recommender's pandas code expects."""
+    def decode(codes, categories):
+        values = np.asarray(categories + [None], dtype=object)
+        return values[codes]  # -1 picks the trailing None
+
+    df = pd.DataFrame({
+        'id': arrays.ids,
+        'title': arrays.titles,
+        'genre_name': decode(arrays.genre_codes, arrays.genres),
+        'artist_name': decode(arrays.artist_codes, arrays.artists),
+        'mood': decode(arrays.mood_codes, arrays.moods),
+        'plays': arrays.plays,
+        'created_at': arrays.created_at,
+    })
+    for i, feature in enumerate(AUDIO_FEATURES):
+        df[feature] = arrays.features[:, i]
+    return df
+
+
+def _jsonable(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+def fetch_display_fields(conn, song_ids: Sequence[int]) -> List[Dict[str, Any]]:
+    """Fetch display rows for `song_ids`, returned in the same order as the ids."""
+    song_ids = [int(song_id) for song_id in song_ids]
+    if not song_ids:
+        return []
+
+    with conn.cursor() as cursor:
+        db_pool.execute_prepared(cursor, 'song_display', DISPLAY_QUERY, (song_ids,))
+        rows = {row[0]: row for row in cursor.fetchall()}
+
+    return [
+        {column: _jsonable(value) for column, value in zip(DISPLAY_COLUMNS, rows[song_id])}
+        for song_id in song_ids if song_id in rows
+    ]
+
+
+def catalog_signature(conn) -> List[int]:
+    """Song count and highest id, as stored in CompactCatalog.signature."""
+    with conn.cursor() as cursor:
+        cursor.execute(SIGNATURE_QUERY)
+        count, max_id = cursor.fetchone()
+    return [int(count), int(max_id)]
+
+
+class DisplayStore:
+    """Display rows (titles, urls, album, ...) fetched on demand and kept in a bounded LRU.
+
+    Scoring never touches these strings, so they stay out of the catalog arrays and
+    are only loaded for the ids that actually get returned.
+    """
+
+    def __init__(self, fetch: Callable[[Sequence[int]], List[Dict[str, Any]]], max_rows: int = 10000):
+        self._fetch = fetch
+        self._max_rows = max_rows
+        self._rows: 'OrderedDict[int, Dict[str, Any]]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def records(self, song_ids: Sequence[int]) -> List[Dict[str, Any]]:
+        song_ids = [int(song_id) for song_id in song_ids]
+        with self._lock:
+            missing = [song_id for song_id in song_ids if song_id not in self._rows]
+        fetched = {row['id']: row for row in self._fetch(missing)} if missing else {}
+
+        with self._lock:
+            self._rows.update(fetched)
+            result = []
+            for song_id in song_ids:
+                row = self._rows.get(song_id)
+                if row is not None:
+                    self._rows.move_to_end(song_id)
+                    result.append(dict(row))
+            while len(self._rows) > self._max_rows:
+                self._rows.popitem(last=False)
+        return result
+
+
+def catalog_version(loaded_at: float) -> str:
+    """Sortable id for one catalog build, e.g. to tie cached rankings to it."""
+    stamp = time.strftime('%Y%m%d%H%M%S', time.localtime(loaded_at))
+    return f'{stamp}.{int(loaded_at % 1 * 1e6):06d}-{os.getpid()}'
+
+
+class CompactCatalog:
+    """Scoring-only view of the catalog: integer codes and contiguous float32 arrays.
+
+    Genre/artist/mood are interned into int32 codes, so equality similarities are
+    integer comparisons. The text features are kept only as a TF-IDF CSR matrix
+    built once per catalog; titles and other display strings live in `display`.
+
+    save() writes the arrays to disk and load() memory-maps them back, so a
+    short-lived process can score without re-reading and re-fitting the catalog.
+    """
+
+    def __init__(self, arrays: CatalogArrays, display: DisplayStore,
+                 feature_stats: Optional[FeatureStats] = None):
+        self.ids = arrays.ids.astype(np.int32)
+        self.genre_codes = arrays.genre_codes
+        self.artist_codes = arrays.artist_codes
+        self.mood_codes = arrays.mood_codes
+        self.genres = arrays.genres
+        self.artists = arrays.artists
+        self.moods = arrays.moods
+        self.plays = arrays.plays.astype(np.int32)
+        self.display = display
+        self.loaded_at = time.time()
+        self.version = catalog_version(self.loaded_at)
+        self.signature = [int(len(arrays.ids)), int(arrays.ids.max()) if len(arrays.ids) else 0]
+
+        # Days since epoch; missing dates count as the oldest song
+        created_days = arrays.created_at.astype('datetime64[D]').astype(np.int64)
+        missing_date = np.isnat(arrays.created_at)
+        oldest = created_days[~missing_date].min() if (~missing_date).any() else 0
+        self.created_days = np.where(missing_date, oldest, created_days).astype(np.int32)
+
+        # Standardised audio features (missing values -> 0 before scaling, as before).
+        # Persisted stats only need the songs added since they were last updated.
+        if feature_stats is None:
+            self.feature_stats = FeatureStats.from_values(arrays.features, arrays.ids)
+        else:
+            self.feature_stats = feature_stats.extended(arrays.ids, arrays.features)
+        self.feature_mean = self.feature_stats.mean.astype(np.float32)
+        self.feature_std = self.feature_stats.std.astype(np.float32)
+        self.features = np.ascontiguousarray(self.feature_stats.transform(arrays.features))
+        self.feature_norms = np.linalg.norm(self.features, axis=1).astype(np.float32)
+
+        self.vectorizer, self._text_matrix = build_text_matrix(arrays)
+        self._text_parts = None
+
+        # Titles are only available here, so the typeahead index is built with the catalog
+        titles = [title if isinstance(title, str) else '' for title in arrays.titles]
+        self.prefix_index = PrefixIndex.build(titles, self.plays, self.artist_codes, self.artists,
+                                              self.genre_codes, self.genres)
+
+    @classmethod
+    def from_arrays(cls, arrays: CatalogArrays,
+                    display_fetch: Callable[[Sequence[int]], List[Dict[str, Any]]],
+                    feature_stats: Optional[FeatureStats] = None) -> 'CompactCatalog':
+        return cls(arrays, DisplayStore(display_fetch), feature_stats)
+
+    @property
+    def text_matrix(self) -> sparse.csr_matrix:
+        # A loaded catalog wraps its mapped CSR arrays on first use, so commands
+        # that never touch text don't import scipy.sparse
+        if self._text_matrix is None:
+            data, indices, indptr, columns = self._text_parts
+            self._text_matrix = sparse.csr_matrix((data, indices, indptr), shape=(len(self.ids), columns))
+        return self._text_matrix
+
+    def save(self, directory: str) -> str:
+        """Write the scoring arrays as a VersionedArrayStore version named after the catalog version."""
+        arrays = {name: getattr(self, name) for name in SAVED_ARRAYS}
+        arrays['text_data'] = self.text_matrix.data
+        arrays['text_indices'] = self.text_matrix.indices
+        arrays['text_indptr'] = self.text_matrix.indptr
+        if self.vectorizer is not None:
+            arrays['idf'] = self.vectorizer.idf
+        for name, array in self.prefix_index.arrays().items():
+            arrays[f'prefix_{name}'] = array
+        return VersionedArrayStore(directory).save(arrays, {
+            'loaded_at': self.loaded_at,
+            'signature': self.signature,
+            'text_columns': int(self.text_matrix.shape[1]),
+            'terms': self.vectorizer.terms if self.vectorizer is not None else None,
+            'genres': self.genres,
+            'artists': self.artists,
+            'moods': self.moods,
+            'feature_stats': self.feature_stats.to_dict(),
+            'prefix_counts': self.prefix_index.counts,
+        }, self.version)
+
+    @classmethod
+    def load(cls, directory: str,
+             display_fetch: Callable[[Sequence[int]], List[Dict[str, Any]]]) -> Optional['CompactCatalog']:
+        """Memory-map the catalog saved in `directory`, or None if there is none.
+
+        `loaded_at` is when the saved catalog was built, so callers age it the
+        same way as one built in-process. Saves from before the typeahead
+        index count as missing, so the caller rebuilds them.
+        """
+        path = VersionedArrayStore(directory).current_path()
+        if path is None:
+            return None
+        with open(os.path.join(path, 'manifest.json')) as f:
+            manifest = json.load(f)
+        if 'prefix_counts' not in manifest:
+            return None
+
+        def mapped(name):
+            return np.load(os.path.join(path, f'{name}.npy'), mmap_mode='r')
+
+        cat = cls.__new__(cls)
+        for name in SAVED_ARRAYS:
+            setattr(cat, name, mapped(name))
+        cat.genres = manifest['genres']
+        cat.artists = manifest['artists']
+        cat.moods = manifest['moods']
+        cat.display = DisplayStore(display_fetch)
+        cat.loaded_at = manifest['loaded_at']
+        cat.version = manifest['version']
+        cat.signature = manifest['signature']
+        cat.feature_stats = FeatureStats.from_dict(manifest['feature_stats'])
+        terms = manifest['terms']
+        cat.vectorizer = QueryVectorizer(terms, mapped('idf')) if terms is not None else None
+        cat._text_matrix = None
+        cat._text_parts = (mapped('text_data'), mapped('text_indices'), mapped('text_indptr'),
+                           manifest['text_columns'])
+        cat.prefix_index = PrefixIndex(
+            mapped('prefix_keys'), mapped('prefix_key_suggestions'), mapped('prefix_popularity'),
+            mapped('prefix_label_data'), mapped('prefix_label_offsets'), manifest['prefix_counts'],
+            mapped('prefix_prefixes'), mapped('prefix_prefix_top'))
+        return cat
+
+    def __len__(self):
+        return len(self.ids)
+
+    def positions(self, song_ids) -> np.ndarray:
+        """Row positions for `song_ids`, -1 for ids not in the catalog."""
+        song_ids = np.asarray(song_ids, dtype=np.int64)
+        if len(self.ids) == 0:
+            return np.full(song_ids.shape, -1, dtype=np.int64)
+        positions = np.minimum(np.searchsorted(self.ids, song_ids), len(self.ids) - 1)
+        return np.where(self.ids[positions] == song_ids, positions, -1)
+
+    def position(self, song_id) -> int:
+        return int(self.positions([int(song_id)])[0])
+
+    def nbytes(self) -> int:
+        """Approximate resident size of the scoring arrays (display rows excluded)."""
+        arrays = (self.ids, self.genre_codes, self.artist_codes, self.mood_codes, self.plays,
+                  self.created_days, self.features, self.feature_norms)
+        text = self.text_matrix.data.nbytes + self.text_matrix.indices.nbytes + self.text_matrix.indptr.nbytes
+        return sum(a.nbytes for a in arrays) + text
+
+
+# sklearn's default token pattern, applied after lowercasing
+TOKEN_PATTERN = re.compile(r'(?u)\b\w\w+\b')
+
+
+class QueryVectorizer:
+    """TF-IDF transform for search queries from a fitted vocabulary and idf weights.
+
+    Gives the same rows as the fitted TfidfVectorizer's transform() (lowercase,
+    default token pattern, raw counts times idf, L2 norm): stop words were never
+    added to the vocabulary, so dropping unknown tokens drops them too. Unlike
+    the fitted vectorizer it can be saved with the catalog and used without sklearn.
+    """
+
+    def __init__(self, terms: List[str], idf: np.ndarray):
+        self.terms = list(terms)
+        self.idf = np.asarray(idf, dtype=np.float32)
+        self.vocabulary = {term: column for column, term in enumerate(self.terms)}
+
+    @classmethod
+    def from_tfidf(cls, vectorizer) -> 'QueryVectorizer':
+        return cls(vectorizer.get_feature_names_out().tolist(), vectorizer.idf_)
+
+    def transform(self, texts: Sequence[str]) -> sparse.csr_matrix:
+        data, indices, indptr = [], [], [0]
+        for text in texts:
+            counts = {}
+            for token in TOKEN_PATTERN.findall(text.lower()):
+                column = self.vocabulary.get(token)
+                if column is not None:
+                    counts[column] = counts.get(column, 0) + 1
+            columns = sorted(counts)
+            weights = np.array([counts[column] for column in columns], dtype=np.float32) * self.idf[columns]
+            norm = np.linalg.norm(weights)
+            if norm > 0:
+                weights /= norm
+            data.extend(weights.tolist())
+            indices.extend(columns)
+            indptr.append(len(indices))
+        return sparse.csr_matrix((np.array(data, dtype=np.float32), np.array(indices, dtype=np.int32),
+                                  np.array(indptr, dtype=np.int32)), shape=(len(texts), len(self.terms)))
+
+
+def build_text_matrix(arrays: CatalogArrays):
+    """Fit TF-IDF over 'title artist genre mood' once and keep only the CSR matrix."""
+    def decode(codes, categories):
+        values = np.asarray(categories + [''], dtype=object)
+        return values[codes]
+
+    titles = pd.Series(arrays.titles, dtype=object).fillna('').to_numpy(dtype=object)
+    text = (titles + ' ' + decode(arrays.artist_codes, arrays.artists) + ' '
+            + decode(arrays.genre_codes, arrays.genres) + ' ' + decode(arrays.mood_codes, arrays.moods))
+
+    vectorizer = sklearn_text.TfidfVectorizer(stop_words='english', dtype=np.float32)
+    try:
+        matrix = vectorizer.fit_transform(text).tocsr()
+    except ValueError:
+        # Empty vocabulary (empty catalog or stop words only)
+        return None, sparse.csr_matrix((len(text), 0), dtype=np.float32)
+    return QueryVectorizer.from_tfidf(vectorizer), matrix
@@ -0,0 +1,92 @@
+import os
+import threading
+from contextlib import contextmanager
+
+import psycopg2
+import psycopg2.extensions
+from psycopg2 import pool
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+_connection_pool = None
+_pool_lock = threading.Lock()
+
+
+class PreparedConnection(psycopg2.extensions.connection):
+    """Connection that remembers which named statements it has already PREPAREd."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared = set()
+
+
+def get_connection_pool():
+    """Process-wide connection pool, created on first use."""
+    global _connection_pool
+    with _pool_lock:
+        if _connection_pool is None:
+            _connection_pool = pool.ThreadedConnectionPool(
+                minconn=1,
+                maxconn=int(os.getenv('DB_POOL_MAX', '10')),
+                dbname=os.getenv('DB_NAME'),
+                user=os.getenv('DB_USER'),
+                password=os.getenv('DB_PASSWORD'),
+                host=os.getenv('DB_HOST'),
+                port=os.getenv('DB_PORT'),
+                connection_factory=PreparedConnection
+            )
+    return _connection_pool
+
+
+def close_pool():
+    global _connection_pool
+    with _pool_lock:
+        if _connection_pool is not None:
+            _connection_pool.closeall()
+            _connection_pool = None
+
+
+@contextmanager
+def pooled_connection():
+    """Borrow a connection from the pool and always hand it back."""
+    connection_pool = get_connection_pool()
+    conn = connection_pool.getconn()
+    try:
+        yield conn
+        conn.commit()
+    except Exception:
+        if not conn.closed:
+            conn.rollback()
+        raise
+    finally:
+        connection_pool.putconn(conn, close=bool(conn.closed))
+
+
+def execute_prepared(cursor, name: str, statement: str, params: tuple = ()):
+    """Run a fixed query as a server-side prepared statement.
+
+    `statement` uses $1, $2, ... placeholders. It is PREPAREd once per pooled
+    connection and EXECUTEd afterwards, so Postgres skips parsing and planning.
+    Connections that don't track prepared statements just run it as a plain query.
+    """
+    prepared = getattr(cursor.connection, 'prepared', None)
+    if prepared is None:
+        cursor.execute(_inline_placeholders(statement, len(params)),
+                       {f'p{i}': value for i, value in enumerate(params, 1)})
+        return
+
+    if name not in prepared:
+        cursor.execute(f"PREPARE {name} AS {statement}")
+        prepared.add(name)
+
+    placeholders = ', '.join(['%s'] * len(params))
+    cursor.execute(f"EXECUTE {name} ({placeholders})" if params else f"EXECUTE {name}", params)
+
+
+def _inline_placeholders(statement: str, n_params: int) -> str:
+    # Highest index first so $1 doesn't clobber the front of $10
+    for i in range(n_params, 0, -1):
+        statement = statement.replace(f'${i}', f'%(p{i})s')
+    return statement
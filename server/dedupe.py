@@ -0,0 +1,317 @@
+from __future__ import annotations
+
+import argparse
+import json
+import logging
+import os
+import re
+import time
+import unicodedata
+from typing import Dict, Optional, Sequence
+
+import numpy as np
+
+from feature_stats import FeatureStats
+from startup import lazy_module
+from versioned_store import VersionedArrayStore, lookup_rows
+
+# Only needed to find clusters; serving memory-mapped cluster ids doesn't import them
+sparse = lazy_module('scipy.sparse')
+csgraph = lazy_module('scipy.sparse.csgraph')
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+# Bracketed qualifiers and " - ..." suffixes that mark another version of the same song
+BRACKETED = re.compile(r'[\(\[\{][^\)\]\}]*[\)\]\}]')
+VERSION_SUFFIX = re.compile(r'\s+-\s+.*\b(remaster(ed)?|live|version|edit|mix|mono|stereo|demo|acoustic|'
+                            r'official|audio|video|lyrics?|explicit|clean|re-?upload|hd|hq)\b.*$')
+FEATURING = re.compile(r'\s(feat|ft|featuring)\b.*$')
+ARTIST_SEPARATOR = re.compile(r'\s*(?:,|&|\+|/|\band\b|\bx\b|\bwith\b|\bvs\b)\s*')
+NON_WORD = re.compile(r'[^\w]+')
+
+# Title MinHash: bands x rows permutations; pairs agreeing on ~50% of their
+# shingles meet in at least one band.
+MINHASH_BANDS = 16
+MINHASH_ROWS = 4
+
+# Audio SimHash: random hyperplanes over the standardised features, one band of
+# AUDIO_BITS per title band. Eight audio features alone put unrelated songs in
+# the same buckets, so audio bands only ever bucket together with a title band.
+AUDIO_BITS = 8
+
+# A candidate pair is a duplicate when either holds:
+#  - titles agree (estimated Jaccard >= TITLE_THRESHOLD), same primary artist and
+#    the audio doesn't contradict it (cosine >= AUDIO_MIN, or no audio features)
+#  - audio is near-identical (cosine >= AUDIO_THRESHOLD) and the titles mostly
+#    agree (>= TITLE_MIN), e.g. a re-upload under another artist name
+TITLE_THRESHOLD = 0.8
+AUDIO_MIN = 0.5
+AUDIO_THRESHOLD = 0.98
+TITLE_MIN = 0.6
+
+# Songs compared per song and band: buckets bigger than this (a common title
+# like "Intro") only pair songs within this distance, which keeps the job linear
+MAX_BUCKET = 32
+
+# Candidate pairs verified at a time; bounds the (pairs x permutations) comparison
+CHUNK_PAIRS = 1 << 18
+
+# Shingles hashed per MinHash chunk; bounds the (shingles x permutations) scratch array
+CHUNK_SHINGLES = 1 << 17
+
+
+def normalize_title(title) -> str:
+    """Lower-case, accent-free title without version qualifiers or featured artists."""
+    text = str(title or '')
+    if not text.isascii():
+        text = unicodedata.normalize('NFKD', text)
+        text = ''.join(ch for ch in text if not unicodedata.combining(ch))
+    text = text.lower()
+    text = BRACKETED.sub(' ', text)
+    text = VERSION_SUFFIX.sub('', text)
+    text = FEATURING.sub('', ' ' + text)
+    return ' '.join(NON_WORD.sub(' ', text).split())
+
+
+def primary_artist(artist) -> str:
+    """Normalised first credited artist, without a leading "the"."""
+    name = normalize_title(artist)
+    name = ARTIST_SEPARATOR.split(name, maxsplit=1)[0]
+    return name[4:] if name.startswith('the ') else name
+
+
+def title_shingles(titles: Sequence[str]):
+    """Byte 3-grams of each padded title as uint32, plus each title's offset into them.
+
+    Titles are padded with a space on both sides, so every non-empty title has at
+    least one shingle; empty titles have none.
+    """
+    encoded = [f' {title} '.encode() if title else b'' for title in titles]
+    grams_per_title = np.array([max(len(data) - 2, 0) for data in encoded], dtype=np.int64)
+    offsets = np.concatenate([[0], np.cumsum(grams_per_title)])
+    data = np.frombuffer(b''.join(encoded), dtype=np.uint8).astype(np.uint32)
+    starts = np.concatenate([[0], np.cumsum([len(data) for data in encoded])])[:-1]
+    # Start of every 3-gram inside the concatenated bytes
+    gram_starts = np.repeat(starts, grams_per_title) + (
+        np.arange(offsets[-1]) - np.repeat(offsets[:-1], grams_per_title))
+    shingles = (data[gram_starts] << 16) | (data[gram_starts + 1] << 8) | data[gram_starts + 2]
+    return shingles, offsets
+
+
+def minhash_signatures(shingles: np.ndarray, offsets: np.ndarray, permutations: int,
+                       seed: int = 0) -> np.ndarray:
+    """(documents, permutations) uint32 MinHash signatures.
+
+    Each permutation is a multiply-shift hash (a * x + b) >> 32 over 64-bit
+    wrapping arithmetic. Documents without shingles get all-ones signatures and
+    must be masked out by the caller.
+    """
+    rng = np.random.default_rng(seed)
+    a = rng.integers(1, 1 << 63, size=permutations, dtype=np.uint64) | np.uint64(1)
+    b = rng.integers(0, 1 << 63, size=permutations, dtype=np.uint64)
+    documents = len(offsets) - 1
+    signatures = np.full((documents, permutations), np.iinfo(np.uint32).max, dtype=np.uint32)
+    nonempty = np.flatnonzero(offsets[1:] > offsets[:-1])
+    start = 0
+    while start < len(nonempty):
+        # Whole documents per chunk, about CHUNK_SHINGLES shingles each
+        limit = np.searchsorted(offsets[nonempty + 1], offsets[nonempty[start]] + CHUNK_SHINGLES, side='right')
+        end = max(int(limit), start + 1)
+        docs = nonempty[start:end]
+        low, high = offsets[docs[0]], offsets[docs[-1] + 1]
+        chunk = shingles[low:high].astype(np.uint64)
+        with np.errstate(over='ignore'):
+            # (permutations, shingles), so the per-document minimum runs along contiguous rows
+            hashed = ((a[:, None] * chunk + b[:, None]) >> np.uint64(32)).astype(np.uint32)
+        signatures[docs] = np.minimum.reduceat(hashed, offsets[docs] - low, axis=1).T
+        start = end
+    return signatures
+
+
+def band_keys(columns: np.ndarray) -> np.ndarray:
+    """One 64-bit FNV-style hash per row: equal rows get equal keys.
+
+    Unequal rows collide with negligible probability, and a collision only adds
+    a candidate pair that verification then rejects.
+    """
+    keys = np.full(len(columns), 0xcbf29ce484222325, dtype=np.uint64)
+    with np.errstate(over='ignore'):
+        for column in np.asarray(columns, dtype=np.int64).T:
+            keys = (keys ^ column.astype(np.uint64)) * np.uint64(0x100000001b3)
+    return keys
+
+
+def bucket_pairs(keys: np.ndarray, valid: np.ndarray, window: int = MAX_BUCKET) -> np.ndarray:
+    """(pairs, 2) rows sharing a key, each at most `window` apart in key order."""
+    order = np.argsort(keys, kind='stable')
+    order = order[valid[order]]
+    ordered_keys = keys[order]
+    pairs = []
+    for distance in range(1, window):
+        same = ordered_keys[distance:] == ordered_keys[:-distance]
+        if not same.any():
+            break
+        pairs.append(np.stack([order[:-distance][same], order[distance:][same]], axis=1))
+    return np.concatenate(pairs) if pairs else np.empty((0, 2), dtype=np.int64)
+
+
+def unit_rows(features: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(features, axis=1, keepdims=True)
+    return np.divide(features, norms, out=np.zeros_like(features), where=norms > 0)
+
+
+def find_duplicates(ids: np.ndarray, titles: Sequence[str], artists: Sequence[str],
+                    features: np.ndarray, seed: int = 0) -> Dict[str, np.ndarray]:
+    """Cluster re-uploads, remasters and live versions of the same song.
+
+    Candidate pairs come from two sets of LSH buckets over the MinHash bands of
+    the normalised titles: one keyed per primary artist, one keyed per audio
+    SimHash band. The work grows with the number of songs (times bands and
+    MAX_BUCKET), not with its square. Candidates are verified with the rules
+    above and clusters are the connected components of the verified pairs. A
+    song's cluster id is the smallest song id in its cluster, so songs without
+    duplicates are their own cluster.
+    """
+    ids = np.asarray(ids, dtype=np.int64)
+    n = len(ids)
+    if n == 0:
+        return {'clusters': ids.copy(), 'candidates': 0, 'pairs': 0}
+    titles = [normalize_title(title) for title in titles]
+    artist_keys = np.unique(np.array([primary_artist(artist) for artist in artists], dtype=str),
+                            return_inverse=True)[1].astype(np.int64)
+    shingles, offsets = title_shingles(titles)
+    signatures = minhash_signatures(shingles, offsets, MINHASH_BANDS * MINHASH_ROWS, seed)
+    has_title = offsets[1:] > offsets[:-1]
+
+    unit = unit_rows(FeatureStats.from_values(features, ids).transform(features))
+    has_audio = unit.any(axis=1)
+    planes = np.random.default_rng(seed + 1).standard_normal((unit.shape[1], MINHASH_BANDS * AUDIO_BITS))
+    bits = (unit @ planes > 0).reshape(n, MINHASH_BANDS, AUDIO_BITS)
+    audio_keys = bits.astype(np.int64) @ (np.int64(1) << np.arange(AUDIO_BITS, dtype=np.int64))
+
+    candidates = []
+    for band in range(MINHASH_BANDS):
+        rows = signatures[:, band * MINHASH_ROWS:(band + 1) * MINHASH_ROWS].astype(np.int64)
+        candidates.append(bucket_pairs(band_keys(np.column_stack([artist_keys, rows])), has_title))
+        candidates.append(bucket_pairs(band_keys(np.column_stack([audio_keys[:, band], rows])),
+                                       has_title & has_audio))
+
+    # Verify each distinct candidate pair once
+    pairs = np.sort(np.concatenate(candidates), axis=1)
+    pairs = np.sort(pairs[:, 0] * n + pairs[:, 1])
+    pairs = pairs[np.concatenate([[True], pairs[1:] != pairs[:-1]])] if len(pairs) else pairs
+    duplicate = np.zeros(len(pairs), dtype=bool)
+    for start in range(0, len(pairs), CHUNK_PAIRS):
+        left, right = np.divmod(pairs[start:start + CHUNK_PAIRS], n)
+        title_sim = (signatures[left] == signatures[right]).mean(axis=1)
+        both_audio = has_audio[left] & has_audio[right]
+        audio_sim = np.einsum('ij,ij->i', unit[left], unit[right])
+        same_artist = artist_keys[left] == artist_keys[right]
+        duplicate[start:start + CHUNK_PAIRS] = (
+            ((title_sim >= TITLE_THRESHOLD) & same_artist & (~both_audio | (audio_sim >= AUDIO_MIN))) |
+            (both_audio & (audio_sim >= AUDIO_THRESHOLD) & (title_sim >= TITLE_MIN))
+        )
+
+    left, right = np.divmod(pairs[duplicate], n)
+    graph = sparse.csr_matrix((np.ones(len(left), dtype=np.int8), (left, right)), shape=(n, n))
+    _, labels = csgraph.connected_components(graph, directed=False)
+    cluster_ids = np.full(labels.max() + 1, np.iinfo(np.int64).max, dtype=np.int64)
+    np.minimum.at(cluster_ids, labels, ids)
+    return {
+        'clusters': cluster_ids[labels],
+        'candidates': int(len(pairs)),
+        'pairs': int(duplicate.sum()),
+    }
+
+
+class DuplicateStore:
+    """Versioned song-id -> cluster-id arrays on disk (a VersionedArrayStore), read back memory-mapped."""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.store = VersionedArrayStore(directory)
+
+    def save(self, ids: np.ndarray, clusters: np.ndarray, params: Dict) -> str:
+        order = np.argsort(ids, kind='stable')
+        sizes = np.unique(clusters, return_counts=True)[1]
+        return self.store.save({
+            'ids': np.asarray(ids, dtype=np.int64)[order],
+            'clusters': np.asarray(clusters, dtype=np.int64)[order],
+        }, {
+            'songs': int(len(ids)),
+            'clusters': int((sizes > 1).sum()),
+            'duplicates': int(sizes[sizes > 1].sum() - (sizes > 1).sum()),
+            'largest': int(sizes.max()) if len(sizes) else 0,
+            'params': params,
+        })
+
+    def load(self) -> Optional['DuplicateClusters']:
+        loaded = self.store.load(('ids', 'clusters'))
+        if loaded is None:
+            return None
+        manifest, arrays = loaded
+        return DuplicateClusters(manifest, **arrays)
+
+
+class DuplicateClusters:
+    """A loaded dedupe run: cluster id per song id."""
+
+    def __init__(self, manifest: Dict, ids: np.ndarray, clusters: np.ndarray):
+        self.manifest = manifest
+        self.version = manifest['version']
+        self.ids = ids
+        self.clusters = clusters
+
+    def clusters_for(self, song_ids: np.ndarray) -> np.ndarray:
+        """Cluster ids for `song_ids`; songs the run has not seen are their own cluster."""
+        song_ids = np.asarray(song_ids, dtype=np.int64)
+        if len(self.ids) == 0:
+            return song_ids.copy()
+        rows = lookup_rows(self.ids, song_ids)
+        return np.where(rows >= 0, self.clusters[rows], song_ids)
+
+
+def dedupe_from_database(directory: str, seed: int = 0) -> str:
+    import catalog
+    import db_pool
+
+    with db_pool.pooled_connection() as conn:
+        arrays = catalog.load_catalog_arrays(conn)
+    artists = np.asarray(list(arrays.artists) + [''], dtype=object)[arrays.artist_codes]
+    start = time.perf_counter()
+    result = find_duplicates(arrays.ids, arrays.titles, artists, arrays.features, seed)
+    logger.info(f"Checked {result['candidates']} candidate pairs of {len(arrays)} songs, "
+                f"{result['pairs']} duplicates in {time.perf_counter() - start:.2f}s")
+    return DuplicateStore(directory).save(arrays.ids, result['clusters'], {
+        'seed': seed,
+        'minhash_bands': MINHASH_BANDS,
+        'minhash_rows': MINHASH_ROWS,
+        'audio_bits': AUDIO_BITS,
+        'title_threshold': TITLE_THRESHOLD,
+        'audio_threshold': AUDIO_THRESHOLD,
+        'candidates': result['candidates'],
+        'pairs': result['pairs'],
+    })
+
+
+def main():
+    default_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'artifacts', 'duplicates')
+    parser = argparse.ArgumentParser(description='Find near-duplicate songs (re-uploads, remasters, live versions).')
+    parser.add_argument('--output', default=os.getenv('DUPLICATES_DIR', default_dir))
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    version = dedupe_from_database(args.output, args.seed)
+    with open(os.path.join(args.output, version, 'manifest.json')) as f:
+        manifest = json.load(f)
+    print(json.dumps({'version': version, 'directory': args.output, 'songs': manifest['songs'],
+                      'clusters': manifest['clusters'], 'duplicates': manifest['duplicates']}))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,348 @@
+import argparse
+import json
+import logging
+import sys
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+import db_pool
+import recommender
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+PLAYS_QUERY = """
+SELECT user_id, song_id, EXTRACT(EPOCH FROM played_at)
+FROM user_play_history
+WHERE user_id IS NOT NULL AND song_id IS NOT NULL AND played_at IS NOT NULL
+"""
+
+SKIPS_QUERY = """
+SELECT user_id, song_id, skip_type, EXTRACT(EPOCH FROM created_at)
+FROM skip_history
+WHERE song_id IS NOT NULL AND created_at IS NOT NULL
+"""
+
+# Score components a weight set can use; missing ones weigh 0
+COMPONENTS = ('content', 'collaborative', 'popularity', 'recency')
+
+# Upper bound on one batch's (songs, queries) float32 score arrays; sets the default batch size
+BATCH_BYTES = 256 * 1024 * 1024
+
+# Skips in the last RECENT_SKIP_DAYS before the split count as recent, as in collaborative_scores()
+RECENT_SKIP_DAYS = 30
+
+
+def load_history(conn):
+    """(plays, skips) frames with float epoch timestamps; anonymous skips have user_id NaN."""
+    with conn.cursor() as cursor:
+        cursor.execute(PLAYS_QUERY)
+        plays = pd.DataFrame(cursor.fetchall(), columns=['user_id', 'song_id', 'timestamp'])
+        cursor.execute(SKIPS_QUERY)
+        skips = pd.DataFrame(cursor.fetchall(), columns=['user_id', 'song_id', 'skip_type', 'timestamp'])
+    for frame in (plays, skips):
+        frame['timestamp'] = frame['timestamp'].astype(np.float64)
+        frame['user_id'] = frame['user_id'].astype(np.float64)
+    return plays, skips
+
+
+def parse_weights(value: str) -> Dict[str, float]:
+    """'content=0.4,collaborative=0.4,...' -> dict; unknown components are an error."""
+    weights = {}
+    for part in value.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in COMPONENTS:
+            raise argparse.ArgumentTypeError(f"Unknown component '{name}', expected one of {', '.join(COMPONENTS)}")
+        weights[name] = float(weight)
+    return weights
+
+
+def build_queries(plays: pd.DataFrame, cat, cutoff: float, horizon: int = 1) -> Dict[str, np.ndarray]:
+    """One query per play that has a later play by the same user in the test window.
+
+    The seed is the played song; the targets are the user's next `horizon`
+    plays, as long as they happen after `cutoff`. Targets equal to the seed
+    (repeat plays) can't be recommended and are dropped. Queries come out
+    sorted by user.
+    """
+    plays = plays.sort_values(['user_id', 'timestamp'], kind='stable')
+    users = plays['user_id'].to_numpy(dtype=np.int64)
+    positions = cat.positions(plays['song_id'].to_numpy(dtype=np.int64))
+    timestamps = plays['timestamp'].to_numpy()
+
+    query_rows, target_rows = [], []
+    for step in range(1, horizon + 1):
+        rows = np.arange(len(plays) - step)
+        valid = ((users[rows] == users[rows + step]) & (timestamps[rows + step] >= cutoff) &
+                 (positions[rows] >= 0) & (positions[rows + step] >= 0) &
+                 (positions[rows] != positions[rows + step]))
+        query_rows.append(rows[valid])
+        target_rows.append(rows[valid] + step)
+    query_rows = np.concatenate(query_rows)
+    target_rows = np.concatenate(target_rows)
+
+    # Dense query index per seed row; several steps of the same seed share a query
+    seed_rows, query_index = np.unique(query_rows, return_inverse=True)
+    targets = np.unique(query_index.astype(np.int64) * len(cat) + positions[target_rows])
+    return {
+        'users': users[seed_rows],
+        'seeds': positions[seed_rows],
+        'target_keys': targets,
+        'target_counts': np.bincount(targets // len(cat), minlength=len(seed_rows)),
+    }
+
+
+def sample_queries(queries: Dict[str, np.ndarray], n_songs: int, limit: int) -> Dict[str, np.ndarray]:
+    """Every k-th query, so at most `limit` remain (still sorted by user)."""
+    count = len(queries['seeds'])
+    if limit <= 0 or count <= limit:
+        return queries
+    keep = np.linspace(0, count - 1, limit).astype(np.int64)
+    renumber = np.full(count, -1, dtype=np.int64)
+    renumber[keep] = np.arange(limit)
+    target_queries = renumber[queries['target_keys'] // n_songs]
+    kept = target_queries >= 0
+    return {
+        'users': queries['users'][keep],
+        'seeds': queries['seeds'][keep],
+        'target_keys': target_queries[kept] * n_songs + queries['target_keys'][kept] % n_songs,
+        'target_counts': queries['target_counts'][keep],
+    }
+
+
+class ReplayScorer:
+    """Score components as the recommender builds them, from the training window only.
+
+    Collaborative scores follow get_skip_patterns(user): the querying user's
+    skips plus anonymous ones, before the split. Popularity is the training
+    window's play counts instead of the catalog's lifetime plays, which
+    include the test window. Content and recency are the catalog's own.
+    """
+
+    def __init__(self, cat, train_plays: pd.DataFrame, train_skips: pd.DataFrame, cutoff: float):
+        self.cat = cat
+        n = len(cat)
+        plays = np.bincount(self._positions(train_plays), minlength=n + 1)[:n]
+        self.popularity = (plays / plays.max() if plays.max() > 0 else np.zeros(n)).astype(np.float32)
+        self.recency = recommender.recency_scores(cat)
+
+        positions = cat.positions(train_skips['song_id'].to_numpy(dtype=np.int64))
+        known = positions >= 0
+        skips = train_skips[known]
+        self._skip_positions = positions[known]
+        self._skip_recent = (skips['timestamp'].to_numpy() > cutoff - RECENT_SKIP_DAYS * 86400).astype(np.int64)
+        self._skip_quick = (skips['skip_type'] == 'quick').to_numpy().astype(np.int64)
+        self._skip_users = skips['user_id'].to_numpy()
+        # Total skip rows per user (as get_skip_patterns() returns them, known songs or not)
+        anonymous = train_skips['user_id'].isna()
+        self._anonymous_total = int(anonymous.sum())
+        self._user_totals = train_skips[~anonymous]['user_id'].value_counts().to_dict()
+        anonymous_known = np.isnan(self._skip_users)
+        self._anonymous_counts = self._counts(anonymous_known)
+
+        order = np.argsort(self._skip_users, kind='stable')
+        self._user_order = order[~np.isnan(self._skip_users[order])]
+        self._user_keys = self._skip_users[self._user_order]
+
+    def _positions(self, frame: pd.DataFrame) -> np.ndarray:
+        positions = self.cat.positions(frame['song_id'].to_numpy(dtype=np.int64))
+        return np.where(positions >= 0, positions, len(self.cat))
+
+    def _counts(self, rows) -> np.ndarray:
+        # (3, songs) skip, recent-skip and quick-skip counts for the selected skip rows
+        n = len(self.cat)
+        positions = self._skip_positions[rows]
+        return np.stack([
+            np.bincount(positions, minlength=n),
+            np.bincount(positions, weights=self._skip_recent[rows], minlength=n),
+            np.bincount(positions, weights=self._skip_quick[rows], minlength=n),
+        ])
+
+    def collaborative(self, user_id) -> np.ndarray:
+        low = np.searchsorted(self._user_keys, user_id, side='left')
+        high = np.searchsorted(self._user_keys, user_id, side='right')
+        counts = self._anonymous_counts
+        if high > low:
+            counts = counts + self._counts(self._user_order[low:high])
+        total = self._anonymous_total + self._user_totals.get(float(user_id), 0)
+        return recommender.collaborative_from_counts(counts[0], counts[1], counts[2], total)
+
+    def components(self, users: np.ndarray, seeds: np.ndarray) -> Dict[str, np.ndarray]:
+        """(songs, queries) content and collaborative matrices plus per-song vectors."""
+        unique_users, user_columns = np.unique(users, return_inverse=True)
+        collaborative = np.column_stack([self.collaborative(user) for user in unique_users])
+        return {
+            'content': recommender.content_score_matrix(self.cat, seeds).astype(np.float32),
+            'collaborative': collaborative[:, user_columns],
+            'popularity': self.popularity[:, None],
+            'recency': self.recency[:, None],
+        }
+
+
+def ranked_positions(components: Dict[str, np.ndarray], weights: Dict[str, float], seeds: np.ndarray,
+                     k: int) -> np.ndarray:
+    """(k, queries) best positions per query under `weights`, seeds excluded."""
+    scores = sum(weight * components[name] for name, weight in weights.items() if weight)
+    scores = np.broadcast_to(scores, (len(components['popularity']), len(seeds))).astype(np.float32)
+    scores[seeds, np.arange(len(seeds))] = -np.inf
+    k = min(k, len(scores))
+    top = np.argpartition(-scores, k - 1, axis=0)[:k] if k < len(scores) else \
+        np.broadcast_to(np.arange(len(scores))[:, None], scores.shape)
+    order = np.argsort(-np.take_along_axis(scores, top, axis=0), axis=0, kind='stable')
+    return np.take_along_axis(top, order, axis=0)
+
+
+def evaluate(cat, queries: Dict[str, np.ndarray], scorer: ReplayScorer, weight_sets: List[Dict[str, float]],
+             ks: List[int], test_plays: pd.DataFrame, test_skips: pd.DataFrame,
+             batch_size: Optional[int] = None) -> Dict[str, Any]:
+    """Replay every query against every weight set, batch by batch."""
+    n = len(cat)
+    k_max = max(ks)
+    count = len(queries['seeds'])
+    if batch_size is None:
+        batch_size = max(1, BATCH_BYTES // (4 * n * 4))
+    discounts = 1.0 / np.log2(np.arange(k_max) + 2)
+    ideal = np.concatenate([[0.0], np.cumsum(discounts)])
+
+    # Test-window (user, song) pairs the user played or skipped, and the skipped ones
+    def pair_keys(frame):
+        positions = cat.positions(frame['song_id'].to_numpy(dtype=np.int64))
+        users = frame['user_id'].to_numpy()
+        keep = (positions >= 0) & ~np.isnan(users)
+        return users[keep].astype(np.int64) * n + positions[keep]
+    skipped = np.unique(pair_keys(test_skips))
+    interacted = np.unique(np.concatenate([pair_keys(test_plays), skipped]))
+    baseline_skip_rate = len(skipped) / len(interacted) if len(interacted) else 0.0
+
+    totals = [{f'{name}@{k}': 0.0 for k in ks for name in ('recall', 'ndcg', 'skipped', 'interacted')}
+              for _ in weight_sets]
+    for start in range(0, count, batch_size):
+        end = min(start + batch_size, count)
+        users, seeds = queries['users'][start:end], queries['seeds'][start:end]
+        components = scorer.components(users, seeds)
+        target_counts = queries['target_counts'][start:end]
+        for total, weights in zip(totals, weight_sets):
+            top = ranked_positions(components, weights, seeds, k_max)
+            query_index = np.arange(start, end)
+            hits = np.isin(query_index * n + top, queries['target_keys'])
+            user_pairs = users * n + top
+            was_interacted = np.isin(user_pairs, interacted)
+            was_skipped = np.isin(user_pairs, skipped)
+            for k in ks:
+                depth = min(k, len(top))
+                found = hits[:depth].sum(axis=0)
+                total[f'recall@{k}'] += float((found / target_counts).sum())
+                dcg = (hits[:depth] * discounts[:depth, None]).sum(axis=0)
+                total[f'ndcg@{k}'] += float((dcg / ideal[np.minimum(target_counts, depth)]).sum())
+                total[f'skipped@{k}'] += float(was_skipped[:depth].sum())
+                total[f'interacted@{k}'] += float(was_interacted[:depth].sum())
+
+    results = []
+    for total, weights in zip(totals, weight_sets):
+        metrics = {}
+        for k in ks:
+            skip_rate = total[f'skipped@{k}'] / total[f'interacted@{k}'] if total[f'interacted@{k}'] else None
+            metrics[f'recall@{k}'] = total[f'recall@{k}'] / count if count else None
+            metrics[f'ndcg@{k}'] = total[f'ndcg@{k}'] / count if count else None
+            metrics[f'skip_rate@{k}'] = skip_rate
+            # Below 1: recommended songs the user got to are skipped less often than songs overall
+            metrics[f'skip_rate_lift@{k}'] = (skip_rate / baseline_skip_rate
+                                              if skip_rate is not None and baseline_skip_rate else None)
+            metrics[f'interactions@{k}'] = int(total[f'interacted@{k}'])
+        results.append({'weights': weights, 'metrics': metrics})
+    return {'baseline_skip_rate': baseline_skip_rate, 'batch_size': batch_size, 'results': results}
+
+
+def run_replay(weight_sets: List[Dict[str, float]], ks: List[int], test_fraction: float = 0.2,
+               split_at: Optional[float] = None, horizon: int = 1, max_queries: int = 0,
+               batch_size: Optional[int] = None) -> Dict[str, Any]:
+    started = time.perf_counter()
+    cat = recommender.get_catalog()
+    with db_pool.pooled_connection() as conn:
+        plays, skips = load_history(conn)
+    if plays.empty:
+        raise ValueError("user_play_history is empty; nothing to replay")
+    cutoff = split_at if split_at is not None else float(np.quantile(plays['timestamp'], 1 - test_fraction))
+    train_plays, test_plays = plays[plays['timestamp'] < cutoff], plays[plays['timestamp'] >= cutoff]
+    train_skips, test_skips = skips[skips['timestamp'] < cutoff], skips[skips['timestamp'] >= cutoff]
+
+    queries = sample_queries(build_queries(plays, cat, cutoff, horizon), len(cat), max_queries)
+    logger.info(f"Replaying {len(queries['seeds'])} queries over {len(cat)} songs "
+                f"against {len(weight_sets)} weight set(s)")
+    scorer = ReplayScorer(cat, train_plays, train_skips, cutoff)
+    load_seconds = time.perf_counter() - started
+
+    replay_started = time.perf_counter()
+    report = evaluate(cat, queries, scorer, weight_sets, ks, test_plays, test_skips, batch_size)
+    replay_seconds = time.perf_counter() - replay_started
+    return {
+        'generated_at': datetime.now().isoformat(),
+        'split': {
+            'cutoff': datetime.fromtimestamp(cutoff).isoformat(),
+            'train_plays': int(len(train_plays)),
+            'test_plays': int(len(test_plays)),
+            'train_skips': int(len(train_skips)),
+            'test_skips': int(len(test_skips)),
+        },
+        'songs': len(cat),
+        'queries': int(len(queries['seeds'])),
+        'horizon': horizon,
+        **report,
+        'load_seconds': load_seconds,
+        'replay_seconds': replay_seconds,
+        'queries_per_second': (len(queries['seeds']) * len(weight_sets) / replay_seconds
+                               if replay_seconds > 0 else None),
+    }
+
+
+def print_summary(report: Dict[str, Any]):
+    print(f"{report['queries']} queries, split at {report['split']['cutoff']}, "
+          f"baseline skip rate {report['baseline_skip_rate']:.3f}", file=sys.stderr)
+    for result in report['results']:
+        weights = ','.join(f'{name}={weight:g}' for name, weight in result['weights'].items())
+        metrics = '  '.join(f'{name}={value:.4f}' for name, value in result['metrics'].items()
+                            if isinstance(value, float))
+        print(f"  {weights}: {metrics}", file=sys.stderr)
+
+
+def parse_int_list(value: str) -> List[int]:
+    return [int(part) for part in value.split(',') if part]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay play/skip history against recommender weight sets.')
+    parser.add_argument('--weights', type=parse_weights, action='append',
+                        help="Weight set to evaluate, e.g. 'content=0.4,collaborative=0.4,popularity=0.1,"
+                             "recency=0.1' (repeatable; default: the recommender's SEED_WEIGHTS)")
+    parser.add_argument('--k', type=parse_int_list, default=[5, 10, 20], help='Cut-offs, e.g. 5,10,20')
+    parser.add_argument('--test-fraction', type=float, default=0.2,
+                        help='Share of plays (by time) held out for testing')
+    parser.add_argument('--split-at', default=None, help='ISO timestamp to split at instead of --test-fraction')
+    parser.add_argument('--horizon', type=int, default=1, help='Next plays per query that count as hits')
+    parser.add_argument('--max-queries', type=int, default=0, help='Evenly sample at most this many queries')
+    parser.add_argument('--batch-size', type=int, default=None, help='Queries scored per batch')
+    parser.add_argument('--output', default=None, help='Write the JSON report here instead of stdout')
+    args = parser.parse_args()
+
+    split_at = datetime.fromisoformat(args.split_at).timestamp() if args.split_at else None
+    report = run_replay(args.weights or [dict(recommender.SEED_WEIGHTS)], args.k, args.test_fraction,
+                        split_at, args.horizon, args.max_queries, args.batch_size)
+    print_summary(report)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
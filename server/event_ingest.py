@@ -0,0 +1,385 @@
+import json
+import logging
+import os
+import select
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict, Iterator, Optional
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# Channel the NOTIFY triggers in migrations/add_recommender_event_notify.sql publish on
+NOTIFY_CHANNEL = 'recommender_events'
+
+# Skips newer than this count as "recent" in the collaborative score
+RECENT_SKIP_DAYS = 30
+
+SKIP_HISTORY_QUERY = """
+SELECT user_id, song_id, skip_type, EXTRACT(EPOCH FROM created_at)
+FROM skip_history
+WHERE song_id IS NOT NULL
+"""
+
+
+def parse_event(payload) -> Optional[dict]:
+    """Normalise a JSON string or dict into {type, song_id, user_id, skip_type, timestamp}.
+
+    Returns None for anything that isn't a well-formed play, like or skip.
+    """
+    try:
+        event = json.loads(payload) if isinstance(payload, (str, bytes)) else dict(payload)
+        event_type = event['type']
+        if event_type not in ('play', 'like', 'skip'):
+            return None
+        user_id = event.get('user_id')
+        return {
+            'type': event_type,
+            'song_id': int(event['song_id']),
+            'user_id': None if user_id is None else int(user_id),
+            'skip_type': event.get('skip_type'),
+            'timestamp': float(event.get('timestamp') or time.time()),
+        }
+    except (ValueError, KeyError, TypeError):
+        return None
+
+
+def append_event(path: str, event: dict):
+    """Append one event to a JSON-lines log read by FileEventSource."""
+    event = dict(event)
+    event.setdefault('timestamp', time.time())
+    line = json.dumps(event) + '\n'
+    # One write() per line so concurrent appenders don't interleave partial events
+    fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, line.encode())
+    finally:
+        os.close(fd)
+
+
+class EventAggregates:
+    """Skip and play counters for one catalog snapshot, updated in O(1) per event.
+
+    Per-song arrays are indexed by catalog position. Skips with no user (which
+    every user's skip patterns include) live in dense arrays; each user's own skips
+    are a sorted (positions, counts) slice from the skip_history snapshot plus a
+    small dict of live skips on top. Plays only touch the per-song play array.
+    """
+
+    def __init__(self, n_songs: int, position: Callable[[int], int], since: Optional[float] = None):
+        self.n_songs = n_songs
+        self._position = position
+        self.since = time.time() if since is None else since
+        self.plays = np.zeros(n_songs, dtype=np.int64)
+        self.skips = np.zeros(n_songs, dtype=np.int32)
+        self.recent_skips = np.zeros(n_songs, dtype=np.int32)
+        self.quick_skips = np.zeros(n_songs, dtype=np.int32)
+        self.anonymous_skip_total = 0
+        # user -> (positions, skips, recent, quick) from the snapshot, and live additions
+        self._user_snapshot: Dict[int, tuple] = {}
+        self._user_live: Dict[int, Dict[int, list]] = {}
+        self.user_plays: Dict[int, int] = {}
+        self.applied = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_skip_history(cls, skip_history: pd.DataFrame, positions: np.ndarray, n_songs: int,
+                          position: Callable[[int], int], since: Optional[float] = None) -> 'EventAggregates':
+        """Seed the counters from a full skip_history read.
+
+        `skip_history` has user_id, skip_type and timestamp columns and `positions`
+        gives each row's catalog position (-1 for unknown songs, which still count
+        towards the user's total like they do in collaborative_scores()).
+
+        `since` defaults to the newest timestamp in the snapshot itself. Live
+        events carry their row's created_at, so the ones after it are exactly
+        those the snapshot doesn't hold; an empty snapshot starts from now.
+        """
+        if since is None and not skip_history.empty:
+            since = float(skip_history['timestamp'].max())
+        aggregates = cls(n_songs, position, since)
+        if skip_history.empty:
+            return aggregates
+
+        user_ids = pd.to_numeric(skip_history['user_id'], errors='coerce').to_numpy(dtype=np.float64)
+        anonymous = np.isnan(user_ids)
+        recent = (skip_history['timestamp'].to_numpy(dtype=np.float64)
+                  > time.time() - RECENT_SKIP_DAYS * 86400)
+        quick = (skip_history['skip_type'] == 'quick').to_numpy()
+
+        known = anonymous & (positions >= 0)
+        aggregates.skips += np.bincount(positions[known], minlength=n_songs).astype(np.int32)
+        aggregates.recent_skips += np.bincount(positions[known & recent], minlength=n_songs).astype(np.int32)
+        aggregates.quick_skips += np.bincount(positions[known & quick], minlength=n_songs).astype(np.int32)
+        aggregates.anonymous_skip_total = int(anonymous.sum())
+
+        # Group each user's skips by song once, so a lookup is one dict access and a slice
+        owned = ~anonymous
+        frame = pd.DataFrame({
+            'user_id': user_ids[owned].astype(np.int64),
+            'position': positions[owned],
+            'skips': 1,
+            'recent': recent[owned].astype(np.int32),
+            'quick': quick[owned].astype(np.int32),
+        })
+        grouped = frame.groupby(['user_id', 'position'], sort=True).sum().reset_index()
+        users = grouped['user_id'].to_numpy()
+        bounds = np.flatnonzero(np.diff(users)) + 1
+        starts = np.concatenate(([0], bounds))
+        ends = np.concatenate((bounds, [len(users)]))
+        columns = [grouped[name].to_numpy() for name in ('position', 'skips', 'recent', 'quick')]
+        for start, end in zip(starts, ends):
+            aggregates._user_snapshot[int(users[start])] = tuple(column[start:end] for column in columns)
+        return aggregates
+
+    def apply(self, event: dict) -> bool:
+        """Fold one parsed event into the counters; False if the song isn't in the catalog."""
+        position = self._position(event['song_id'])
+        user_id = event.get('user_id')
+        with self._lock:
+            self.applied += 1
+            if event['type'] == 'play':
+                if position >= 0:
+                    self.plays[position] += 1
+                if user_id is not None:
+                    self.user_plays[user_id] = self.user_plays.get(user_id, 0) + 1
+            elif event['type'] == 'skip':
+                recent = event['timestamp'] > time.time() - RECENT_SKIP_DAYS * 86400
+                quick = event.get('skip_type') == 'quick'
+                if user_id is None:
+                    self.anonymous_skip_total += 1
+                    if position >= 0:
+                        self.skips[position] += 1
+                        self.recent_skips[position] += recent
+                        self.quick_skips[position] += quick
+                else:
+                    counts = self._user_live.setdefault(user_id, {}).setdefault(position, [0, 0, 0])
+                    counts[0] += 1
+                    counts[1] += recent
+                    counts[2] += quick
+        return position >= 0
+
+    def skip_counts(self, user_id=None):
+        """Per-song (skips, recent, quick) arrays and the total skip count for one user.
+
+        Matches what collaborative_scores() computes from get_skip_patterns(user_id):
+        the user's own skips plus the anonymous ones.
+        """
+        try:
+            user_id = None if user_id is None else int(user_id)
+        except (TypeError, ValueError):
+            user_id = None
+        with self._lock:
+            skips = self.skips.astype(np.int64)
+            recent = self.recent_skips.astype(np.int64)
+            quick = self.quick_skips.astype(np.int64)
+            total = self.anonymous_skip_total
+            if user_id is None:
+                return skips, recent, quick, total
+
+            snapshot = self._user_snapshot.get(user_id)
+            if snapshot is not None:
+                positions, user_skips, user_recent, user_quick = snapshot
+                total += int(user_skips.sum())
+                known = positions >= 0
+                np.add.at(skips, positions[known], user_skips[known])
+                np.add.at(recent, positions[known], user_recent[known])
+                np.add.at(quick, positions[known], user_quick[known])
+            for position, (count, recent_count, quick_count) in self._user_live.get(user_id, {}).items():
+                total += count
+                if position >= 0:
+                    skips[position] += count
+                    recent[position] += recent_count
+                    quick[position] += quick_count
+        return skips, recent, quick, total
+
+
+class FileEventSource:
+    """Tails a JSON-lines event log, e.g. one written with append_event().
+
+    Starts at the end of the file unless `from_start` is set, waits for a partial
+    last line to be completed, and reopens the file if it is truncated or replaced.
+    """
+
+    def __init__(self, path: str, from_start: bool = False, poll_interval: float = 0.2):
+        self.path = path
+        self.from_start = from_start
+        self.poll_interval = poll_interval
+        self._closed = threading.Event()
+
+    def close(self):
+        self._closed.set()
+
+    def _open(self, seek_end: bool):
+        while not self._closed.is_set():
+            try:
+                f = open(self.path, 'rb')
+                if seek_end:
+                    f.seek(0, os.SEEK_END)
+                return f
+            except FileNotFoundError:
+                self._closed.wait(self.poll_interval)
+        return None
+
+    def events(self) -> Iterator[dict]:
+        f = self._open(seek_end=not self.from_start)
+        buffer = b''
+        while f is not None and not self._closed.is_set():
+            chunk = f.read(65536)
+            if chunk:
+                buffer += chunk
+                *lines, buffer = buffer.split(b'\n')
+                for line in lines:
+                    event = parse_event(line) if line.strip() else None
+                    if event is not None:
+                        yield event
+                    elif line.strip():
+                        logger.warning(f"Skipping malformed event in {self.path}: {line[:200]!r}")
+                continue
+
+            # At EOF: reopen from the start if the log was rotated or truncated
+            try:
+                stat = os.stat(self.path)
+                replaced = stat.st_ino != os.fstat(f.fileno()).st_ino or stat.st_size < f.tell()
+            except FileNotFoundError:
+                replaced = False
+            if replaced:
+                f.close()
+                buffer = b''
+                f = self._open(seek_end=False)
+            else:
+                self._closed.wait(self.poll_interval)
+        if f is not None:
+            f.close()
+
+
+class PostgresEventSource:
+    """Receives events from Postgres NOTIFY on a dedicated autocommit connection.
+
+    LISTEN can't share pooled connections, so this opens its own and reconnects
+    with backoff if the server goes away. Events sent while disconnected are lost;
+    the next catalog reload picks them up from the tables.
+    """
+
+    def __init__(self, channel: str = NOTIFY_CHANNEL, timeout: float = 1.0):
+        self.channel = channel
+        self.timeout = timeout
+        self._closed = threading.Event()
+
+    def close(self):
+        self._closed.set()
+
+    def _connect(self):
+        import psycopg2
+        import psycopg2.extensions
+
+        conn = psycopg2.connect(
+            dbname=os.getenv('DB_NAME'),
+            user=os.getenv('DB_USER'),
+            password=os.getenv('DB_PASSWORD'),
+            host=os.getenv('DB_HOST'),
+            port=os.getenv('DB_PORT')
+        )
+        conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+        with conn.cursor() as cursor:
+            cursor.execute(f'LISTEN {self.channel}')
+        return conn
+
+    def events(self) -> Iterator[dict]:
+        import psycopg2
+
+        backoff = 1.0
+        conn = None
+        while not self._closed.is_set():
+            try:
+                if conn is None:
+                    conn = self._connect()
+                    backoff = 1.0
+                if select.select([conn], [], [], self.timeout)[0]:
+                    conn.poll()
+                    while conn.notifies:
+                        notify = conn.notifies.pop(0)
+                        event = parse_event(notify.payload)
+                        if event is not None:
+                            yield event
+            except psycopg2.Error as e:
+                logger.warning(f"Event listener lost its connection, retrying in {backoff:.0f}s: {str(e)}")
+                if conn is not None and not conn.closed:
+                    conn.close()
+                conn = None
+                self._closed.wait(backoff)
+                backoff = min(backoff * 2, 30.0)
+        if conn is not None and not conn.closed:
+            conn.close()
+
+
+class EventIngestor:
+    """Background thread that feeds a source's events into the current aggregates.
+
+    Recent events are kept in a bounded buffer so that aggregates rebuilt from a
+    fresh table snapshot can replay whatever arrived after the snapshot was taken.
+    Listeners (e.g. trending counters) see every event once, as it arrives.
+    """
+
+    def __init__(self, source, buffer_size: int = 100000):
+        self.source = source
+        self._aggregates: Optional[EventAggregates] = None
+        self._buffer = deque(maxlen=buffer_size)
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name='event-ingest', daemon=True)
+        self._listeners = []
+        self.received = 0
+
+    def start(self) -> 'EventIngestor':
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.source.close()
+        self._thread.join(timeout=5)
+
+    def add_listener(self, callback: Callable[[dict], object]) -> 'EventIngestor':
+        """Also pass every received event to `callback`, on the ingest thread."""
+        self._listeners.append(callback)
+        return self
+
+    def _run(self):
+        try:
+            for event in self.source.events():
+                with self._lock:
+                    self.received += 1
+                    self._buffer.append(event)
+                    aggregates = self._aggregates
+                if aggregates is not None:
+                    aggregates.apply(event)
+                for listener in self._listeners:
+                    try:
+                        listener(event)
+                    except Exception as e:
+                        logger.warning(f"Event listener failed: {str(e)}")
+        except Exception as e:
+            logger.error(f"Event ingestion stopped: {str(e)}")
+
+    def attach(self, aggregates: EventAggregates):
+        """Make `aggregates` current, replaying buffered events newer than its snapshot."""
+        with self._lock:
+            for event in self._buffer:
+                if event['timestamp'] > aggregates.since:
+                    aggregates.apply(event)
+            self._aggregates = aggregates
+
+    @property
+    def aggregates(self) -> Optional[EventAggregates]:
+        return self._aggregates
+
+
+def load_skip_history(conn) -> pd.DataFrame:
+    with conn.cursor() as cursor:
+        cursor.execute(SKIP_HISTORY_QUERY)
+        rows = cursor.fetchall()
+    frame = pd.DataFrame(rows, columns=['user_id', 'song_id', 'skip_type', 'timestamp'])
+    frame['timestamp'] = frame['timestamp'].astype(np.float64)
+    return frame
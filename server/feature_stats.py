@@ -0,0 +1,165 @@
+import json
+import os
+import time
+from typing import Iterable, Optional
+
+import numpy as np
+
+# Relative slack in describes(): well above float64 rounding, well below a real edit
+CHECK_TOLERANCE = 1e-9
+
+
+class FeatureStats:
+    """Running per-feature count, mean and sum of squared deviations (M2).
+
+    Batches are folded in with Chan et al.'s parallel update, which is Welford's
+    algorithm generalised to merging two partial results, so stats computed on
+    separate shards or separate loads combine exactly. Variance is the population
+    variance, matching StandardScaler.
+
+    `max_id` is the highest song id folded in, so a catalog reload only has to
+    add the songs created since; `version` changes on every update.
+    """
+
+    def __init__(self, dimensions: int):
+        self.dimensions = dimensions
+        self.count = 0
+        self.mean = np.zeros(dimensions, dtype=np.float64)
+        self.m2 = np.zeros(dimensions, dtype=np.float64)
+        self.max_id = -1
+        self.version = 0
+        self.updated_at = None
+
+    @classmethod
+    def from_values(cls, values: np.ndarray, ids: Optional[np.ndarray] = None) -> 'FeatureStats':
+        stats = cls(values.shape[1])
+        stats.update(values, ids)
+        return stats
+
+    def copy(self) -> 'FeatureStats':
+        other = FeatureStats(self.dimensions)
+        other.count, other.mean, other.m2 = self.count, self.mean.copy(), self.m2.copy()
+        other.max_id, other.version, other.updated_at = self.max_id, self.version, self.updated_at
+        return other
+
+    def _combine(self, count: int, mean: np.ndarray, m2: np.ndarray):
+        if count == 0:
+            return
+        total = self.count + count
+        delta = mean - self.mean
+        self.mean = self.mean + delta * (count / total)
+        self.m2 = self.m2 + m2 + delta ** 2 * (self.count * count / total)
+        self.count = total
+        self.version += 1
+        self.updated_at = time.time()
+
+    def update(self, values: np.ndarray, ids: Optional[np.ndarray] = None) -> 'FeatureStats':
+        """Fold a (rows, dimensions) batch in; NaNs count as 0 like the scoring path."""
+        values = np.nan_to_num(np.asarray(values, dtype=np.float64), nan=0.0)
+        if len(values):
+            mean = values.mean(axis=0)
+            self._combine(len(values), mean, ((values - mean) ** 2).sum(axis=0))
+        if ids is not None and len(ids):
+            self.max_id = max(self.max_id, int(np.max(ids)))
+        return self
+
+    def merge(self, other: 'FeatureStats') -> 'FeatureStats':
+        """Fold another shard's stats into these."""
+        if other.dimensions != self.dimensions:
+            raise ValueError(f"Cannot merge stats over {other.dimensions} features into {self.dimensions}")
+        self._combine(other.count, other.mean, other.m2)
+        self.max_id = max(self.max_id, other.max_id)
+        return self
+
+    @classmethod
+    def combine(cls, shards: Iterable['FeatureStats']) -> 'FeatureStats':
+        shards = list(shards)
+        if not shards:
+            raise ValueError('No stats to combine')
+        result = cls(shards[0].dimensions)
+        for shard in shards:
+            result.merge(shard)
+        return result
+
+    @property
+    def variance(self) -> np.ndarray:
+        return self.m2 / self.count if self.count else np.zeros(self.dimensions)
+
+    @property
+    def std(self) -> np.ndarray:
+        # Constant features scale by 1, as StandardScaler does
+        std = np.sqrt(self.variance)
+        return np.where(std > 0, std, 1.0)
+
+    def transform(self, values: np.ndarray) -> np.ndarray:
+        """Standardise rows with one affine transform: values * scale + offset."""
+        scale = (1.0 / self.std).astype(np.float32)
+        offset = (-self.mean * scale).astype(np.float32)
+        values = np.nan_to_num(np.asarray(values, dtype=np.float32), nan=0.0)
+        return values * scale + offset
+
+    def describes(self, values: np.ndarray) -> bool:
+        """Whether `values` have the per-column sums and sums of squares these stats imply.
+
+        A cheap content check: an edited or replaced song changes them even
+        when the song count and ids stay the same.
+        """
+        values = np.nan_to_num(np.asarray(values, dtype=np.float64), nan=0.0)
+        if len(values) != self.count:
+            return False
+        sums = values.sum(axis=0)
+        squares = (values ** 2).sum(axis=0)
+        expected_sums = self.mean * self.count
+        expected_squares = self.m2 + self.count * self.mean ** 2
+        return bool(np.all(np.abs(sums - expected_sums) <= CHECK_TOLERANCE * (np.abs(values).sum(axis=0) + 1.0))
+                    and np.all(np.abs(squares - expected_squares) <= CHECK_TOLERANCE * (squares + 1.0)))
+
+    def extended(self, ids: np.ndarray, values: np.ndarray) -> 'FeatureStats':
+        """Stats for a catalog snapshot, reusing these if they still describe it.
+
+        Only songs with ids above `max_id` are folded in. If the older songs no
+        longer match the stats (deletions, or features edited in place), the
+        stats are refitted instead.
+        """
+        new = ids > self.max_id
+        if self.count + int(new.sum()) != len(ids) or not self.describes(values[~new]):
+            return FeatureStats.from_values(values, ids)
+        if not new.any():
+            return self
+        return self.copy().update(values[new], ids[new])
+
+    def to_dict(self) -> dict:
+        return {
+            'dimensions': self.dimensions,
+            'count': self.count,
+            'mean': self.mean.tolist(),
+            'm2': self.m2.tolist(),
+            'max_id': self.max_id,
+            'version': self.version,
+            'updated_at': self.updated_at,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'FeatureStats':
+        stats = cls(data['dimensions'])
+        stats.count = data['count']
+        stats.mean = np.asarray(data['mean'], dtype=np.float64)
+        stats.m2 = np.asarray(data['m2'], dtype=np.float64)
+        stats.max_id = data['max_id']
+        stats.version = data['version']
+        stats.updated_at = data.get('updated_at')
+        return stats
+
+    def save(self, path: str):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.to_dict(), f)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> Optional['FeatureStats']:
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            return cls.from_dict(json.load(f))
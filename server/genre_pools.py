@@ -0,0 +1,118 @@
+from typing import Optional, Sequence
+
+import numpy as np
+
+# Songs kept per genre, best scored first
+DEFAULT_POOL_SIZE = 500
+
+# Sampling rounds before the rest of a short feed is filled in rank order
+MAX_ROUNDS = 8
+
+
+def alias_table(weights: np.ndarray):
+    """Vose's alias method: (probability, alias) columns for O(1) weighted draws.
+
+    A draw picks a column uniformly, keeps it with its probability and takes
+    its alias otherwise.
+    """
+    n = len(weights)
+    total = float(weights.sum())
+    scaled = weights * n / total if total > 0 else np.ones(n)
+    probability = np.ones(n, dtype=np.float64)
+    alias = np.arange(n, dtype=np.int32)
+    small = [i for i in range(n) if scaled[i] < 1.0]
+    large = [i for i in range(n) if scaled[i] >= 1.0]
+    while small and large:
+        less, more = small.pop(), large.pop()
+        probability[less] = scaled[less]
+        alias[less] = more
+        scaled[more] -= 1.0 - scaled[less]
+        (small if scaled[more] < 1.0 else large).append(more)
+    return probability, alias
+
+
+class GenrePools:
+    """Per-genre candidate pools with alias tables, for cold-start feeds.
+
+    Each genre keeps its `pool_size` best-scored catalog positions, stored
+    back to back: genre g owns entries offsets[g]:offsets[g + 1]. A feed for
+    any set of genres is k weighted draws, each a uniform genre choice plus
+    one alias-table lookup, so it costs O(k) whatever the catalog size.
+    """
+
+    def __init__(self, positions: np.ndarray, offsets: np.ndarray, probability: np.ndarray, alias: np.ndarray):
+        self.positions = positions
+        self.offsets = offsets
+        self.probability = probability
+        self.alias = alias
+
+    @classmethod
+    def build(cls, genre_codes: np.ndarray, scores: np.ndarray, genres: int,
+              candidates: Optional[np.ndarray] = None, pool_size: int = DEFAULT_POOL_SIZE) -> 'GenrePools':
+        """Pools from per-song scores; draws are proportional to score within a genre.
+
+        `candidates` limits the pools to those positions (e.g. one song per
+        duplicate cluster); songs without a genre are left out.
+        """
+        if candidates is None:
+            candidates = np.arange(len(genre_codes))
+        candidates = candidates[genre_codes[candidates] >= 0]
+        codes = genre_codes[candidates]
+        order = np.lexsort((candidates, -scores[candidates], codes))
+        codes, ranked = codes[order], candidates[order]
+        starts = np.searchsorted(codes, np.arange(genres + 1))
+        rank = np.arange(len(codes)) - starts[codes]
+        keep = rank < pool_size
+        positions = ranked[keep].astype(np.int64)
+        offsets = np.concatenate([[0], np.cumsum(np.bincount(codes[keep], minlength=genres))]).astype(np.int64)
+
+        probability = np.ones(len(positions), dtype=np.float64)
+        alias = np.zeros(len(positions), dtype=np.int32)
+        weights = np.maximum(scores[positions].astype(np.float64), 0.0)
+        for genre in range(genres):
+            start, end = offsets[genre], offsets[genre + 1]
+            if end > start:
+                probability[start:end], alias[start:end] = alias_table(weights[start:end])
+        return cls(positions, offsets, probability, alias)
+
+    def __len__(self):
+        return len(self.positions)
+
+    def sample(self, genres: Sequence[int], k: int, rng: np.random.Generator, randomness: float = 0.0) -> np.ndarray:
+        """Up to k distinct positions drawn from the pools of `genres`, in draw order.
+
+        Each draw picks one of the genres uniformly. With probability
+        `randomness` it then takes a uniform song from that genre's pool,
+        otherwise a score-weighted one, so 0 follows the scores and 1 ignores
+        them.
+        """
+        genres = np.unique(np.asarray(genres, dtype=np.int64))
+        genres = genres[(genres >= 0) & (genres < len(self.offsets) - 1)]
+        starts, sizes = self.offsets[genres], self.offsets[genres + 1] - self.offsets[genres]
+        starts, sizes = starts[sizes > 0], sizes[sizes > 0]
+        k = min(int(k), int(sizes.sum()))
+        if k <= 0:
+            return np.array([], dtype=np.int64)
+
+        picked = np.array([], dtype=np.int64)
+        draws = 2 * k
+        for _ in range(MAX_ROUNDS):
+            genre = rng.integers(len(starts), size=draws)
+            slot = rng.random(draws) * sizes[genre]
+            column = np.minimum(slot.astype(np.int64), sizes[genre] - 1)
+            entry = starts[genre] + column
+            own = (slot - column < self.probability[entry]) | (rng.random(draws) < randomness)
+            entry = np.where(own, entry, starts[genre] + self.alias[entry])
+            picked = distinct(np.concatenate([picked, self.positions[entry]]))
+            if len(picked) >= k:
+                return picked[:k]
+            draws *= 2
+        # Scores so skewed that draws keep repeating: fill up from the pools in rank order
+        rest = np.concatenate([self.positions[start:start + size] for start, size in zip(starts, sizes)])
+        return distinct(np.concatenate([picked, rest]))[:k]
+
+
+def distinct(positions: np.ndarray) -> np.ndarray:
+    """First occurrence of each position, order kept."""
+    _, first = np.unique(positions, return_index=True)
+    return positions[np.sort(first)]
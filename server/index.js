@@ -24,7 +24,8 @@ const app = express();
 app.use(cors({
   origin: ['http://localhost:3000', 'http://localhost:3001'],
   methods: ['GET', 'POST', 'PUT', 'DELETE'],
-  allowedHeaders: ['Content-Type']
+  allowedHeaders: ['Content-Type'],
+  exposedHeaders: ['X-Recommendation-Degradation']
 }));
 
 app.use(express.json());
@@ -53,6 +54,12 @@ app.get('/api/test', (req, res) => {
 // Get initial recommendations
 app.get('/api/songs/recommendations', async (req, res) => {
   try {
+    if (req.query.cursor || req.query.limit) {
+      return sendRecommenderPage(req, res, ['initial']);
+    }
+    if (req.query.budgetMs) {
+      return sendBudgetedRecommendations(req, res, 'initial', []);
+    }
     console.log('Fetching initial recommendations...');
     // Call Python script for recommendations
     const pythonProcess = spawn('python', ['recommender.py', 'initial']);
@@ -121,6 +128,17 @@ app.get('/api/songs/top', async (req, res) => {
   }
 });
 
+// Get trending songs (decayed recent plays and likes) - This needs to come BEFORE the /api/songs/:id route
+app.get('/api/songs/trending', async (req, res) => {
+  try {
+    const songs = await runRecommender(['trending']);
+    res.json(songs);
+  } catch (error) {
+    console.error('Error fetching trending songs:', error);
+    res.status(500).json({ message: 'Server error', error: error.message });
+  }
+});
+
 // Get popular songs for non-logged in users - This needs to come BEFORE the /api/songs/:id route
 app.get('/api/songs/popular', async (req, res) => {
   try {
@@ -361,6 +379,60 @@ app.post('/api/playlists/:playlistId/songs', async (req, res) => {
   }
 });
 
+// Recommendations for a whole seed set in one recommender call
+// (mode: centroid = blend of all seeds, max = close to any one seed)
+function sendSeedSetRecommendations(req, res, seeds) {
+  const mode = req.query.mode || 'centroid';
+  if (!['centroid', 'max'].includes(mode)) {
+    return res.status(400).json({ error: 'mode must be centroid or max' });
+  }
+  const args = ['multi', seeds, '--mode', mode];
+  if (req.query.cursor || req.query.limit) {
+    return sendRecommenderPage(req, res, args);
+  }
+  if (req.query.budgetMs) {
+    return sendBudgetedRecommendations(req, res, 'multi', [seeds, 10, mode]);
+  }
+  return runRecommender(args)
+    .then((recommendations) => res.json(recommendations))
+    .catch((error) => {
+      console.error('Seed set recommendations error:', error);
+      res.status(500).json({ error: 'Failed to get recommendations' });
+    });
+}
+
+// Get recommendations for a playlist
+app.get('/api/playlists/:playlistId/recommendations', async (req, res) => {
+  try {
+    const { playlistId } = req.params;
+    const result = await db.query(
+      'SELECT song_id FROM playlist_songs WHERE playlist_id = $1 ORDER BY position',
+      [playlistId]
+    );
+    if (result.rows.length === 0) {
+      return res.json([]);
+    }
+    await sendSeedSetRecommendations(req, res, result.rows.map(row => row.song_id).join(','));
+  } catch (error) {
+    console.error('Error fetching playlist recommendations:', error);
+    res.status(500).json({ error: 'Failed to get recommendations' });
+  }
+});
+
+// Get recommendations for a play queue: { songIds: [...], weights?: [...] }
+app.post('/api/queue/recommendations', async (req, res) => {
+  const { songIds, weights } = req.body;
+  const ids = Array.isArray(songIds) ? songIds.map(id => parseInt(id, 10)) : [];
+  if (ids.length === 0 || ids.some(Number.isNaN)) {
+    return res.status(400).json({ error: 'songIds must be a non-empty array of song ids' });
+  }
+  const seeds = ids.map((id, i) => {
+    const weight = Array.isArray(weights) ? Number(weights[i]) : 1;
+    return `${id}:${Number.isFinite(weight) ? weight : 1}`;
+  });
+  await sendSeedSetRecommendations(req, res, seeds.join(','));
+});
+
 
 // Get recently played songs
 app.get('/api/users/:userId/recently-played', async (req, res) => {
@@ -441,6 +513,7 @@ app.post('/api/songs/:id/play', async (req, res) => {
       'INSERT INTO recently_played (user_id, song_id) VALUES ($1, $2)',
       [userId, id]
     );
+    recordRecommenderEvent({ type: 'play', user_id: userId, song_id: id });
     
     res.json({ message: 'Play count updated' });
   } catch (error) {
@@ -473,6 +546,7 @@ app.post('/api/songs/:id/like', async (req, res) => {
         'INSERT INTO user_favorite_songs (user_id, song_id) VALUES ($1, $2)',
         [userId, id]
       );
+      recordRecommenderEvent({ type: 'like', user_id: userId, song_id: id });
     }
     
     res.json({ message: 'Like status updated' });
@@ -523,47 +597,17 @@ app.get('/api/users/:userId/recommendations', async (req, res) => {
     const hasPlayHistory = playHistoryResult.rows[0].count > 0;
 
     if (hasPlayHistory) {
-      // Get recently played songs
-      const result = await db.query(`
-        SELECT 
-          s.*,
-          a.name as artist_name,
-          al.title as album_title,
-          g.name as genre_name,
-          CASE WHEN ufs.user_id IS NOT NULL THEN true ELSE false END as is_liked
-        FROM songs s
-        JOIN artists a ON s.artist_id = a.id
-        LEFT JOIN albums al ON s.album_id = al.id
-        LEFT JOIN genres g ON s.genre_id = g.id
-        LEFT JOIN user_favorite_songs ufs ON s.id = ufs.song_id AND ufs.user_id = $1
-        WHERE s.id IN (
-          SELECT song_id 
-          FROM user_play_history 
-          WHERE user_id = $1 
-          ORDER BY played_at DESC 
-          LIMIT 10
-        )
-        ORDER BY (
-          SELECT played_at 
-          FROM user_play_history 
-          WHERE user_id = $1 AND song_id = s.id 
-          ORDER BY played_at DESC 
-          LIMIT 1
-        ) DESC
-      `, [userId]);
-
-      songs = result.rows;
-      sectionTitle = 'Recently Played';
-    } else {
-      // Get user's preferred genres
-      const genresResult = await db.query(
-        'SELECT preferred_genres FROM users WHERE id = $1',
-        [userId]
-      );
-      const preferredGenres = genresResult.rows[0]?.preferred_genres || [];
+      try {
+        // Personalized recommendations from the user's taste profile
+        songs = await markLikedSongs(userId, await runRecommender(['personal', userId]));
+        sectionTitle = 'Recommended For You';
+      } catch (error) {
+        console.error('Personalized recommendations failed, falling back to recently played:', error);
+        songs = [];
+      }
 
-      if (preferredGenres.length > 0) {
-        // Get random songs from preferred genres
+      if (songs.length === 0) {
+        // Get recently played songs
         const result = await db.query(`
           SELECT 
             s.*,
@@ -576,14 +620,46 @@ app.get('/api/users/:userId/recommendations', async (req, res) => {
           LEFT JOIN albums al ON s.album_id = al.id
           LEFT JOIN genres g ON s.genre_id = g.id
           LEFT JOIN user_favorite_songs ufs ON s.id = ufs.song_id AND ufs.user_id = $1
-          WHERE g.name = ANY($2)
-          ORDER BY RANDOM()
-          LIMIT 10
-        `, [userId, preferredGenres]);
+          WHERE s.id IN (
+            SELECT song_id 
+            FROM user_play_history 
+            WHERE user_id = $1 
+            ORDER BY played_at DESC 
+            LIMIT 10
+          )
+          ORDER BY (
+            SELECT played_at 
+            FROM user_play_history 
+            WHERE user_id = $1 AND song_id = s.id 
+            ORDER BY played_at DESC 
+            LIMIT 1
+          ) DESC
+        `, [userId]);
 
         songs = result.rows;
-        sectionTitle = 'Songs You Might Like';
-      } else {
+        sectionTitle = 'Recently Played';
+      }
+    } else {
+      // Get user's preferred genres
+      const genresResult = await db.query(
+        'SELECT preferred_genres FROM users WHERE id = $1',
+        [userId]
+      );
+      const preferredGenres = genresResult.rows[0]?.preferred_genres || [];
+
+      if (preferredGenres.length > 0) {
+        try {
+          // Weighted draw from the recommender's precomputed per-genre pools
+          const reply = await callRecommenderServer('cold-start', [preferredGenres.join(',')]);
+          songs = await markLikedSongs(userId, reply.result);
+          sectionTitle = 'Songs You Might Like';
+        } catch (error) {
+          console.error('Cold-start recommendations failed, falling back to popular songs:', error);
+          songs = [];
+        }
+      }
+
+      if (songs.length === 0) {
         // Fallback to popular songs
         const result = await db.query(`
           SELECT 
@@ -617,9 +693,12 @@ app.get('/api/users/:userId/recommendations', async (req, res) => {
 app.get('/api/search', async (req, res) => {
   try {
     const { q } = req.query;
-    if (!q) {
+    if (!q && !req.query.cursor) {
       return res.status(400).json({ error: 'Search query is required' });
     }
+    if (req.query.cursor || req.query.limit) {
+      return sendRecommenderPage(req, res, ['search', q]);
+    }
 
     // Call Python script for search
     const pythonProcess = spawn('python', ['recommender.py', 'search', `"${q}"`]);
@@ -657,12 +736,35 @@ app.get('/api/search', async (req, res) => {
 
 
 
+});
+
+// Search-as-you-type suggestions: song titles, artists and genres for a typed prefix
+app.get('/api/search/suggest', async (req, res) => {
+  try {
+    const q = String(req.query.q || '');
+    if (!q.trim()) {
+      return res.json([]);
+    }
+    // get_completions caps this at the completions it precomputes per prefix
+    const limit = parseInt(req.query.limit, 10) || 10;
+    const reply = await callRecommenderServer('complete', [q, limit]);
+    res.json(reply.result);
+  } catch (error) {
+    console.error('Suggest error:', error);
+    res.status(500).json({ error: 'Suggest failed' });
+  }
 });
 
 // Get song recommendations
 app.get('/api/songs/:id/recommendations', async (req, res) => {
   try {
     const { id } = req.params;
+    if (req.query.cursor || req.query.limit) {
+      return sendRecommenderPage(req, res, ['recommend', id]);
+    }
+    if (req.query.budgetMs) {
+      return sendBudgetedRecommendations(req, res, 'recommend', [id]);
+    }
 
     // Call Python script for recommendations
     const pythonProcess = spawn('python', ['recommender.py', 'recommend', id]);
@@ -701,6 +803,12 @@ app.get('/api/songs/:id/recommendations', async (req, res) => {
 app.get('/api/songs/:id/similar', async (req, res) => {
   try {
     const songId = req.params.id;
+    if (req.query.cursor || req.query.limit) {
+      return sendRecommenderPage(req, res, ['similar', songId]);
+    }
+    if (req.query.budgetMs) {
+      return sendBudgetedRecommendations(req, res, 'similar', [songId]);
+    }
     console.log('Fetching similar songs for song ID:', songId);
     
     const pythonProcess = spawn('python', ['recommender.py', 'similar', songId]);
@@ -798,18 +906,17 @@ app.post('/api/recognition/match', upload.single('audio'), async (req, res) => {
       return res.status(500).json({ error: 'Audio recognition service not properly configured' });
     }
     
-    const pythonProcess = spawn('python', [pythonScript, req.file.path]);
+    // Feature extraction and DTW matching both run in Python; only the top matches come back
+    const pythonProcess = spawn('python', [pythonScript, req.file.path, '--match', '--top', '5']);
     
     let output = '';
     let errorOutput = '';
     
     pythonProcess.stdout.on('data', (data) => {
-      console.log('Python stdout:', data.toString());
       output += data.toString();
     });
     
     pythonProcess.stderr.on('data', (data) => {
-      console.error('Python stderr:', data.toString());
       errorOutput += data.toString();
     });
     
@@ -829,50 +936,14 @@ app.post('/api/recognition/match', upload.single('audio'), async (req, res) => {
       }
       
       try {
-        // Parse the JSON output from Python script
-        const features = JSON.parse(output.trim());
-        console.log('Extracted features:', features);
-        
-        if (features.error) {
-          return res.status(500).json({ error: features.error });
-        }
-
-        // Get songs with features from database
-        console.log('Querying database for songs with features');
-        const result = await db.query(`
-          SELECT s.id, s.title, s.features, a.name as artist_name, s.image_url
-          FROM songs s
-          LEFT JOIN artists a ON s.artist_id = a.id
-          WHERE s.features IS NOT NULL
-        `);
+        const result = JSON.parse(output.trim());
         
-        console.log(`Found ${result.rows.length} songs with features`);
-        
-        const matches = [];
-        for (const song of result.rows) {
-          if (song.features) {
-            console.log('Comparing with song:', song.title);
-            console.log('Song features:', song.features);
-            
-            const similarity = computeSimilarity(features, song.features);
-            console.log(`Similarity for ${song.title}: ${similarity}`);
-            if (similarity > 0.5) {  // Lowered threshold due to DTW
-              matches.push({
-                id: song.id,
-                title: song.title,
-                artist_name: song.artist_name,
-                image_url: song.image_url,
-                similarity: similarity
-              });
-            }
-          }
+        if (result.error) {
+          return res.status(500).json({ error: result.error });
         }
         
-        // Sort matches by similarity
-        matches.sort((a, b) => b.similarity - a.similarity);
-        console.log('Top matches:', matches.slice(0, 5));
-        
-        res.json({ matches: matches.slice(0, 5) });
+        console.log('Top matches:', result.matches);
+        res.json({ matches: result.matches });
       } catch (error) {
         console.error('Error processing matches:', error);
         res.status(500).json({ error: 'Failed to process matches: ' + error.message });
@@ -933,71 +1004,145 @@ app.post('/api/search-history', async (req, res) => {
   }
 });
 
-// Helper function to compute similarity between audio features
-function computeSimilarity(features1, features2) {
-  try {
-    console.log('Comparing features:', {
-      features1: features1,
-      features2: features2
+// Run recommender.py with the given arguments and resolve with its parsed JSON output
+function runRecommender(args) {
+  return new Promise((resolve, reject) => {
+    const pythonProcess = spawn('python', ['recommender.py', ...args], { cwd: __dirname });
+    let data = '';
+    let error = '';
+
+    pythonProcess.stdout.on('data', (chunk) => {
+      data += chunk.toString();
     });
 
-    // Parse features if they're strings
-    const f1 = typeof features1 === 'string' ? JSON.parse(features1) : features1;
-    const f2 = typeof features2 === 'string' ? JSON.parse(features2) : features2;
-
-    // Convert features to arrays
-    const f1Array = [
-      ...f1.mfcc,
-      f1.tempo,
-      ...f1.chroma,
-      f1.spectral_rolloff,
-      f1.spectral_centroid,
-      f1.zero_crossing_rate
-    ];
-    const f2Array = [
-      ...f2.mfcc,
-      f2.tempo,
-      ...f2.chroma,
-      f2.spectral_rolloff,
-      f2.spectral_centroid,
-      f2.zero_crossing_rate
-    ];
-    
-    // Compute Dynamic Time Warping (DTW) distance
-    const dtwDistance = computeDTW(f1Array, f2Array);
-    
-    // Convert DTW distance to similarity score (lower distance = higher similarity)
-    const similarity = 1 / (1 + dtwDistance);
-    console.log('Computed similarity:', similarity);
-    return similarity;
+    pythonProcess.stderr.on('data', (chunk) => {
+      error += chunk.toString();
+    });
+
+    pythonProcess.on('close', (code) => {
+      if (code !== 0) {
+        return reject(new Error(error || `recommender.py exited with code ${code}`));
+      }
+      try {
+        resolve(JSON.parse(data));
+      } catch (e) {
+        reject(e);
+      }
+    });
+  });
+}
+
+// One long-lived `recommender.py serve` process for per-keystroke calls, which can't
+// afford a Python start-up each. Replies come back one JSON line per request, in order.
+let recommenderServer = null;
+
+function startRecommenderServer() {
+  const child = spawn('python', ['recommender.py', 'serve'], { cwd: __dirname });
+  const server = { child, pending: [], buffer: '' };
+  const stop = (error) => {
+    if (recommenderServer === server) recommenderServer = null;
+    server.pending.splice(0).forEach(({ reject }) => reject(error));
+  };
+
+  child.stdout.on('data', (chunk) => {
+    server.buffer += chunk.toString();
+    let newline;
+    while ((newline = server.buffer.indexOf('\n')) >= 0) {
+      const line = server.buffer.slice(0, newline);
+      server.buffer = server.buffer.slice(newline + 1);
+      const request = server.pending.shift();
+      if (!request) continue;
+      try {
+        const reply = JSON.parse(line);
+        if (reply.error) request.reject(new Error(reply.error));
+        else request.resolve(reply);
+      } catch (e) {
+        request.reject(e);
+      }
+    }
+  });
+  child.stderr.on('data', (chunk) => {
+    console.error('recommender.py serve:', chunk.toString());
+  });
+  child.stdin.on('error', stop);
+  child.on('error', stop);
+  child.on('close', (code) => stop(new Error(`recommender.py serve exited with code ${code}`)));
+  return server;
+}
+
+// Resolves with the whole reply: `result` plus e.g. `degradation` for budgeted requests
+function callRecommenderServer(command, args, options = {}) {
+  if (!recommenderServer) {
+    recommenderServer = startRecommenderServer();
+  }
+  const server = recommenderServer;
+  return new Promise((resolve, reject) => {
+    server.pending.push({ resolve, reject });
+    server.child.stdin.write(JSON.stringify({ command, args, ...options }) + '\n');
+  });
+}
+
+// Recommendations within ?budgetMs=N, from the resident recommender so no Python start-up
+// eats the budget. The degradation level it needed comes back in X-Recommendation-Degradation.
+async function sendBudgetedRecommendations(req, res, command, args) {
+  const budgetMs = Number(req.query.budgetMs);
+  if (!(budgetMs > 0)) {
+    return res.status(400).json({ error: 'budgetMs must be a positive number of milliseconds' });
+  }
+  try {
+    const reply = await callRecommenderServer(command, args, { budget_ms: budgetMs });
+    res.set('X-Recommendation-Degradation', reply.degradation);
+    res.json(reply.result);
   } catch (error) {
-    console.error('Error computing similarity:', error);
-    return 0.0;
+    console.error('Budgeted recommendations error:', error);
+    res.status(500).json({ error: 'Failed to get recommendations' });
   }
 }
 
-// Dynamic Time Warping implementation
-function computeDTW(seq1, seq2) {
-  const n = seq1.length;
-  const m = seq2.length;
-  
-  // Create cost matrix
-  const costMatrix = Array(n + 1).fill().map(() => Array(m + 1).fill(Infinity));
-  costMatrix[0][0] = 0;
-  
-  // Fill cost matrix
-  for (let i = 1; i <= n; i++) {
-    for (let j = 1; j <= m; j++) {
-      const cost = Math.abs(seq1[i - 1] - seq2[j - 1]);
-      costMatrix[i][j] = cost + Math.min(
-        costMatrix[i - 1][j],     // insertion
-        costMatrix[i][j - 1],     // deletion
-        costMatrix[i - 1][j - 1]  // match
-      );
+// Paged recommendations/search: ?limit=N ranks a list once and returns its first page with a
+// cursor; ?cursor=... returns the following page from that cached list
+async function sendRecommenderPage(req, res, args) {
+  try {
+    const { cursor, limit } = req.query;
+    const pageArgs = cursor ? ['page', cursor] : [...args];
+    if (limit) {
+      const pageSize = parseInt(limit, 10);
+      if (!(pageSize > 0)) {
+        return res.status(400).json({ error: 'limit must be a positive integer' });
+      }
+      pageArgs.push('--limit', String(pageSize));
     }
+    const page = await runRecommender(pageArgs);
+    res.json(page);
+  } catch (error) {
+    if (error.message.includes('Invalid cursor')) {
+      return res.status(400).json({ error: 'Invalid cursor' });
+    }
+    console.error('Error fetching page:', error);
+    res.status(500).json({ error: 'Failed to get page', details: error.message });
   }
-  
-  return costMatrix[n][m];
+}
+
+// Set is_liked on recommender results, which don't carry per-user fields
+async function markLikedSongs(userId, songs) {
+  if (songs.length === 0) return songs;
+  const likedResult = await db.query(
+    'SELECT song_id FROM user_favorite_songs WHERE user_id = $1 AND song_id = ANY($2)',
+    [userId, songs.map(song => song.id)]
+  );
+  const likedIds = new Set(likedResult.rows.map(row => row.song_id));
+  return songs.map(song => ({ ...song, is_liked: likedIds.has(song.id) }));
+}
+
+// Append a play/like/skip to the event log a resident recommender tails (RECOMMENDER_EVENTS_FILE).
+// Events default to the current time; skips pass their row's created_at.
+function recordRecommenderEvent(event) {
+  const logPath = process.env.RECOMMENDER_EVENTS_FILE;
+  if (!logPath) return;
+  const line = JSON.stringify({ timestamp: Date.now() / 1000, ...event }) + '\n';
+  fs.appendFile(logPath, line, (error) => {
+    if (error) console.error('Error writing recommender event:', error);
+  });
 }
 
 // Helper function to format timestamp
@@ -1030,32 +1175,49 @@ app.post('/api/songs/:id/skip', async (req, res) => {
     if (!userId || skipTimeSeconds === undefined) {
       return res.status(400).json({ error: 'Missing required parameters' });
     }
+    const skipTime = Math.round(Number(skipTimeSeconds));
+    if (!Number.isFinite(skipTime) || skipTime < 0) {
+      return res.status(400).json({ error: 'skipTimeSeconds must be a non-negative number' });
+    }
+    // Same buckets the recommender's collaborative and trending scores read
+    const skipType = skipTime < 30 ? 'quick' : skipTime < 120 ? 'mid' : 'late';
 
-    const conn = await db.getConnection();
+    const conn = await db.pool.connect();
     try {
       // Begin transaction
-      await conn.beginTransaction();
+      await conn.query('BEGIN');
+
+      // skip_history feeds the recommender
+      const skip = await conn.query(
+        `INSERT INTO skip_history (user_id, song_id, skip_type, skip_time) VALUES ($1, $2, $3, $4)
+         RETURNING EXTRACT(EPOCH FROM created_at) AS timestamp`,
+        [userId, id, skipType, skipTime]
+      );
 
       // Update or insert the skip record
       const query = `
         INSERT INTO user_song_interactions 
           (user_id, song_id, skip, skip_time_seconds, last_played) 
-        VALUES (?, ?, true, ?, NOW())
-        ON DUPLICATE KEY UPDATE 
+        VALUES ($1, $2, true, $3, NOW())
+        ON CONFLICT (user_id, song_id) DO UPDATE SET
           skip = true,
-          skip_time_seconds = ?,
+          skip_time_seconds = EXCLUDED.skip_time_seconds,
           last_played = NOW()
       `;
       
-      await conn.query(query, [userId, id, skipTimeSeconds, skipTimeSeconds]);
+      await conn.query(query, [userId, id, skipTime]);
 
       // Commit transaction
-      await conn.commit();
+      await conn.query('COMMIT');
+      recordRecommenderEvent({
+        type: 'skip', user_id: userId, song_id: id, skip_type: skipType,
+        timestamp: Number(skip.rows[0].timestamp)
+      });
       
       res.json({ message: 'Skip recorded successfully' });
     } catch (error) {
       // Rollback on error
-      await conn.rollback();
+      await conn.query('ROLLBACK');
       throw error;
     } finally {
       conn.release();
@@ -0,0 +1,81 @@
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+# Degradation levels, least degraded first:
+#   full             - every score term computed
+#   no_collaborative - skip history or collaborative scoring ran over budget; scored without it
+#   no_content       - content/taste similarity skipped; ranked by the remaining terms
+#   popular          - no time to score; served from the cached popularity list
+LEVELS = ('full', 'no_collaborative', 'no_content', 'popular')
+
+# Weight of the newest run in a stage's cost estimate
+COST_SMOOTHING = 0.2
+
+_costs: Dict[str, float] = {}
+_runs: Dict[str, int] = {}
+_costs_lock = threading.Lock()
+
+
+@contextmanager
+def measure(stage: str):
+    """Fold this run of `stage` into its cost estimate, budgeted request or not.
+
+    A stage's first run in a process pays for lazy imports and cold caches,
+    so it is left out of the estimate.
+    """
+    start = time.perf_counter()
+    yield
+    elapsed = time.perf_counter() - start
+    with _costs_lock:
+        runs = _runs[stage] = _runs.get(stage, 0) + 1
+        if runs == 1:
+            return
+        previous = _costs.get(stage)
+        _costs[stage] = elapsed if previous is None else previous + COST_SMOOTHING * (elapsed - previous)
+
+
+def stage_cost(stage: str) -> float:
+    """Recent cost of `stage` in seconds, 0 before it has run."""
+    return _costs.get(stage, 0.0)
+
+
+class LatencyBudget:
+    """Deadline for one request, and how far its answer had to degrade to meet it.
+
+    Optional stages ask affords() first, which compares the time left with
+    the stage's recent cost; stages that are skipped call degrade().
+    """
+
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+        self.deadline = time.perf_counter() + seconds
+        self.level = LEVELS[0]
+
+    @classmethod
+    def from_ms(cls, budget_ms) -> Optional['LatencyBudget']:
+        """A budget of `budget_ms` milliseconds, or None (no deadline) when not set."""
+        if budget_ms is None:
+            return None
+        budget_ms = float(budget_ms)
+        if budget_ms <= 0:
+            raise ValueError("Latency budget must be positive")
+        return cls(budget_ms / 1000)
+
+    def remaining(self) -> float:
+        return max(0.0, self.deadline - time.perf_counter())
+
+    def remaining_after(self, *stages: str) -> float:
+        """Time left once `stages` have had their usual cost, e.g. to bound a wait before them."""
+        return max(0.0, self.remaining() - sum(stage_cost(stage) for stage in stages))
+
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def affords(self, stage: str) -> bool:
+        return self.remaining() > stage_cost(stage)
+
+    def degrade(self, level: str):
+        if LEVELS.index(level) > LEVELS.index(self.level):
+            self.level = level
@@ -0,0 +1,307 @@
+import atexit
+import json
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter as StackCounter
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+
+from locks import file_lock
+
+logger = logging.getLogger(__name__)
+
+# Latency buckets in seconds, from sub-millisecond lookups to multi-second DSP
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def _label_key(labels: Dict[str, str]) -> LabelKey:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_labels(key: LabelKey, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(key) + ([extra] if extra else [])
+    if not pairs:
+        return ''
+    escaped = (v.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+
+def _format_bound(bound: float) -> str:
+    return '+Inf' if bound == float('inf') else repr(float(bound))
+
+
+class MetricsRegistry:
+    """In-process counters and latency histograms, exportable as Prometheus text."""
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._help: Dict[str, str] = {}
+        self._counters: Dict[str, Dict[LabelKey, float]] = {}
+        # name -> labels -> [per-bucket counts (last is +Inf), sum, count]
+        self._histograms: Dict[str, Dict[LabelKey, list]] = {}
+
+    def inc(self, name: str, amount: float = 1.0, help: str = '', **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._help.setdefault(name, help)
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0.0) + amount
+
+    def observe(self, name: str, value: float, help: str = '', **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._help.setdefault(name, help)
+            series = self._histograms.setdefault(name, {})
+            data = series.get(key)
+            if data is None:
+                data = series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            index = next((i for i, bound in enumerate(self.buckets) if value <= bound), len(self.buckets))
+            data[0][index] += 1
+            data[1] += value
+            data[2] += 1
+
+    def snapshot(self) -> dict:
+        """Plain-JSON copy of every series, suitable for merge()."""
+        with self._lock:
+            return {
+                'buckets': list(self.buckets),
+                'help': dict(self._help),
+                'counters': {name: [[list(map(list, key)), value] for key, value in series.items()]
+                             for name, series in self._counters.items()},
+                'histograms': {name: [[list(map(list, key)), [list(d[0]), d[1], d[2]]]
+                                      for key, d in series.items()]
+                               for name, series in self._histograms.items()},
+            }
+
+    def merge(self, snapshot: dict):
+        """Add another registry's snapshot into this one (same buckets required)."""
+        if tuple(snapshot.get('buckets', self.buckets)) != self.buckets:
+            raise ValueError('Cannot merge histograms with different bucket bounds')
+        with self._lock:
+            for name, text in snapshot.get('help', {}).items():
+                self._help.setdefault(name, text)
+            for name, series in snapshot.get('counters', {}).items():
+                target = self._counters.setdefault(name, {})
+                for key, value in series:
+                    key = tuple(map(tuple, key))
+                    target[key] = target.get(key, 0.0) + value
+            for name, series in snapshot.get('histograms', {}).items():
+                target = self._histograms.setdefault(name, {})
+                for key, (counts, total, count) in series:
+                    key = tuple(map(tuple, key))
+                    data = target.get(key)
+                    if data is None:
+                        target[key] = [list(counts), total, count]
+                    else:
+                        data[0] = [a + b for a, b in zip(data[0], counts)]
+                        data[1] += total
+                        data[2] += count
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def render_prometheus(self) -> str:
+        """Render every series in the Prometheus text exposition format."""
+        lines: List[str] = []
+        with self._lock:
+            for name in sorted(self._counters):
+                lines.append(f'# HELP {name} {self._help.get(name) or name}')
+                lines.append(f'# TYPE {name} counter')
+                for key, value in sorted(self._counters[name].items()):
+                    lines.append(f'{name}{_format_labels(key)} {value:g}')
+
+            bounds = self.buckets + (float('inf'),)
+            for name in sorted(self._histograms):
+                lines.append(f'# HELP {name} {self._help.get(name) or name}')
+                lines.append(f'# TYPE {name} histogram')
+                for key, (counts, total, count) in sorted(self._histograms[name].items()):
+                    cumulative = 0
+                    for bound, bucket_count in zip(bounds, counts):
+                        cumulative += bucket_count
+                        lines.append(f'{name}_bucket{_format_labels(key, ("le", _format_bound(bound)))} {cumulative}')
+                    lines.append(f'{name}_sum{_format_labels(key)} {total:.6f}')
+                    lines.append(f'{name}_count{_format_labels(key)} {count}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+
+
+@contextmanager
+def stage(name: str, component: str = 'recommender'):
+    """Time one pipeline stage into `<component>_stage_seconds{stage=name}`."""
+    start = time.perf_counter()
+    outcome = 'error'
+    try:
+        yield
+        outcome = 'ok'
+    finally:
+        elapsed = time.perf_counter() - start
+        registry.observe(f'{component}_stage_seconds', elapsed,
+                         help=f'Latency of {component} pipeline stages in seconds.', stage=name)
+        registry.inc(f'{component}_stage_total',
+                     help=f'{component} pipeline stage executions by outcome.', stage=name, outcome=outcome)
+
+
+def inc(name: str, amount: float = 1.0, component: str = 'recommender', **labels):
+    registry.inc(f'{component}_{name}', amount, **labels)
+
+
+class StackSampler:
+    """Samples one thread's Python stack on a timer, in flame-graph 'collapsed' form."""
+
+    def __init__(self, thread_id: int, interval: float = 0.005):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks: StackCounter = StackCounter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+                frame = frame.f_back
+            self.stacks[';'.join(reversed(stack))] += 1
+
+    def write_collapsed(self, path: str):
+        """Write `stack count` lines, readable by flamegraph.pl and speedscope."""
+        with open(path, 'w') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f'{stack} {count}\n')
+
+
+def _profile_threshold() -> Optional[float]:
+    value = os.getenv('PROFILE_SLOW_MS')
+    return float(value) / 1000 if value else None
+
+
+@contextmanager
+def request(name: str, component: str = 'recommender'):
+    """Time a whole request and, when PROFILE_SLOW_MS is set, profile it.
+
+    With profiling enabled the calling thread is sampled every PROFILE_INTERVAL_MS
+    (default 5 ms). Requests slower than PROFILE_SLOW_MS have their collapsed stacks
+    written to PROFILE_DIR (default: the temp directory); faster ones are discarded.
+    """
+    threshold = _profile_threshold()
+    sampler = None
+    if threshold is not None:
+        interval = float(os.getenv('PROFILE_INTERVAL_MS', '5')) / 1000
+        sampler = StackSampler(threading.get_ident(), interval)
+        sampler.start()
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        registry.observe(f'{component}_request_seconds', elapsed,
+                         help=f'End-to-end {component} request latency in seconds.', request=name)
+        if sampler is not None:
+            sampler.stop()
+            if elapsed >= threshold and sampler.stacks:
+                registry.inc(f'{component}_slow_requests_total',
+                             help=f'{component} requests slower than PROFILE_SLOW_MS.', request=name)
+                directory = os.getenv('PROFILE_DIR') or tempfile.gettempdir()
+                os.makedirs(directory, exist_ok=True)
+                path = os.path.join(directory, f'{component}-{name}-{int(time.time() * 1000)}-{os.getpid()}.folded')
+                try:
+                    sampler.write_collapsed(path)
+                    logger.info(f"Slow {component} request '{name}' took {elapsed:.3f}s, stacks written to {path}")
+                except OSError as e:
+                    logger.warning(f"Could not write profile {path}: {str(e)}")
+
+
+def write_prometheus(path: str):
+    """Fold this process's metrics into `path` and reset them.
+
+    The Node server spawns a Python process per request, so each process adds its
+    counts to a shared JSON state file (`path + '.state.json'`) under an exclusive
+    lock and re-renders the text file atomically. Point a node_exporter textfile
+    collector (or anything that reads Prometheus text) at `path`.
+    """
+    state_path = path + '.state.json'
+    lock_path = path + '.lock'
+    with file_lock(lock_path):
+        combined = MetricsRegistry(registry.buckets)
+        if os.path.exists(state_path):
+            try:
+                with open(state_path) as f:
+                    combined.merge(json.load(f))
+            except (ValueError, OSError) as e:
+                logger.warning(f"Discarding unreadable metrics state {state_path}: {str(e)}")
+        combined.merge(registry.snapshot())
+
+        for target, content in ((state_path, json.dumps(combined.snapshot())),
+                                (path, combined.render_prometheus())):
+            tmp_path = f'{target}.{os.getpid()}.tmp'
+            with open(tmp_path, 'w') as f:
+                f.write(content)
+            os.replace(tmp_path, target)
+        registry.reset()
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = registry.render_prometheus().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_http_server(port: int, host: str = '127.0.0.1') -> ThreadingHTTPServer:
+    """Serve GET /metrics from a daemon thread, for long-running processes."""
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name='metrics-http', daemon=True).start()
+    logger.info(f"Serving metrics on http://{host}:{port}/metrics")
+    return server
+
+
+def _flush_at_exit():
+    path = os.getenv('METRICS_FILE')
+    if path:
+        try:
+            write_prometheus(path)
+        except Exception as e:
+            logger.warning(f"Could not write metrics to {path}: {str(e)}")
+
+
+# Opt-in export: METRICS_FILE for per-process CLI runs, METRICS_PORT for resident ones
+atexit.register(_flush_at_exit)
+if os.getenv('METRICS_PORT'):
+    try:
+        start_http_server(int(os.getenv('METRICS_PORT')))
+    except OSError as e:
+        logger.warning(f"Could not start metrics endpoint: {str(e)}")
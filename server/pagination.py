@@ -0,0 +1,142 @@
+import base64
+import json
+import os
+import re
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+import numpy as np
+
+# Cached lists are named by random hex ids; cursors are checked against this before any file access
+LIST_ID = re.compile(r'[0-9a-f]{16}')
+
+CURSOR_FIELDS = {'command': str, 'args': list, 'offset': int, 'limit': int, 'list': str, 'catalog': str}
+
+
+def encode_cursor(state: dict) -> str:
+    """Opaque, URL-safe cursor for a page position (see CURSOR_FIELDS)."""
+    data = json.dumps(state, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(data).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str) -> dict:
+    """Inverse of encode_cursor(); ValueError for anything that isn't one of ours."""
+    try:
+        data = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        state = json.loads(data)
+    except (ValueError, TypeError) as e:
+        raise ValueError('Invalid cursor') from e
+    if not isinstance(state, dict) or any(not isinstance(state.get(field), kind)
+                                          for field, kind in CURSOR_FIELDS.items()):
+        raise ValueError('Invalid cursor')
+    if state['offset'] < 0 or state['limit'] <= 0 or not LIST_ID.fullmatch(state['list']):
+        raise ValueError('Invalid cursor')
+    return state
+
+
+class RankedListCache:
+    """Ranked song-id lists behind pagination cursors, bounded by size and age.
+
+    Lists are kept in an in-process LRU and also written to `directory` as
+    small .npy files, so a cursor handed out by one per-request CLI process
+    can be served by the next. Both copies expire after `ttl` seconds, and
+    the oldest lists are dropped once their total size passes `max_bytes`.
+    """
+
+    def __init__(self, directory: Optional[str], max_bytes: int = 32 << 20, ttl: float = 900.0,
+                 prune_interval: float = 60.0):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.prune_interval = prune_interval
+        self._lists: 'OrderedDict[str, tuple]' = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def put(self, ids: np.ndarray) -> str:
+        ids = np.ascontiguousarray(ids, dtype=np.int32)
+        list_id = secrets.token_hex(8)
+        with self._lock:
+            self._lists[list_id] = (ids, time.time())
+            self._bytes += ids.nbytes
+            self._evict(time.time())
+        if self.directory is not None:
+            try:
+                os.makedirs(self.directory, exist_ok=True)
+                path = os.path.join(self.directory, f'{list_id}.npy')
+                tmp_path = f'{path}.{os.getpid()}.tmp'
+                with open(tmp_path, 'wb') as f:
+                    np.save(f, ids)
+                os.replace(tmp_path, path)
+                self._prune_directory()
+            except OSError:
+                # Still usable from memory; only other processes miss it
+                pass
+        return list_id
+
+    def get(self, list_id: str) -> Optional[np.ndarray]:
+        """The list behind a cursor, or None if it is unknown or older than the TTL."""
+        if not LIST_ID.fullmatch(list_id):
+            return None
+        now = time.time()
+        with self._lock:
+            self._evict(now)
+            entry = self._lists.get(list_id)
+            if entry is not None and now - entry[1] <= self.ttl:
+                self._lists.move_to_end(list_id)
+                return entry[0]
+            if entry is not None:
+                del self._lists[list_id]
+                self._bytes -= entry[0].nbytes
+                return None
+        if self.directory is None:
+            return None
+        path = os.path.join(self.directory, f'{list_id}.npy')
+        try:
+            if now - os.path.getmtime(path) > self.ttl:
+                return None
+            return np.load(path)
+        except (OSError, ValueError):
+            return None
+
+    def _evict(self, now: float):
+        while self._lists:
+            list_id, (ids, created) = next(iter(self._lists.items()))
+            if self._bytes <= self.max_bytes and now - created <= self.ttl:
+                break
+            del self._lists[list_id]
+            self._bytes -= ids.nbytes
+
+    def _prune_directory(self):
+        # At most once per prune_interval across processes, tracked by a marker file's mtime
+        marker = os.path.join(self.directory, '.pruned')
+        now = time.time()
+        try:
+            if now - os.path.getmtime(marker) < self.prune_interval:
+                return
+        except OSError:
+            pass
+        with open(marker, 'w'):
+            pass
+
+        entries = []
+        for entry in os.scandir(self.directory):
+            if not entry.name.endswith('.npy'):
+                continue
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+        entries.sort(reverse=True)
+        total = 0
+        for mtime, size, path in entries:
+            total += size
+            if now - mtime > self.ttl or total > self.max_bytes:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
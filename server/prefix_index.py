@@ -0,0 +1,177 @@
+import re
+import unicodedata
+from typing import Dict, List, Sequence
+
+import numpy as np
+
+# Keys are cut to this many UTF-8 bytes; longer typed prefixes are matched on their first bytes
+MAX_KEY_BYTES = 32
+
+# Prefixes matching more keys than this get their top completions precomputed
+PRECOMPUTE_ABOVE = 256
+
+# Completions stored per precomputed prefix
+TOP_K = 20
+
+# Suggestion kinds, in suggestion-index order: every song title, then artists, then genres
+KINDS = ('song', 'artist', 'genre')
+
+NON_WORD = re.compile(r'[^\w]+')
+
+
+def normalize(text, keep_trailing_space: bool = False) -> str:
+    """Lower-case, accent-free words separated by single spaces.
+
+    A trailing space is kept on request, so a typed "love " only matches
+    "love" as a whole word.
+    """
+    text = str(text or '')
+    if not text.isascii():
+        text = unicodedata.normalize('NFKD', text)
+        text = ''.join(ch for ch in text if not unicodedata.combining(ch))
+    normalized = ' '.join(NON_WORD.sub(' ', text.lower()).split())
+    if keep_trailing_space and normalized and NON_WORD.match(text[-1]):
+        normalized += ' '
+    return normalized
+
+
+def word_starts(label: str) -> List[bytes]:
+    """Keys for one label: the normalised text from every word start ("in time ", "time ", ...).
+
+    The trailing space lets a typed "love " match a label that ends in "love".
+    """
+    words = normalize(label).split(' ')
+    return [(' '.join(words[i:]) + ' ').encode()[:MAX_KEY_BYTES] for i in range(len(words)) if words[i]]
+
+
+class PrefixIndex:
+    """Typeahead completions over song titles, artist names and genres.
+
+    Every word start of every label is a key in one sorted bytes array, so
+    the keys under a prefix are a contiguous range found by binary search.
+    Prefixes whose range holds more than PRECOMPUTE_ABOVE keys (the nodes
+    near the top of the implied trie) store their TOP_K most popular
+    suggestions at build time; any other prefix has a small range that is
+    ranked on the fly. Either way a lookup touches at most a few hundred keys.
+
+    All state is flat arrays (see arrays()), so the index is saved with the
+    catalog snapshot it was built from and memory-mapped back.
+    """
+
+    def __init__(self, keys: np.ndarray, key_suggestions: np.ndarray, popularity: np.ndarray,
+                 label_data: np.ndarray, label_offsets: np.ndarray, counts: Sequence[int],
+                 prefixes: np.ndarray, prefix_top: np.ndarray):
+        self.keys = keys
+        self.key_suggestions = key_suggestions
+        self.popularity = popularity
+        self.label_data = label_data
+        self.label_offsets = label_offsets
+        self.counts = [int(count) for count in counts]
+        self.prefixes = prefixes
+        self.prefix_top = prefix_top
+
+    @classmethod
+    def build(cls, titles: Sequence[str], plays: np.ndarray, artist_codes: np.ndarray, artists: List[str],
+              genre_codes: np.ndarray, genres: List[str]) -> 'PrefixIndex':
+        """Index one catalog snapshot; artists and genres rank by their songs' total plays."""
+        plays = np.asarray(plays, dtype=np.float64)
+        labels = [str(title or '') for title in titles] + list(artists) + list(genres)
+        counts = [len(titles), len(artists), len(genres)]
+        popularity = np.concatenate([
+            plays,
+            np.bincount(artist_codes[artist_codes >= 0], weights=plays[artist_codes >= 0], minlength=len(artists)),
+            np.bincount(genre_codes[genre_codes >= 0], weights=plays[genre_codes >= 0], minlength=len(genres)),
+        ])
+
+        encoded = [label.encode() for label in labels]
+        label_offsets = np.concatenate([[0], np.cumsum([len(data) for data in encoded])]).astype(np.int64)
+        label_data = np.frombuffer(b''.join(encoded), dtype=np.uint8).copy()
+
+        key_lists = [word_starts(label) for label in labels]
+        key_suggestions = np.repeat(np.arange(len(labels), dtype=np.int32), [len(keys) for keys in key_lists])
+        keys = np.array([key for keys in key_lists for key in keys], dtype=f'S{MAX_KEY_BYTES}')
+        order = np.argsort(keys, kind='stable')
+        keys, key_suggestions = keys[order], key_suggestions[order]
+
+        prefixes, prefix_top = cls._precompute(keys, key_suggestions, popularity)
+        return cls(keys, key_suggestions, popularity, label_data, label_offsets, counts, prefixes, prefix_top)
+
+    @staticmethod
+    def _precompute(keys: np.ndarray, key_suggestions: np.ndarray, popularity: np.ndarray):
+        # Walk the prefix lengths down the trie, keeping only the ranges that are still large
+        lengths = np.char.str_len(keys)
+        active = np.arange(len(keys))
+        all_prefixes, all_top = [], []
+        for length in range(1, MAX_KEY_BYTES + 1):
+            active = active[lengths[active] >= length]
+            if len(active) <= PRECOMPUTE_ABOVE:
+                break
+            heads = keys[active].astype(f'S{length}')
+            starts = np.flatnonzero(np.concatenate([[True], heads[1:] != heads[:-1]]))
+            sizes = np.diff(np.append(starts, len(heads)))
+            large = np.repeat(sizes > PRECOMPUTE_ABOVE, sizes)
+            if not large.any():
+                break
+            active, heads = active[large], heads[large]
+            group_starts = np.flatnonzero(np.concatenate([[True], heads[1:] != heads[:-1]]))
+            groups = np.repeat(np.arange(len(group_starts)), np.diff(np.append(group_starts, len(heads))))
+
+            # Distinct suggestions per prefix, most popular first, first TOP_K of each
+            pairs = np.unique(groups.astype(np.int64) << 32 | key_suggestions[active])
+            pair_groups, suggestions = pairs >> 32, (pairs & 0xffffffff).astype(np.int32)
+            order = np.lexsort((suggestions, -popularity[suggestions], pair_groups))
+            pair_groups, suggestions = pair_groups[order], suggestions[order]
+            first = np.searchsorted(pair_groups, np.arange(len(group_starts)))
+            rank = np.arange(len(pair_groups)) - first[pair_groups]
+            top = np.full((len(group_starts), TOP_K), -1, dtype=np.int32)
+            keep = rank < TOP_K
+            top[pair_groups[keep], rank[keep]] = suggestions[keep]
+            all_prefixes.append(heads[group_starts].astype(f'S{MAX_KEY_BYTES}'))
+            all_top.append(top)
+        if not all_prefixes:
+            return np.array([], dtype=f'S{MAX_KEY_BYTES}'), np.empty((0, TOP_K), dtype=np.int32)
+        prefixes = np.concatenate(all_prefixes)
+        order = np.argsort(prefixes, kind='stable')
+        return prefixes[order], np.concatenate(all_top)[order]
+
+    def arrays(self) -> Dict[str, np.ndarray]:
+        return {
+            'keys': self.keys,
+            'key_suggestions': self.key_suggestions,
+            'popularity': self.popularity,
+            'label_data': self.label_data,
+            'label_offsets': self.label_offsets,
+            'prefixes': self.prefixes,
+            'prefix_top': self.prefix_top,
+        }
+
+    def __len__(self):
+        return len(self.keys)
+
+    def complete(self, text: str, limit: int = 10) -> np.ndarray:
+        """Suggestion indices for a typed prefix, most popular first."""
+        prefix = normalize(text, keep_trailing_space=True).encode()[:MAX_KEY_BYTES]
+        if not prefix or limit <= 0:
+            return np.array([], dtype=np.int32)
+        if limit <= TOP_K:
+            row = int(np.searchsorted(self.prefixes, prefix))
+            if row < len(self.prefixes) and self.prefixes[row] == prefix:
+                top = self.prefix_top[row]
+                return top[top >= 0][:limit]
+        low = int(np.searchsorted(self.keys, prefix, side='left'))
+        high = int(np.searchsorted(self.keys, prefix + b'\xff', side='left'))
+        suggestions = np.unique(self.key_suggestions[low:high])
+        order = np.lexsort((suggestions, -self.popularity[suggestions]))
+        return suggestions[order[:limit]]
+
+    def kind(self, suggestion: int) -> tuple:
+        """(kind, index within that kind) for a suggestion index."""
+        for kind, count in zip(KINDS, self.counts):
+            if suggestion < count:
+                return kind, suggestion
+            suggestion -= count
+        raise IndexError('Suggestion index out of range')
+
+    def label(self, suggestion: int) -> str:
+        start, end = self.label_offsets[suggestion], self.label_offsets[suggestion + 1]
+        return bytes(self.label_data[start:end]).decode()
@@ -0,0 +1,577 @@
+import argparse
+import json
+import logging
+import os
+import subprocess
+import sys
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from locks import file_lock
+
+logger = logging.getLogger(__name__)
+
+
+# Frames kept per song when matching chroma sequences
+CHROMA_SEQUENCE_FRAMES = 64
+
+# Sakoe-Chiba band half-width as a fraction of the sequence length
+DTW_BAND_FRACTION = 0.1
+
+SEQUENCE_INDEX_DIR = os.getenv('RECOGNITION_INDEX_DIR',
+                               os.path.join(os.path.dirname(os.path.abspath(__file__)), 'artifacts', 'recognition'))
+
+
+# mfcc (20), tempo, chroma (12), spectral rolloff, spectral centroid, zero crossing rate
+FEATURE_VECTOR_SIZE = 36
+
+
+def feature_sequence(features: Dict[str, Any]) -> Optional[np.ndarray]:
+    """The summary feature vector the match endpoint used to compare, as a (36, 1) sequence."""
+    try:
+        values = [*features['mfcc'], features['tempo'], *features['chroma'],
+                  features['spectral_rolloff'], features['spectral_centroid'], features['zero_crossing_rate']]
+        sequence = np.asarray(values, dtype=np.float32)[:, None]
+    except (KeyError, TypeError, ValueError):
+        return None
+    return sequence if np.isfinite(sequence).all() else None
+
+
+def chroma_sequence(features: Dict[str, Any]) -> Optional[np.ndarray]:
+    """The song's (frames, 12) chroma sequence, if its features include one."""
+    try:
+        sequence = np.asarray(features['chroma_sequence'], dtype=np.float32)
+    except (KeyError, TypeError, ValueError):
+        return None
+    if sequence.ndim != 2 or sequence.shape[1] != 12 or len(sequence) < 2 or not np.isfinite(sequence).all():
+        return None
+    return resample_sequence(sequence, CHROMA_SEQUENCE_FRAMES)
+
+
+def segment_sequences(features: Dict[str, Any]) -> Optional[np.ndarray]:
+    """The song's per-segment summary vectors (see segment_features) as (segments, 36, 1) sequences.
+
+    These are stretches of audio along the track, unrelated to the storage
+    segments of a SegmentedIndex.
+    """
+    try:
+        matrix = np.asarray(features['segments'], dtype=np.float32)
+    except (KeyError, TypeError, ValueError):
+        return None
+    if matrix.ndim != 2 or len(matrix) == 0 or matrix.shape[1] != FEATURE_VECTOR_SIZE or not np.isfinite(matrix).all():
+        return None
+    return matrix[:, :, None]
+
+
+def resample_sequence(sequence: np.ndarray, length: int) -> np.ndarray:
+    """Linearly rescale a (frames, dims) sequence in time to exactly `length` frames."""
+    if len(sequence) == length:
+        return sequence.astype(np.float32)
+    source = np.linspace(0, 1, len(sequence))
+    target = np.linspace(0, 1, length)
+    return np.stack([np.interp(target, source, sequence[:, d]) for d in range(sequence.shape[1])],
+                    axis=1).astype(np.float32)
+
+
+def query_envelope(query: np.ndarray, band: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Upper and lower envelope of the query over a +/- band window, per dimension."""
+    padded_max = np.pad(query, ((band, band), (0, 0)), constant_values=-np.inf)
+    padded_min = np.pad(query, ((band, band), (0, 0)), constant_values=np.inf)
+    windows = 2 * band + 1
+    upper = np.lib.stride_tricks.sliding_window_view(padded_max, windows, axis=0).max(axis=-1)
+    lower = np.lib.stride_tricks.sliding_window_view(padded_min, windows, axis=0).min(axis=-1)
+    return upper, lower
+
+
+def lb_kim(query: np.ndarray, candidates: np.ndarray) -> np.ndarray:
+    """First and last frames are on every warping path, so their costs bound DTW from below."""
+    bound = np.abs(candidates[:, 0] - query[0]).sum(axis=-1)
+    if len(query) > 1:
+        bound += np.abs(candidates[:, -1] - query[-1]).sum(axis=-1)
+    return bound
+
+
+def lb_keogh(upper: np.ndarray, lower: np.ndarray, candidates: np.ndarray) -> np.ndarray:
+    """Distance from each candidate frame to the query's band envelope (Keogh 2002)."""
+    return (np.maximum(candidates - upper, 0) + np.maximum(lower - candidates, 0)).sum(axis=(1, 2))
+
+
+def dtw_band(query: np.ndarray, candidates: np.ndarray, band: int, abandon_above: float = np.inf) -> np.ndarray:
+    """L1 DTW of one query against many equal-length candidates inside a Sakoe-Chiba band.
+
+    Every candidate advances row by row together. A candidate whose cheapest cell
+    in a row already exceeds `abandon_above` can't finish below it and is dropped
+    (its distance is returned as inf).
+    """
+    n, m = len(query), candidates.shape[1]
+    distances = np.full(len(candidates), np.inf)
+    alive = np.arange(len(candidates))
+    previous = np.full((len(candidates), m + 1), np.inf)
+    previous[:, 0] = 0
+    for i in range(1, n + 1):
+        lo, hi = max(1, i - band), min(m, i + band)
+        if lo > hi:
+            return distances
+        cost = np.abs(candidates[alive, lo - 1:hi] - query[i - 1]).sum(axis=-1)
+        from_above = np.minimum(previous[:, lo - 1:hi], previous[:, lo:hi + 1])
+        current = np.full_like(previous, np.inf)
+        for offset, j in enumerate(range(lo, hi + 1)):
+            current[:, j] = cost[:, offset] + np.minimum(from_above[:, offset], current[:, j - 1])
+        keep = current[:, lo:hi + 1].min(axis=1) <= abandon_above
+        if not keep.all():
+            current, alive = current[keep], alive[keep]
+            if len(alive) == 0:
+                return distances
+        previous = current
+    distances[alive] = previous[:, m]
+    return distances
+
+
+class SequenceIndex:
+    """Equal-length per-song sequences packed into one float16 array for DTW matching.
+
+    Search orders candidates by max(LB_Kim, LB_Keogh), runs banded DTW on them in
+    batches, stops once the next lower bound can't beat the current top-N, and
+    abandons candidates early inside each batch.
+    """
+
+    def __init__(self, song_ids: np.ndarray, sequences: np.ndarray):
+        self.song_ids = np.asarray(song_ids, dtype=np.int64)
+        self.sequences = np.asarray(sequences, dtype=np.float16)
+
+    def __len__(self):
+        return len(self.song_ids)
+
+    @property
+    def length(self) -> int:
+        return self.sequences.shape[1]
+
+    @classmethod
+    def from_sequences(cls, items: List[Tuple[int, np.ndarray]]) -> Optional['SequenceIndex']:
+        if not items:
+            return None
+        length = max(len(sequence) for _, sequence in items)
+        sequences = np.stack([resample_sequence(sequence, length) for _, sequence in items])
+        return cls(np.array([song_id for song_id, _ in items]), sequences)
+
+    def save(self, path: str):
+        tmp_path = f'{path}.{os.getpid()}.tmp.npz'
+        np.savez(tmp_path, song_ids=self.song_ids, sequences=self.sequences)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> 'SequenceIndex':
+        with np.load(path) as data:
+            return cls(data['song_ids'], data['sequences'])
+
+    def search(self, query: np.ndarray, top_n: int = 5, band_fraction: float = DTW_BAND_FRACTION,
+               batch_size: int = 512, chunk_size: int = 4096, live: Optional[np.ndarray] = None,
+               threshold: float = np.inf) -> Tuple[List[Tuple[int, float]], Dict[str, int]]:
+        """Top-N (song_id, DTW distance) pairs, nearest first, plus pruning counts.
+
+        Songs stored as several rows are ranked by their nearest row.
+
+        Rows where `live` is False are skipped. Only distances below `threshold`
+        are returned, which lets a caller searching several indexes carry its
+        current N-th best distance from one to the next.
+        """
+        length = self.length
+        query = resample_sequence(np.asarray(query, dtype=np.float32), length)
+        band = max(1, int(np.ceil(band_fraction * length)))
+        upper, lower = query_envelope(query, band)
+
+        # Lower bounds for every song, in chunks so only a slice is ever float32
+        bounds = np.empty(len(self), dtype=np.float64)
+        for start in range(0, len(self), chunk_size):
+            chunk = self.sequences[start:start + chunk_size].astype(np.float32)
+            bounds[start:start + chunk_size] = np.maximum(lb_kim(query, chunk), lb_keogh(upper, lower, chunk))
+        candidates = len(self)
+        if live is not None:
+            bounds[~live] = np.inf
+            candidates = int(live.sum())
+
+        order = np.argsort(bounds, kind='stable')[:candidates]
+        best_ids = np.array([], dtype=np.int64)
+        best_distances = np.array([], dtype=np.float64)
+        stats = {'candidates': candidates, 'pruned': 0, 'abandoned': 0, 'full_dtw': 0}
+        limit = threshold
+        # Small first batches tighten the top-N threshold before the bulk is touched
+        start, size = 0, max(2 * top_n, 16)
+        while start < len(order):
+            threshold = best_distances[-1] if len(best_distances) >= top_n else limit
+            window = order[start:start + size]
+            start, size = start + size, min(2 * size, batch_size)
+            batch = window[bounds[window] < threshold]
+            if len(batch) == 0:
+                # Bounds are sorted, so nothing later can beat the current top-N
+                stats['pruned'] = candidates - stats['full_dtw'] - stats['abandoned']
+                break
+            stats['pruned'] += len(window) - len(batch)
+
+            distances = dtw_band(query, self.sequences[batch].astype(np.float32), band, threshold)
+            finished = np.isfinite(distances)
+            stats['full_dtw'] += int(finished.sum())
+            stats['abandoned'] += int((~finished).sum())
+
+            best_ids = np.concatenate([best_ids, batch[finished]])
+            best_distances = np.concatenate([best_distances, distances[finished]])
+            # A song with several rows (audio segments) counts once, at its nearest row
+            ranked = np.argsort(best_distances, kind='stable')
+            _, first = np.unique(self.song_ids[best_ids[ranked]], return_index=True)
+            keep = ranked[np.sort(first)][:top_n]
+            best_ids, best_distances = best_ids[keep], best_distances[keep]
+
+        return [(int(self.song_ids[i]), float(d)) for i, d in zip(best_ids, best_distances)], stats
+
+
+# Sequence kinds kept per song, and how each is read from a features dict
+SEQUENCE_KINDS = {
+    'vector': feature_sequence,
+    'chroma': chroma_sequence,
+    'segments': segment_sequences,
+}
+
+# Kinds whose query is read differently from what is indexed: a recording's summary
+# vector is compared with every audio segment of each song, so the best segment wins
+SEQUENCE_QUERIES = {
+    'segments': feature_sequence,
+}
+
+def rank_matches(indexes: Dict[str, Any], features: Dict[str, Any], top_n: int = 5,
+                 min_similarity: float = 0.5) -> Tuple[List[Tuple[float, int]], Dict[str, Dict[str, int]]]:
+    """Top-N (similarity, song_id) pairs over every sequence kind, plus each kind's search stats.
+
+    Similarity is 1 / (1 + distance) as the Node matcher computed it. Chroma
+    sequence distances are divided by the sequence length first, so all
+    kinds land on a comparable scale; a song matched by several keeps its best.
+    """
+    similarities: Dict[int, float] = {}
+    stats = {}
+    for kind, extract in SEQUENCE_KINDS.items():
+        query = SEQUENCE_QUERIES.get(kind, extract)(features)
+        index = indexes.get(kind)
+        if query is None or index is None:
+            continue
+        results, stats[kind] = index.search(query, top_n)
+        scale = index.length if kind == 'chroma' else 1
+        for song_id, distance in results:
+            similarity = 1.0 / (1.0 + distance / scale)
+            similarities[song_id] = max(similarity, similarities.get(song_id, 0.0))
+
+    ranked = sorted(((similarity, song_id) for song_id, similarity in similarities.items()
+                     if similarity > min_similarity), reverse=True)[:top_n]
+    return ranked, stats
+
+
+# Segments at one level are merged into one at the next once there are this many
+SEGMENT_FANOUT = 8
+
+# Everything is merged into one segment once this share of stored rows is dead
+DEAD_ROW_FRACTION = 0.25
+
+# Rows copied per step while writing a merged segment
+MERGE_CHUNK_ROWS = 8192
+
+
+class SegmentedIndex:
+    """A SequenceIndex split into immutable, memory-mapped segments (LSM-style).
+
+    Every add() writes a new small segment and is searchable as soon as the
+    manifest names it. A song's current rows (one sequence, or one per audio
+    segment) are those in the newest segment holding it; delete() records a
+    tombstone that hides every older row of the song. compact() merges runs of
+    same-level segments into one segment a level up, dropping dead rows, and
+    merges everything once too many rows are dead.
+    Each level is a contiguous run in segment order, so merges never change
+    which row is current.
+
+    The manifest is the only mutable file and is replaced atomically under a
+    lock; readers re-read it when its version changes and map the segments it
+    lists. Sequence numbers order segments and tombstones on one counter.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.version = None
+        self.length = None
+        self.segments: List[Tuple[Dict[str, Any], SequenceIndex, np.ndarray]] = []
+        self.refresh()
+
+    @property
+    def manifest_path(self) -> str:
+        return os.path.join(self.directory, 'manifest.json')
+
+    def _paths(self, name: str) -> Tuple[str, str]:
+        return (os.path.join(self.directory, f'{name}.ids.npy'),
+                os.path.join(self.directory, f'{name}.sequences.npy'))
+
+    def _read_manifest(self) -> Dict[str, Any]:
+        try:
+            with open(self.manifest_path) as f:
+                manifest = json.load(f)
+        except FileNotFoundError:
+            return {'version': 0, 'length': None, 'dims': None, 'next_seq': 1, 'next_file': 1,
+                    'segments': [], 'tombstones': {}}
+        manifest['tombstones'] = {int(song_id): seq for song_id, seq in manifest['tombstones'].items()}
+        return manifest
+
+    def _write_manifest(self, manifest: Dict[str, Any]):
+        manifest['version'] += 1
+        tmp_path = f'{self.manifest_path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, self.manifest_path)
+
+    @contextmanager
+    def _locked_manifest(self):
+        with file_lock(os.path.join(self.directory, 'manifest.lock')):
+            manifest = self._read_manifest()
+            yield manifest
+
+    def refresh(self):
+        """Pick up segments and tombstones written since the last refresh."""
+        for attempt in range(3):
+            manifest = self._read_manifest()
+            if manifest['version'] == self.version:
+                return
+            try:
+                opened = {entry['name']: index for entry, index, _ in self.segments}
+                segments = []
+                for entry in manifest['segments']:
+                    index = opened.get(entry['name'])
+                    if index is None:
+                        ids_path, sequences_path = self._paths(entry['name'])
+                        index = SequenceIndex(np.load(ids_path, mmap_mode='r'),
+                                              np.load(sequences_path, mmap_mode='r'))
+                    segments.append((entry, index))
+                break
+            except FileNotFoundError:
+                # A merge replaced these segments after the manifest was read
+                if attempt == 2:
+                    raise
+        masks = live_masks([(entry['seq'], index.song_ids) for entry, index in segments], manifest['tombstones'])
+        self.segments = [(entry, index, mask) for (entry, index), mask in zip(segments, masks)]
+        self.version = manifest['version']
+        self.length = manifest['length']
+        self.tombstones = manifest['tombstones']
+
+    def __len__(self):
+        return sum(int(mask.sum()) for _, _, mask in self.segments)
+
+    @property
+    def stored_rows(self) -> int:
+        return sum(len(index) for _, index, _ in self.segments)
+
+    def live_ids(self) -> np.ndarray:
+        parts = [index.song_ids[mask] for _, index, mask in self.segments]
+        return np.unique(np.concatenate(parts)) if parts else np.array([], dtype=np.int64)
+
+    def add(self, items: Iterable[Tuple[int, np.ndarray]]):
+        """Write one new segment holding these (song_id, sequence) pairs.
+
+        A (rows, frames, dims) array stores several rows for one song.
+        """
+        latest = {}
+        for song_id, sequence in items:
+            sequence = np.asarray(sequence, dtype=np.float32)
+            latest[int(song_id)] = sequence if sequence.ndim == 3 else sequence[None]
+        if not latest:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        with self._locked_manifest() as manifest:
+            if manifest['length'] is None:
+                manifest['length'] = max(rows.shape[1] for rows in latest.values())
+                manifest['dims'] = next(iter(latest.values())).shape[2]
+            if any(rows.shape[2] != manifest['dims'] for rows in latest.values()):
+                raise ValueError(f"Sequences must have {manifest['dims']} dimensions")
+
+            name = f"{manifest['next_file']:08d}"
+            ids_path, sequences_path = self._paths(name)
+            song_ids = np.repeat(np.fromiter(latest, dtype=np.int64, count=len(latest)),
+                                 [len(rows) for rows in latest.values()])
+            sequences = np.stack([resample_sequence(sequence, manifest['length'])
+                                  for rows in latest.values() for sequence in rows]).astype(np.float16)
+            np.save(ids_path, song_ids)
+            np.save(sequences_path, sequences)
+
+            manifest['segments'].append({'name': name, 'seq': manifest['next_seq'], 'rows': len(song_ids), 'level': 0})
+            manifest['next_seq'] += 1
+            manifest['next_file'] += 1
+            self._write_manifest(manifest)
+
+    def delete(self, song_ids: Iterable[int]):
+        """Tombstone every row currently stored for these songs."""
+        song_ids = [int(song_id) for song_id in song_ids]
+        if not song_ids:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        with self._locked_manifest() as manifest:
+            for song_id in song_ids:
+                manifest['tombstones'][song_id] = manifest['next_seq']
+            manifest['next_seq'] += 1
+            self._write_manifest(manifest)
+
+    def search(self, query: np.ndarray, top_n: int = 5,
+               band_fraction: float = DTW_BAND_FRACTION) -> Tuple[List[Tuple[int, float]], Dict[str, int]]:
+        """Top-N over every segment; the N-th best so far prunes the segments after it."""
+        self.refresh()
+        best: List[Tuple[float, int]] = []
+        stats = {'candidates': 0, 'pruned': 0, 'abandoned': 0, 'full_dtw': 0, 'segments': len(self.segments)}
+        for entry, index, mask in sorted(self.segments, key=lambda segment: -segment[2].sum()):
+            threshold = best[-1][0] if len(best) >= top_n else np.inf
+            results, segment_stats = index.search(query, top_n, band_fraction, live=mask, threshold=threshold)
+            for key in ('candidates', 'pruned', 'abandoned', 'full_dtw'):
+                stats[key] += segment_stats[key]
+            # A song's live rows are all in one segment, so it appears here at most once
+            best = sorted(best + [(distance, song_id) for song_id, distance in results])[:top_n]
+        return [(song_id, distance) for distance, song_id in best], stats
+
+    def _plan(self, manifest: Dict[str, Any], full: bool) -> List[Dict[str, Any]]:
+        segments = manifest['segments']
+        stored = sum(entry['rows'] for entry in segments)
+        dead = stored - len(self) if self.version == manifest['version'] else 0
+        if full or (stored and dead / stored > DEAD_ROW_FRACTION):
+            if len(segments) > 1 or dead or manifest['tombstones']:
+                return list(segments)
+            return []
+        for level in sorted({entry['level'] for entry in segments}):
+            run = [entry for entry in segments if entry['level'] == level]
+            if len(run) >= SEGMENT_FANOUT:
+                return run
+        return []
+
+    def needs_compaction(self) -> bool:
+        self.refresh()
+        return bool(self._plan(self._read_manifest(), full=False))
+
+    def compact(self, full: bool = False) -> int:
+        """Merge segments until none are due; returns the number of merges.
+
+        Only one process compacts at a time; others return 0 straight away.
+        Writers aren't blocked while a merged segment is being written.
+        """
+        merges = 0
+        with file_lock(os.path.join(self.directory, 'compact.lock'), blocking=False) as acquired:
+            if not acquired:
+                return 0
+            while True:
+                with self._locked_manifest() as manifest:
+                    # Refresh under the lock so the run's segments are all mapped
+                    self.refresh()
+                    run = self._plan(manifest, full and merges == 0)
+                    if not run:
+                        return merges
+                    name = f"{manifest['next_file']:08d}"
+                    manifest['next_file'] += 1
+                    self._write_manifest(manifest)
+                # A merge of every segment applies every tombstone in the manifest it was planned from
+                applied = dict(manifest['tombstones']) if len(run) == len(manifest['segments']) else {}
+                self._merge(run, name, applied)
+                merges += 1
+
+    def _merge(self, run: List[Dict[str, Any]], name: str, applied: Dict[int, int]):
+        names = {entry['name'] for entry in run}
+        inputs = [(index, mask) for entry, index, mask in self.segments if entry['name'] in names]
+        rows = sum(int(mask.sum()) for _, mask in inputs)
+        if rows:
+            self._write_merged(inputs, name, rows)
+
+        seq = max(entry['seq'] for entry in run)
+        merged = {'name': name, 'seq': seq, 'rows': rows, 'level': max(entry['level'] for entry in run) + 1}
+        with self._locked_manifest() as manifest:
+            # Segments added while merging are newer than the run, so it stays in place
+            position = next(i for i, entry in enumerate(manifest['segments']) if entry['name'] in names)
+            manifest['segments'] = [entry for entry in manifest['segments'] if entry['name'] not in names]
+            if rows:
+                manifest['segments'].insert(position, merged)
+            # Tombstones issued while merging may still hide merged rows, so they stay
+            manifest['tombstones'] = {song_id: tomb for song_id, tomb in manifest['tombstones'].items()
+                                      if applied.get(song_id) != tomb}
+            self._write_manifest(manifest)
+        for old in names:
+            for path in self._paths(old):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+        logger.info(f"Merged {len(run)} segments into {name}: {rows} rows, level {merged['level']}")
+
+    def _write_merged(self, inputs: List[Tuple[SequenceIndex, np.ndarray]], name: str, rows: int):
+        ids_path, sequences_path = self._paths(name)
+        song_ids = np.lib.format.open_memmap(ids_path, mode='w+', dtype=np.int64, shape=(rows,))
+        sequences = np.lib.format.open_memmap(sequences_path, mode='w+', dtype=np.float16,
+                                              shape=(rows, self.length, inputs[0][0].sequences.shape[2]))
+        offset = 0
+        for index, mask in inputs:
+            for start in range(0, len(index), MERGE_CHUNK_ROWS):
+                keep = np.flatnonzero(mask[start:start + MERGE_CHUNK_ROWS]) + start
+                song_ids[offset:offset + len(keep)] = index.song_ids[keep]
+                sequences[offset:offset + len(keep)] = index.sequences[keep]
+                offset += len(keep)
+        song_ids.flush()
+        sequences.flush()
+
+    def request_compaction(self):
+        """Start a background compaction if one is due and none is running."""
+        if not self.needs_compaction():
+            return
+        with file_lock(os.path.join(self.directory, 'compact.lock'), blocking=False) as acquired:
+            if not acquired:
+                return
+        subprocess.Popen([sys.executable, os.path.abspath(__file__), 'compact', self.directory],
+                         stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                         start_new_session=True)
+
+
+def live_masks(segments: List[Tuple[int, np.ndarray]], tombstones: Dict[int, int]) -> List[np.ndarray]:
+    """Per segment, which rows are current: not superseded by a newer segment or tombstone."""
+    tomb_ids = np.fromiter(tombstones, dtype=np.int64, count=len(tombstones))
+    tomb_seqs = np.fromiter(tombstones.values(), dtype=np.int64, count=len(tombstones))
+    order = np.argsort(tomb_ids)
+    tomb_ids, tomb_seqs = tomb_ids[order], tomb_seqs[order]
+
+    masks: List[Optional[np.ndarray]] = [None] * len(segments)
+    newer = np.array([], dtype=np.int64)
+    for i in sorted(range(len(segments)), key=lambda i: -segments[i][0]):
+        seq, song_ids = segments[i]
+        song_ids = np.asarray(song_ids)
+        live = ~np.isin(song_ids, newer)
+        if len(tomb_ids):
+            slot = np.minimum(np.searchsorted(tomb_ids, song_ids), len(tomb_ids) - 1)
+            live &= ~((tomb_ids[slot] == song_ids) & (tomb_seqs[slot] > seq))
+        masks[i] = live
+        newer = np.union1d(newer, song_ids)
+    return masks
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Maintain the segmented recognition indexes.')
+    parser.add_argument('command', choices=['compact', 'stats'])
+    parser.add_argument('directory', nargs='?', default=None,
+                        help='one index directory; defaults to every kind under RECOGNITION_INDEX_DIR')
+    parser.add_argument('--full', action='store_true', help='merge everything into one segment')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    directories = [args.directory] if args.directory else [os.path.join(SEQUENCE_INDEX_DIR, kind)
+                                                           for kind in SEQUENCE_KINDS]
+    for directory in directories:
+        if not os.path.exists(os.path.join(directory, 'manifest.json')):
+            continue
+        index = SegmentedIndex(directory)
+        if args.command == 'compact':
+            index.compact(full=args.full)
+            index.refresh()
+        print(json.dumps({
+            'directory': directory,
+            'segments': [{key: entry[key] for key in ('name', 'rows', 'level')} for entry, _, _ in index.segments],
+            'live_rows': len(index),
+            'stored_rows': index.stored_rows,
+            'tombstones': len(index.tombstones),
+        }))
+
+
+if __name__ == '__main__':
+    main()
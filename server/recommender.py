@@ -1,69 +1,154 @@
-import pandas as pd
+import startup
 import numpy as np
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
-from sklearn.preprocessing import StandardScaler
-import psycopg2
 from dotenv import load_dotenv
 import os
 import sys
 import json
+import atexit
+import threading
+import time
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+import catalog
+import db_pool
+import feature_stats
+import genre_pools
+import latency_budget
+import locks
+import metrics
+import pagination
+import prefix_index
+import trending
+
+# Imported on first use: each CLI run is its own process, so only the
+# command being run pays for pandas, sklearn, ALS factors, event ingestion, ...
+pd = startup.lazy_module('pandas')
+sklearn_text = startup.lazy_module('sklearn.feature_extraction.text')
+sklearn_pairwise = startup.lazy_module('sklearn.metrics.pairwise')
+event_ingest = startup.lazy_module('event_ingest')
+matrix_factorization = startup.lazy_module('matrix_factorization')
+dedupe = startup.lazy_module('dedupe')
+sharded_scoring = startup.lazy_module('sharded_scoring')
+user_profiles = startup.lazy_module('user_profiles')
 
 load_dotenv()
+startup.imports_done()
+
+# Optional replacement for the Postgres reads below (e.g. the synthetic
+# provider in benchmark_recommender.py). None means read from the database.
+_data_provider = None
+
+def set_data_provider(provider):
+    global _data_provider
+    _data_provider = provider
+    refresh_catalog()
+
+ARTIFACTS_DIR = os.getenv('RECOMMENDER_ARTIFACTS_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'artifacts'))
+
+# Compact catalog kept for the life of the process, reloaded after CATALOG_MAX_AGE seconds
+CATALOG_MAX_AGE = float(os.getenv('CATALOG_MAX_AGE', '300'))
+_catalog = None
+_catalog_lock = threading.Lock()
+
+# Running audio-feature mean/variance, versioned with the catalog and extended
+# with new songs on each reload instead of refitted
+FEATURE_STATS_PATH = os.path.join(ARTIFACTS_DIR, 'feature_stats.json')
+
+def load_feature_stats():
+    if _data_provider is not None:
+        return None
+    try:
+        return feature_stats.FeatureStats.load(FEATURE_STATS_PATH)
+    except (OSError, ValueError, KeyError) as e:
+        print(f"Error loading feature stats: {str(e)}", file=sys.stderr)
+        return None
+
+# Scoring arrays saved after each build and memory-mapped by later processes
+# while younger than CATALOG_MAX_AGE and the songs table still has the same songs
+CATALOG_DIR = os.path.join(ARTIFACTS_DIR, 'catalog')
+
+def load_saved_catalog():
+    if _data_provider is not None:
+        return None
+    try:
+        with startup.phase('catalog_load'):
+            cat = catalog.CompactCatalog.load(CATALOG_DIR, get_display_fields)
+        if cat is None or time.time() - cat.loaded_at > CATALOG_MAX_AGE:
+            return None
+        with startup.phase('catalog_check'):
+            with db_pool.pooled_connection() as conn:
+                if catalog.catalog_signature(conn) != cat.signature:
+                    return None
+        return cat
+    except Exception as e:
+        print(f"Error loading saved catalog: {str(e)}", file=sys.stderr)
+        return None
+
+def get_catalog():
+    global _catalog
+    with _catalog_lock:
+        if _catalog is None or time.time() - _catalog.loaded_at > CATALOG_MAX_AGE:
+            saved = load_saved_catalog()
+            if saved is not None:
+                _catalog = saved
+                return _catalog
+            with metrics.stage('catalog_fetch'), startup.phase('catalog_fetch'):
+                arrays = get_catalog_arrays()
+            with metrics.stage('feature_prep'), startup.phase('catalog_build'):
+                previous = _catalog.feature_stats if _catalog is not None else load_feature_stats()
+                _catalog = catalog.CompactCatalog.from_arrays(arrays, get_display_fields, previous)
+            if _data_provider is None and _catalog.feature_stats is not previous:
+                try:
+                    _catalog.feature_stats.save(FEATURE_STATS_PATH)
+                except OSError as e:
+                    print(f"Error saving feature stats: {str(e)}", file=sys.stderr)
+            if _data_provider is None:
+                try:
+                    with startup.phase('catalog_save'):
+                        _catalog.save(CATALOG_DIR)
+                except OSError as e:
+                    print(f"Error saving catalog: {str(e)}", file=sys.stderr)
+        return _catalog
+
+def refresh_catalog():
+    global _catalog
+    with _catalog_lock:
+        _catalog = None
 
 def get_db_connection():
-    return psycopg2.connect(
-        dbname=os.getenv('DB_NAME'),
-        user=os.getenv('DB_USER'),
-        password=os.getenv('DB_PASSWORD'),
-        host=os.getenv('DB_HOST'),
-        port=os.getenv('DB_PORT')
-    )
+    return db_pool.get_connection_pool().getconn()
+
+def put_db_connection(conn):
+    db_pool.get_connection_pool().putconn(conn)
+
+def get_catalog_arrays():
+    if _data_provider is not None:
+        return _data_provider.get_catalog_arrays()
+    with db_pool.pooled_connection() as conn:
+        return catalog.load_catalog_arrays(conn)
 
 def get_songs_data():
+    # Scoring columns only; display fields are fetched for the top-k by get_display_fields()
     try:
-        conn = get_db_connection()
-        query = """
-        SELECT 
-            s.id,
-            s.title,
-            g.name as genre_name,
-            s.mood,
-            s.tempo,
-            s.danceability,
-            s.energy,
-            s.valence,
-            s.acousticness,
-            s.instrumentalness,
-            s.liveness,
-            s.speechiness,
-            a.name as artist_name,
-            al.title as album_title,
-            s.year,
-            s.plays,
-            s.image_url,
-            s.audio_url,
-            s.created_at
-        FROM songs s
-        LEFT JOIN artists a ON s.artist_id = a.id
-        LEFT JOIN albums al ON s.album_id = al.id
-        LEFT JOIN genres g ON s.genre_id = g.id
-        """
-        df = pd.read_sql_query(query, conn)
-        conn.close()
-        return df
+        return catalog.arrays_to_frame(get_catalog_arrays())
     except Exception as e:
         print(f"Error in get_songs_data: {str(e)}", file=sys.stderr)
         return pd.DataFrame()
 
+def get_display_fields(song_ids):
+    if _data_provider is not None:
+        return _data_provider.get_display_fields(song_ids)
+    with db_pool.pooled_connection() as conn:
+        return catalog.fetch_display_fields(conn, song_ids)
+
 def normalize_audio_features(df):
     audio_features = ['tempo', 'danceability', 'energy', 'valence', 
                      'acousticness', 'instrumentalness', 'liveness', 'speechiness']
     
-    # Normalize audio features
-    scaler = StandardScaler()
-    df[audio_features] = scaler.fit_transform(df[audio_features].fillna(0))
+    # Normalize audio features with the same running stats the compact catalog uses
+    values = df[audio_features].to_numpy(dtype=np.float64)
+    stats = feature_stats.FeatureStats.from_values(values)
+    df[audio_features] = stats.transform(values)
     return df
 
 def create_song_features(df):
@@ -82,35 +167,67 @@ def create_song_features(df):
     
     return df
 
+SKIP_PATTERNS_QUERY = """
+SELECT 
+    song_id,
+    skip_type,
+    skip_time,
+    created_at
+FROM skip_history
+WHERE user_id = $1 OR user_id IS NULL
+"""
+
 def get_skip_patterns(user_id=None):
+    if _data_provider is not None:
+        return _data_provider.get_skip_patterns(user_id)
     try:
-        conn = get_db_connection()
-        query = """
-        SELECT 
-            song_id,
-            skip_type,
-            skip_time,
-            created_at
-        FROM skip_history
-        WHERE user_id = %s OR user_id IS NULL
-        """
-        df = pd.read_sql_query(query, conn, params=(user_id,))
-        conn.close()
-        return df
+        with db_pool.pooled_connection() as conn:
+            with conn.cursor() as cursor:
+                db_pool.execute_prepared(cursor, 'skip_patterns', SKIP_PATTERNS_QUERY, (user_id,))
+                rows = cursor.fetchall()
+        return pd.DataFrame(rows, columns=['song_id', 'skip_type', 'skip_time', 'created_at'])
     except Exception as e:
         print(f"Error in get_skip_patterns: {str(e)}", file=sys.stderr)
         return pd.DataFrame()
 
+# Catalog and skip reads are independent, so run them on separate pooled connections
+_fetch_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='recommender-fetch')
+
+# Stages a budgeted request still has to run once its data is in
+SCORING_STAGES = ('collaborative', 'content', 'sharded_scoring')
+
+def fetch_catalog_and_skips(user_id=None, budget=None):
+    # Under a latency budget, skips that aren't in on time are left out, and a catalog that
+    # isn't comes back as None when the cached popularity list can answer instead. The skip
+    # wait leaves the time scoring usually takes.
+    catalog_future = _fetch_executor.submit(get_catalog)
+    skips_future = _fetch_executor.submit(get_skip_patterns, user_id)
+    if budget is None:
+        return catalog_future.result(), skips_future.result()
+    try:
+        cat = catalog_future.result(timeout=budget.remaining())
+    except FutureTimeoutError:
+        if _popular is not None:
+            return None, None
+        cat = catalog_future.result()
+    try:
+        skip_patterns = skips_future.result(timeout=budget.remaining_after(*SCORING_STAGES))
+    except FutureTimeoutError:
+        budget.degrade('no_collaborative')
+        skip_patterns = pd.DataFrame()
+    return cat, skip_patterns
+
 def calculate_content_score(target_song, candidate_songs):
     # Text similarity
-    tfidf = TfidfVectorizer(stop_words='english')
-    tfidf_matrix = tfidf.fit_transform(candidate_songs['text_features'])
-    text_sim = cosine_similarity(tfidf_matrix[0:1], tfidf_matrix)[0]
+    with metrics.stage('tfidf'):
+        tfidf = sklearn_text.TfidfVectorizer(stop_words='english')
+        tfidf_matrix = tfidf.fit_transform(candidate_songs['text_features'])
+        text_sim = sklearn_pairwise.cosine_similarity(tfidf_matrix[0:1], tfidf_matrix)[0]
     
     # Audio feature similarity
     audio_features = ['tempo', 'danceability', 'energy', 'valence', 
                      'acousticness', 'instrumentalness', 'liveness', 'speechiness']
-    audio_sim = cosine_similarity(
+    audio_sim = sklearn_pairwise.cosine_similarity(
         target_song[audio_features].values.reshape(1, -1),
         candidate_songs[audio_features].values
     )[0]
@@ -152,127 +269,1084 @@ def calculate_collaborative_score(song_id, skip_patterns):
     collaborative_score = 1 - (0.4 * skip_rate + 0.3 * recent_penalty + 0.3 * quick_penalty)
     return max(0, collaborative_score)
 
-def get_hybrid_recommendations(song_id=None, user_id=None, num_recommendations=10):
-    # Get data
-    df = get_songs_data()
-    df = normalize_audio_features(df)
-    df = create_song_features(df)
-    skip_patterns = get_skip_patterns(user_id)
+def content_scores(cat, position):
+    # Text similarity: TF-IDF rows are L2-normalised, so the sparse dot product is the cosine
+    with metrics.stage('tfidf'):
+        text_sim = (cat.text_matrix @ cat.text_matrix[position].T).toarray().ravel()
     
-    if song_id:
-        # Get target song
-        target_song = df[df['id'] == song_id].iloc[0]
-        candidate_songs = df[df['id'] != song_id]
-        
-        # Calculate scores
-        content_scores = calculate_content_score(target_song, candidate_songs)
-        collaborative_scores = candidate_songs['id'].apply(
-            lambda x: calculate_collaborative_score(x, skip_patterns)
-        )
-        
-        # Popularity and recency scores
-        popularity_scores = candidate_songs['plays'] / candidate_songs['plays'].max()
-        recency_scores = 1 - (candidate_songs['recency'] / candidate_songs['recency'].max())
-        
+    # Audio feature similarity (cosine over the standardised features)
+    norms = cat.feature_norms * cat.feature_norms[position]
+    audio_sim = np.divide(cat.features @ cat.features[position], norms,
+                          out=np.zeros(len(cat), dtype=np.float32), where=norms > 0)
+    
+    # Genre and artist similarity as integer code comparisons
+    genre_sim = (cat.genre_codes == cat.genre_codes[position]) & (cat.genre_codes >= 0)
+    artist_sim = (cat.artist_codes == cat.artist_codes[position]) & (cat.artist_codes >= 0)
+    
+    return 0.3 * text_sim + 0.3 * audio_sim + 0.2 * genre_sim + 0.2 * artist_sim
+
+def content_score_matrix(cat, positions):
+    # content_scores() for several seeds at once: a (songs, seeds) matrix from one product per term
+    positions = np.asarray(positions, dtype=np.int64)
+    with metrics.stage('tfidf'):
+        text_sim = (cat.text_matrix @ cat.text_matrix[positions].T).toarray()
+    norms = cat.feature_norms[:, None] * cat.feature_norms[positions]
+    audio_sim = np.divide(cat.features @ cat.features[positions].T, norms,
+                          out=np.zeros((len(cat), len(positions)), dtype=np.float32), where=norms > 0)
+    seed_genres = cat.genre_codes[positions]
+    seed_artists = cat.artist_codes[positions]
+    genre_sim = (cat.genre_codes[:, None] == seed_genres) & (seed_genres >= 0)
+    artist_sim = (cat.artist_codes[:, None] == seed_artists) & (seed_artists >= 0)
+    return 0.3 * text_sim + 0.3 * audio_sim + 0.2 * genre_sim + 0.2 * artist_sim
+
+SEED_MODES = ('centroid', 'max')
+
+def parse_seeds(seeds):
+    # Weighted seed set from "7:2,12", a list of ids / "id:weight" / [id, weight], or {id: weight}.
+    # Repeated ids add up; weights default to 1 and non-positive ones drop the seed.
+    if isinstance(seeds, str):
+        seeds = [seed for seed in seeds.split(',') if seed.strip()]
+    items = seeds.items() if isinstance(seeds, dict) else seeds
+    parsed = {}
+    for item in items:
+        if isinstance(item, str):
+            song_id, _, weight = item.partition(':')
+            item = (song_id, weight or 1)
+        elif not isinstance(item, (list, tuple)):
+            item = (item, 1)
+        song_id, weight = int(item[0]), float(item[1])
+        parsed[song_id] = parsed.get(song_id, 0.0) + weight
+    return {song_id: weight for song_id, weight in parsed.items() if weight > 0}
+
+def code_weights(codes, seed_codes, weights):
+    # Sum of the weights of the seeds sharing each song's code; missing codes (-1) never match
+    valid = seed_codes >= 0
+    table = np.bincount(seed_codes[valid], weights=weights[valid], minlength=int(codes.max(initial=-1)) + 1)
+    return np.append(table, 0.0)[codes].astype(np.float32)
+
+def seed_set_content_scores(cat, positions, weights, mode='centroid'):
+    # content_scores() for a weighted set of seeds (a playlist or play queue).
+    # 'centroid' is the weighted mean of the per-seed scores. Every term is linear in
+    # the seed, so it is one product with the weighted sum of the seed rows and costs
+    # the same for 1 seed or 100. 'max' keeps each song's best weighted seed, from one
+    # (songs x seeds) product.
+    if mode not in SEED_MODES:
+        raise ValueError(f"Unknown seed mode '{mode}', expected one of {', '.join(SEED_MODES)}")
+    positions = np.asarray(positions, dtype=np.int64)
+    weights = np.asarray(weights, dtype=np.float32)
+    if mode == 'max':
+        return (content_score_matrix(cat, positions) * (weights / weights.max())).max(axis=1)
+    
+    weights = weights / weights.sum()
+    seed_norms = cat.feature_norms[positions]
+    unit_seeds = np.divide(cat.features[positions], seed_norms[:, None],
+                           out=np.zeros((len(positions), cat.features.shape[1]), dtype=np.float32),
+                           where=seed_norms[:, None] > 0)
+    with metrics.stage('tfidf'):
+        text_centroid = cat.text_matrix[positions].T @ weights
+        text_sim = np.asarray(cat.text_matrix @ text_centroid).ravel()
+    audio_sim = np.divide(cat.features @ (weights @ unit_seeds), cat.feature_norms,
+                          out=np.zeros(len(cat), dtype=np.float32), where=cat.feature_norms > 0)
+    genre_sim = code_weights(cat.genre_codes, cat.genre_codes[positions], weights)
+    artist_sim = code_weights(cat.artist_codes, cat.artist_codes[positions], weights)
+    return 0.3 * text_sim + 0.3 * audio_sim + 0.2 * genre_sim + 0.2 * artist_sim
+
+def collaborative_scores(cat, skip_patterns):
+    # Vectorised calculate_collaborative_score() for every song in the catalog
+    n = len(cat)
+    if skip_patterns.empty:
+        return np.zeros(n, dtype=np.float32)
+    
+    song_ids = pd.to_numeric(skip_patterns['song_id'], errors='coerce').fillna(-1).to_numpy(dtype=np.int64)
+    positions = cat.positions(song_ids)
+    known = positions >= 0
+    recent = (pd.to_datetime(skip_patterns['created_at']) > (datetime.now() - pd.Timedelta(days=30))).to_numpy()
+    quick = (skip_patterns['skip_type'] == 'quick').to_numpy()
+    
+    skips = np.bincount(positions[known], minlength=n)
+    recent_skips = np.bincount(positions[known & recent], minlength=n)
+    quick_skips = np.bincount(positions[known & quick], minlength=n)
+    return collaborative_from_counts(skips, recent_skips, quick_skips, len(skip_patterns))
+
+def collaborative_from_counts(skips, recent_skips, quick_skips, total):
+    # Same formula over per-song skip counts, e.g. from live EventAggregates
+    if total == 0:
+        return np.zeros(len(skips), dtype=np.float32)
+    per_song = np.maximum(skips, 1)
+    scores = 1 - (0.4 * skips / total + 0.3 * recent_skips / per_song + 0.3 * quick_skips / per_song)
+    return np.where(skips == 0, 1.0, np.maximum(scores, 0)).astype(np.float32)
+
+def popularity_scores(cat, live_plays=None):
+    plays = cat.plays if live_plays is None else cat.plays + live_plays
+    max_plays = plays.max() if len(cat) else 0
+    if max_plays <= 0:
+        return np.zeros(len(cat), dtype=np.float32)
+    return (plays / max_plays).astype(np.float32)
+
+def recency_scores(cat):
+    today = (np.datetime64(datetime.now(), 'D') - np.datetime64(0, 'D')).astype(np.int64)
+    recency = today - cat.created_days
+    max_recency = recency.max() if len(cat) else 0
+    if max_recency <= 0:
+        return np.ones(len(cat), dtype=np.float32)
+    return (1 - recency / max_recency).astype(np.float32)
+
+def top_k(scores, k, exclude=None):
+    # Positions of the k best scores, best first; argpartition keeps this O(n)
+    scores = np.asarray(scores, dtype=np.float64)
+    if exclude is not None and len(exclude):
+        scores = scores.copy()
+        scores[exclude] = -np.inf
+    valid = int(np.isfinite(scores).sum())
+    k = min(k, valid)
+    if k <= 0:
+        return np.array([], dtype=np.int64)
+    candidates = np.argpartition(-scores, k - 1)[:k] if k < len(scores) else np.arange(len(scores))
+    return candidates[np.argsort(-scores[candidates], kind='stable')][:k]
+
+def collapse_duplicates(top, clusters):
+    # Keep the first (best-ranked) song of each duplicate cluster in a ranked list
+    _, first = np.unique(clusters[top], return_index=True)
+    return top[np.sort(first)]
+
+def top_k_distinct(rank, k, clusters):
+    # Best k positions with at most one song per duplicate cluster. rank(size) returns the best
+    # `size` positions, best first; the pool only grows if duplicates crowd out more than k songs.
+    if clusters is None:
+        return rank(k)
+    size = 2 * k
+    while True:
+        top = rank(size)
+        distinct = collapse_duplicates(top, clusters)
+        if len(distinct) >= k or len(top) < size:
+            return distinct[:k]
+        size *= 2
+
+# Live skip/play counters fed by an event source. While ingestion runs, requests
+# read skips from these instead of querying skip_history every time.
+_ingestor = None
+_aggregates_catalog = None
+_aggregates_lock = threading.Lock()
+
+def get_skip_history():
+    if _data_provider is not None:
+        return _data_provider.get_skip_history()
+    with db_pool.pooled_connection() as conn:
+        return event_ingest.load_skip_history(conn)
+
+def start_event_ingest(source):
+    global _ingestor
+    stop_event_ingest()
+    _ingestor = event_ingest.EventIngestor(source)
+    counters = get_trending()
+    if counters is not None:
+        _ingestor.add_listener(counters.apply)
+    _ingestor.add_listener(record_profile_event)
+    return _ingestor.start()
+
+def stop_event_ingest():
+    global _ingestor, _aggregates_catalog
+    if _ingestor is not None:
+        _ingestor.stop()
+        counters = get_trending()
+        if counters is not None:
+            counters.flush()
+        save_user_profiles()
+    _ingestor = None
+    _aggregates_catalog = None
+
+def event_source_from_env():
+    # RECOMMENDER_EVENTS=postgres listens for NOTIFY; RECOMMENDER_EVENTS_FILE tails a JSON-lines log
+    if os.getenv('RECOMMENDER_EVENTS_FILE'):
+        return event_ingest.FileEventSource(os.getenv('RECOMMENDER_EVENTS_FILE'))
+    if os.getenv('RECOMMENDER_EVENTS') == 'postgres':
+        return event_ingest.PostgresEventSource()
+    return None
+
+def get_event_aggregates(cat):
+    # Rebuilt from a skip_history snapshot whenever the catalog reloads; None if not ingesting
+    global _aggregates_catalog
+    ingestor = _ingestor
+    if ingestor is None:
+        return None
+    with _aggregates_lock:
+        if ingestor.aggregates is None or _aggregates_catalog is not cat:
+            history = get_skip_history()
+            positions = cat.positions(pd.to_numeric(history['song_id'], errors='coerce').fillna(-1))
+            aggregates = event_ingest.EventAggregates.from_skip_history(
+                history, positions, len(cat), cat.position)
+            ingestor.attach(aggregates)
+            _aggregates_catalog = cat
+        return ingestor.aggregates
+
+# Taste vectors over the catalog feature space, persisted between runs
+PROFILES_DIR = os.getenv('USER_PROFILES_DIR', os.path.join(ARTIFACTS_DIR, 'user_profiles'))
+# While ingesting, live plays and likes are saved at most this often (seconds)
+PROFILE_SAVE_INTERVAL = float(os.getenv('PROFILE_SAVE_INTERVAL', '60'))
+_profiles = None
+_profiles_saved_at = 0.0
+_profiles_lock = threading.Lock()
+
+def get_history_events():
+    if _data_provider is not None:
+        return _data_provider.get_history_events()
+    with db_pool.pooled_connection() as conn:
+        return user_profiles.load_history_events(conn)
+
+def profile_catalog_version(cat):
+    # Taste vectors live in the standardised feature space, which only moves when the
+    # feature stats do; updated_at tells apart refits that restart the version count
+    stats = cat.feature_stats
+    return f'{stats.version}:{stats.updated_at}'
+
+def profiles_file_lock():
+    # Serialises load-update-save of the saved profiles across processes
+    return locks.file_lock(os.path.join(PROFILES_DIR, 'profiles.lock'))
+
+def build_user_profiles(save=True):
+    # Full rebuild from user_play_history and user_favorite_songs
+    cat = get_catalog()
+    events = get_history_events()
+    positions = cat.positions(pd.to_numeric(events['song_id'], errors='coerce').fillna(-1))
+    store = user_profiles.UserProfileStore.from_events(events, cat.features, positions, now=time.time())
+    store.catalog_version = profile_catalog_version(cat)
+    if save:
+        store.save(PROFILES_DIR, store.catalog_version)
+    return store
+
+def load_user_profiles(version):
+    # Saved profiles, or None if there are none or they were built over other feature stats
+    try:
+        store = user_profiles.UserProfileStore.load(PROFILES_DIR)
+    except (OSError, ValueError, KeyError) as e:
+        print(f"Error loading user profiles: {str(e)}", file=sys.stderr)
+        return None
+    if store is None or store.catalog_version != version:
+        return None
+    return store
+
+def get_profile_store():
+    global _profiles, _profiles_saved_at
+    with _profiles_lock:
+        version = profile_catalog_version(get_catalog())
+        if _profiles is None or _profiles.catalog_version != version:
+            _profiles = load_user_profiles(version) or build_user_profiles(save=_data_provider is None)
+            _profiles_saved_at = time.time()
+        return _profiles
+
+def save_user_profiles():
+    # Persist the in-memory profiles, if any were loaded
+    global _profiles_saved_at
+    store = _profiles
+    if store is None or _data_provider is not None:
+        return
+    try:
+        with profiles_file_lock():
+            store.save(PROFILES_DIR, store.catalog_version)
+        _profiles_saved_at = time.time()
+    except OSError as e:
+        print(f"Error saving user profiles: {str(e)}", file=sys.stderr)
+
+def record_user_event(user_id, song_id, event='play', timestamp=None):
+    # Incremental taste update for one play or like; False if the song is unknown
+    cat = get_catalog()
+    position = cat.position(song_id)
+    if position < 0:
+        return False
+    get_profile_store().update(user_id, cat.features[position], event, timestamp)
+    return True
+
+def record_profile_event(event):
+    # Ingest listener: fold live plays and likes into the taste vectors
+    if event['type'] not in user_profiles.EVENT_WEIGHTS or event['user_id'] is None:
+        return
+    record_user_event(event['user_id'], event['song_id'], event['type'], event['timestamp'])
+    if time.time() - _profiles_saved_at >= PROFILE_SAVE_INTERVAL:
+        save_user_profiles()
+
+# Implicit ALS factors trained by matrix_factorization.py, memory-mapped on load
+FACTORS_DIR = os.getenv('FACTORS_DIR', os.path.join(ARTIFACTS_DIR, 'factors'))
+_factors = None
+_factor_rows = None
+_factors_lock = threading.Lock()
+
+def get_factor_model():
+    global _factors
+    with _factors_lock:
+        if _factors is None:
+            try:
+                _factors = matrix_factorization.FactorStore(FACTORS_DIR).load()
+            except (OSError, ValueError, KeyError) as e:
+                print(f"Error loading factor model: {str(e)}", file=sys.stderr)
+            if _factors is None:
+                _factors = False
+        return _factors or None
+
+def factor_scores(cat, user_id):
+    # Min-max scaled factor dot products, or None if there is no model or the user is unknown
+    global _factor_rows
+    if user_id is None:
+        return None
+    model = get_factor_model()
+    if model is None:
+        return None
+    key = (id(cat), model.version)
+    if _factor_rows is None or _factor_rows[0] != key:
+        _factor_rows = (key, model.item_rows(cat.ids))
+    scores = model.scores(user_id, _factor_rows[1])
+    if scores is None:
+        return None
+    low, high = scores.min(), scores.max()
+    if high <= low:
+        return np.zeros(len(cat), dtype=np.float32)
+    return ((scores - low) / (high - low)).astype(np.float32)
+
+# Exponentially decayed play/like/skip counters (trending.py). When built,
+# their score replaces lifetime plays as the popularity term and feeds `trending`.
+TRENDING_DIR = os.path.join(ARTIFACTS_DIR, 'trending')
+TRENDING_HALF_LIFE_HOURS = float(os.getenv('TRENDING_HALF_LIFE_HOURS', str(trending.DEFAULT_HALF_LIFE_HOURS)))
+_trending = None
+_trending_scores = None
+_trending_lock = threading.Lock()
+
+def get_trending():
+    global _trending
+    if _data_provider is not None:
+        return None
+    with _trending_lock:
+        if _trending is None:
+            try:
+                _trending = trending.TrendingCounters.load(TRENDING_DIR)
+            except (OSError, ValueError, KeyError) as e:
+                print(f"Error loading trending counters: {str(e)}", file=sys.stderr)
+            if _trending is None:
+                _trending = False
+        return _trending or None
+
+def build_trending():
+    # Full recount from recently_played, user_favorite_songs and skip_history
+    global _trending, _trending_scores
+    with db_pool.pooled_connection() as conn:
+        counters = trending.rebuild_from_database(conn, TRENDING_DIR, TRENDING_HALF_LIFE_HOURS)
+    with _trending_lock:
+        _trending = counters
+        _trending_scores = None
+    return counters
+
+def trending_scores(cat):
+    # Trending popularity over the catalog, reused until an event arrives; None without counters
+    global _trending_scores
+    counters = get_trending()
+    if counters is None:
+        return None
+    key = (id(cat), counters.version)
+    cached = _trending_scores
+    if cached is None or cached[0] != key:
+        with metrics.stage('trending'):
+            cached = _trending_scores = (key, counters.scores(cat.ids))
+    return cached[1]
+
+# Near-duplicate clusters (re-uploads, remasters, live versions) found offline by
+# dedupe.py. When present, recommendation lists keep one song per cluster.
+DUPLICATES_DIR = os.getenv('DUPLICATES_DIR', os.path.join(ARTIFACTS_DIR, 'duplicates'))
+COLLAPSE_DUPLICATES = os.getenv('RECOMMENDER_COLLAPSE_DUPLICATES', '1') != '0'
+_duplicates = None
+_duplicate_positions = None
+_duplicates_lock = threading.Lock()
+
+def get_duplicates():
+    global _duplicates
+    if not COLLAPSE_DUPLICATES or _data_provider is not None:
+        return None
+    with _duplicates_lock:
+        if _duplicates is None:
+            try:
+                _duplicates = dedupe.DuplicateStore(DUPLICATES_DIR).load()
+            except (OSError, ValueError, KeyError) as e:
+                print(f"Error loading duplicate clusters: {str(e)}", file=sys.stderr)
+            if _duplicates is None:
+                _duplicates = False
+        return _duplicates or None
+
+def duplicate_clusters(cat):
+    # Cluster id per catalog position, or None when there are no clusters to collapse
+    global _duplicate_positions
+    duplicates = get_duplicates()
+    if duplicates is None or duplicates.manifest.get('clusters', 1) == 0:
+        return None
+    key = (id(cat), duplicates.version)
+    cached = _duplicate_positions
+    if cached is None or cached[0] != key:
+        cached = _duplicate_positions = (key, duplicates.clusters_for(cat.ids))
+    return cached[1]
+
+# Blend of score components for each kind of request
+SEED_WEIGHTS = {'content': 0.4, 'collaborative': 0.4, 'popularity': 0.1, 'recency': 0.1}
+TASTE_WEIGHTS = {'taste': 0.5, 'collaborative': 0.3, 'popularity': 0.1, 'recency': 0.1}
+INITIAL_WEIGHTS = {'collaborative': 0.5, 'popularity': 0.3, 'recency': 0.2}
+
+# Multi-process scoring over shared memory, enabled with RECOMMENDER_WORKERS > 1
+RECOMMENDER_WORKERS = int(os.getenv('RECOMMENDER_WORKERS', '1'))
+_scorer = None
+_scorer_lock = threading.Lock()
+
+def get_sharded_scorer(cat):
+    # One scorer per catalog snapshot; the previous one's workers and shared memory are released
+    global _scorer
+    if RECOMMENDER_WORKERS <= 1:
+        return None
+    with _scorer_lock:
+        if _scorer is None or _scorer.catalog is not cat:
+            if _scorer is not None:
+                _scorer.close()
+            _scorer = sharded_scoring.ShardedScorer(cat, RECOMMENDER_WORKERS)
+        return _scorer
+
+def close_sharded_scorer():
+    global _scorer
+    with _scorer_lock:
+        if _scorer is not None:
+            _scorer.close()
+        _scorer = None
+
+atexit.register(close_sharded_scorer)
+
+def collaborative_entries(cat, skip_patterns):
+    # Sparse form of collaborative_scores(): only skipped songs differ from the default score
+    scores = collaborative_scores(cat, skip_patterns)
+    default = 1.0 if not skip_patterns.empty else 0.0
+    positions = np.flatnonzero(scores != default)
+    return ('sparse', default, positions, scores[positions])
+
+def score_context(cat):
+    # Catalog-wide normalisers for popularity and recency, as popularity_scores()/recency_scores() use
+    today = int((np.datetime64(datetime.now(), 'D') - np.datetime64(0, 'D')).astype(np.int64))
+    return {
+        'max_plays': float(cat.plays.max()) if len(cat) else 0.0,
+        'max_recency': float(today - cat.created_days.min()) if len(cat) else 0.0,
+        'today': today,
+    }
+
+# Most-played songs of the latest catalog: the answer of last resort for budgeted requests
+_popular = None
+
+def popular_list(cat):
+    global _popular
+    cached = _popular
+    if cached is None or cached[0] is not cat:
+        cached = _popular = (cat, top_k(popularity_scores(cat), RANKED_LIST_SIZE))
+    return cached
+
+def popular_fallback(budget, cat, num_recommendations, exclude_ids):
+    # Budget spent before scoring: the cached popularity list minus the seeds and their
+    # duplicates. Without a catalog (it wasn't ready in time) the list's own catalog answers.
+    budget.degrade('popular')
+    cat, ranked = popular_list(cat) if cat is not None else _popular
+    clusters = duplicate_clusters(cat)
+    exclude = cat.positions(exclude_ids)
+    exclude = exclude[exclude >= 0]
+    if clusters is not None:
+        ranked = ranked[~np.isin(clusters[ranked], clusters[exclude])]
+    else:
+        ranked = ranked[~np.isin(ranked, exclude)]
+    return cat, top_k_distinct(lambda size: ranked[:size], num_recommendations, clusters)
+
+def budgeted_records(cat, top, budget):
+    # Display records; under a budget wrapped as {'results': ..., 'degradation': level}
+    records = cat.display.records(cat.ids[top])
+    if budget is None:
+        return records
+    if budget.level != 'full':
+        metrics.inc('degraded_requests_total', level=budget.level)
+    return {'results': records, 'degradation': budget.level}
+
+# Per-genre candidate pools for cold-start feeds, rebuilt with each catalog snapshot
+GENRE_POOL_SIZE = int(os.getenv('GENRE_POOL_SIZE', str(genre_pools.DEFAULT_POOL_SIZE)))
+COLD_START_RANDOMNESS = float(os.getenv('COLD_START_RANDOMNESS', '0.2'))
+_genre_pools = None
+
+def get_genre_pools(cat):
+    # Pools ranked by the initial feed's popularity and recency terms (no per-user data),
+    # holding one song per duplicate cluster
+    global _genre_pools
+    clusters = duplicate_clusters(cat)
+    key = (id(cat), id(clusters))
+    cached = _genre_pools
+    if cached is None or cached[0] != key:
+        popularity = trending_scores(cat)
+        if popularity is None:
+            popularity = popularity_scores(cat)
+        scores = INITIAL_WEIGHTS['popularity'] * popularity + INITIAL_WEIGHTS['recency'] * recency_scores(cat)
+        candidates = None
+        if clusters is not None:
+            candidates = collapse_duplicates(np.argsort(-scores, kind='stable'), clusters)
+        pools = genre_pools.GenrePools.build(cat.genre_codes, scores, len(cat.genres), candidates, GENRE_POOL_SIZE)
+        cached = _genre_pools = (key, pools)
+    return cached[1]
+
+def get_cold_start_recommendations(genres, num_recommendations=10, randomness=None):
+    # Feed for a user without history from their preferred genres (names, or a comma-separated
+    # string), drawn from the genre pools; the initial feed when none of the genres is known
+    if isinstance(genres, str):
+        genres = genres.split(',')
+    randomness = COLD_START_RANDOMNESS if randomness is None else float(randomness)
+    cat = get_catalog()
+    codes = {name.lower(): code for code, name in enumerate(cat.genres)}
+    known = [codes[name.strip().lower()] for name in genres if name.strip().lower() in codes]
+    if not known:
+        return get_initial_recommendations(num_recommendations)
+    with metrics.request('cold_start'):
+        with metrics.stage('pool_sample'):
+            top = get_genre_pools(cat).sample(known, int(num_recommendations), np.random.default_rng(), randomness)
+        with metrics.stage('display_fetch'):
+            return cat.display.records(cat.ids[top])
+
+def get_taste(user_id, song_id=None):
+    # Taste vector for personal requests; None for seed requests and unknown users
+    if user_id is not None and not song_id:
+        return get_profile_store().vector(user_id)
+    return None
+
+def get_hybrid_recommendations(song_id=None, user_id=None, num_recommendations=10, budget_ms=None):
+    # budget_ms: answer within that many milliseconds, degrading if need be (see budgeted_records)
+    budget = latency_budget.LatencyBudget.from_ms(budget_ms)
+    taste = get_taste(user_id, song_id)
+    request_name = 'recommend' if song_id else ('personal' if taste is not None else 'initial')
+    with metrics.request(request_name):
+        cat, top = rank_hybrid(song_id, user_id, num_recommendations, taste, budget=budget)
+        with metrics.stage('display_fetch'):
+            return budgeted_records(cat, top, budget)
+
+def get_seed_set_recommendations(seeds, num_recommendations=10, mode='centroid', budget_ms=None):
+    # Recommendations for a whole playlist or queue (see parse_seeds), seeds excluded
+    budget = latency_budget.LatencyBudget.from_ms(budget_ms)
+    with metrics.request('multi'):
+        cat, top = rank_hybrid(num_recommendations=num_recommendations, seeds=seeds, seed_mode=mode,
+                               budget=budget)
+        with metrics.stage('display_fetch'):
+            return budgeted_records(cat, top, budget)
+
+def rank_hybrid(song_id=None, user_id=None, num_recommendations=10, taste=None, seeds=None, seed_mode='centroid',
+                budget=None):
+    # Catalog snapshot and its best num_recommendations positions, best first.
+    # `seeds` replaces song_id with a weighted seed set, scored by seed_set_content_scores().
+    # With a LatencyBudget, stages that no longer fit in it are skipped (see latency_budget.LEVELS)
+    if seeds is not None:
+        seeds = parse_seeds(seeds)
+    seed_ids = list(seeds) if seeds is not None else ([int(song_id)] if song_id else [])
+
+    # Get data
+    with metrics.stage('db_fetch'):
+        aggregates = None
+        if _ingestor is not None:
+            cat = get_catalog()
+            aggregates = get_event_aggregates(cat)
+        else:
+            cat, skip_patterns = fetch_catalog_and_skips(user_id, budget)
+    if budget is not None:
+        if cat is None or budget.expired():
+            return popular_fallback(budget, cat, num_recommendations, seed_ids)
+        popular_list(cat)
+
+    position = None
+    exclude = None
+    if seeds is not None:
+        positions = cat.positions(np.fromiter(seeds, dtype=np.int64, count=len(seeds)))
+        known = positions >= 0
+        if not known.any():
+            raise ValueError("None of the seed songs are in the catalog")
+        seed_weights = np.fromiter(seeds.values(), dtype=np.float32, count=len(seeds))[known]
+        seed_positions = exclude = positions[known]
+    elif song_id:
+        position = cat.position(song_id)
+        if position < 0:
+            raise ValueError(f"Unknown song id: {song_id}")
+        exclude = [position]
+    seeded = position is not None or exclude is not None
+    weights = SEED_WEIGHTS if seeded else (TASTE_WEIGHTS if taste is not None else INITIAL_WEIGHTS)
+    clusters = duplicate_clusters(cat)
+    if clusters is not None and exclude is not None:
+        # Other versions of the seed songs are left out along with the seeds
+        exclude = np.flatnonzero(np.isin(clusters, clusters[exclude])).tolist()
+
+    # Live play counts change popularity per request, so that path stays in-process;
+    # so do seed sets, which are already a single pass over the catalog
+    scorer = get_sharded_scorer(cat) if aggregates is None and seeds is None else None
+    trend = trending_scores(cat)
+
+    with metrics.stage('collaborative'):
+        if budget is not None and not budget.affords('collaborative'):
+            budget.degrade('no_collaborative')
+            collaborative = np.zeros(len(cat), dtype=np.float32)
+        else:
+            with latency_budget.measure('collaborative'):
+                # Learned factors when this user has them, otherwise the skip-rate heuristic
+                collaborative = factor_scores(cat, user_id)
+                if collaborative is None and aggregates is not None:
+                    collaborative = collaborative_from_counts(*aggregates.skip_counts(user_id))
+                elif collaborative is None and scorer is not None:
+                    collaborative = collaborative_entries(cat, skip_patterns)
+                elif collaborative is None:
+                    collaborative = collaborative_scores(cat, skip_patterns)
+
+    if scorer is not None:
+        if budget is not None and not budget.affords('sharded_scoring'):
+            return popular_fallback(budget, cat, num_recommendations, seed_ids)
+        context = score_context(cat)
+        with metrics.stage('sharded_scoring'), latency_budget.measure('sharded_scoring'):
+            top = top_k_distinct(lambda size: scorer.top_k([{
+                'weights': weights,
+                'k': size,
+                'seed': position,
+                'taste': taste,
+                'exclude': exclude,
+                'collaborative': collaborative,
+                'popularity': trend,
+            }], context)[0], num_recommendations, clusters)
+        return cat, top
+
+    popularity = trend
+    if popularity is None:
+        popularity = popularity_scores(cat, None if aggregates is None else aggregates.plays)
+    recency = recency_scores(cat)
+
+    if seeded:
         # Combine scores
+        if budget is not None and not budget.affords('content'):
+            budget.degrade('no_content')
+            content = 0.0
+        else:
+            with latency_budget.measure('content'):
+                if seeds is not None:
+                    content = seed_set_content_scores(cat, seed_positions, seed_weights, seed_mode)
+                else:
+                    content = content_scores(cat, position)
         hybrid_scores = (
-            0.4 * content_scores +
-            0.4 * collaborative_scores +
-            0.1 * popularity_scores +
-            0.1 * recency_scores
+            weights['content'] * content +
+            weights['collaborative'] * collaborative +
+            weights['popularity'] * popularity +
+            weights['recency'] * recency
+        )
+    elif taste is not None:
+        # Personalised: one product of the user's taste vector against the catalog
+        if budget is not None and not budget.affords('taste'):
+            budget.degrade('no_content')
+            taste_scores = 0.0
+        else:
+            with metrics.stage('taste'), latency_budget.measure('taste'):
+                taste_scores = user_profiles.taste_scores(cat.features, cat.feature_norms, taste)
+        hybrid_scores = (
+            weights['taste'] * taste_scores +
+            weights['collaborative'] * collaborative +
+            weights['popularity'] * popularity +
+            weights['recency'] * recency
         )
-        
-        # Get top recommendations
-        top_indices = hybrid_scores.nlargest(num_recommendations).index
-        recommendations = candidate_songs.iloc[top_indices]
     else:
         # Initial recommendations
-        popularity_scores = df['plays'] / df['plays'].max()
-        recency_scores = 1 - (df['recency'] / df['recency'].max())
-        collaborative_scores = df['id'].apply(
-            lambda x: calculate_collaborative_score(x, skip_patterns)
-        )
-        
-        # Combine scores
         hybrid_scores = (
-            0.5 * collaborative_scores +
-            0.3 * popularity_scores +
-            0.2 * recency_scores
+            weights['collaborative'] * collaborative +
+            weights['popularity'] * popularity +
+            weights['recency'] * recency
         )
-        
-        # Get top recommendations
-        top_indices = hybrid_scores.nlargest(num_recommendations).index
-        recommendations = df.iloc[top_indices]
+
+    # Get top recommendations
+    with metrics.stage('top_k'):
+        top = top_k_distinct(lambda size: top_k(hybrid_scores, size, exclude), num_recommendations, clusters)
+    return cat, top
+
+def get_batch_recommendations(song_ids, num_recommendations=10):
+    # Seed recommendations for many songs at once; one shard task set per batch when sharded
+    cat, skip_patterns = fetch_catalog_and_skips(None)
+    positions = [cat.position(song_id) for song_id in song_ids]
+    scorer = get_sharded_scorer(cat)
+    if scorer is None:
+        return [get_hybrid_recommendations(song_id=song_id, num_recommendations=num_recommendations)
+                if position >= 0 else [] for song_id, position in zip(song_ids, positions)]
     
-    return recommendations.to_dict('records')
+    with metrics.request('recommend_batch'):
+        collaborative = collaborative_entries(cat, skip_patterns)
+        trend = trending_scores(cat)
+        known = [position for position in positions if position >= 0]
+        clusters = duplicate_clusters(cat)
+        context = score_context(cat)
+        
+        def task(position, size):
+            exclude = [position] if clusters is None else np.flatnonzero(clusters == clusters[position]).tolist()
+            return {
+                'weights': SEED_WEIGHTS,
+                'k': size,
+                'seed': position,
+                'exclude': exclude,
+                'collaborative': collaborative,
+                'popularity': trend,
+            }
+        
+        with metrics.stage('sharded_scoring'):
+            # With duplicate clusters every seed ranks a pool of 2k, as top_k_distinct() starts with
+            size = num_recommendations if clusters is None else 2 * num_recommendations
+            tops = scorer.top_k([task(position, size) for position in known], context)
+            if clusters is not None:
+                for i, (position, top) in enumerate(zip(known, tops)):
+                    distinct = collapse_duplicates(top, clusters)
+                    if len(distinct) >= num_recommendations or len(top) < size:
+                        tops[i] = distinct[:num_recommendations]
+                    else:
+                        tops[i] = top_k_distinct(lambda size, position=position: scorer.top_k(
+                            [task(position, size)], context)[0], num_recommendations, clusters)
+        by_position = dict(zip(known, tops))
+        with metrics.stage('display_fetch'):
+            return [cat.display.records(cat.ids[by_position[position]]) if position >= 0 else []
+                    for position in positions]
 
 # Update existing functions to use the new hybrid system
-def get_recommendations(song_id, num_recommendations=5):
-    return get_hybrid_recommendations(song_id=song_id, num_recommendations=num_recommendations)
+def get_recommendations(song_id, num_recommendations=5, budget_ms=None):
+    return get_hybrid_recommendations(song_id=song_id, num_recommendations=num_recommendations, budget_ms=budget_ms)
 
-def get_initial_recommendations(num_recommendations=10):
-    return get_hybrid_recommendations(num_recommendations=num_recommendations)
+def get_initial_recommendations(num_recommendations=10, budget_ms=None):
+    return get_hybrid_recommendations(num_recommendations=num_recommendations, budget_ms=budget_ms)
 
-def get_similar_songs(song_id, n_recommendations=4):
-    return get_hybrid_recommendations(song_id=song_id, num_recommendations=n_recommendations)
+def get_similar_songs(song_id, n_recommendations=4, budget_ms=None):
+    return get_hybrid_recommendations(song_id=song_id, num_recommendations=n_recommendations, budget_ms=budget_ms)
+
+def get_personal_recommendations(user_id, num_recommendations=10, budget_ms=None):
+    return get_hybrid_recommendations(user_id=user_id, num_recommendations=num_recommendations, budget_ms=budget_ms)
+
+def get_trending_songs(num_results=10):
+    # What's hot right now; the initial feed until trending counters have been built
+    cat = get_catalog()
+    scores = trending_scores(cat)
+    if scores is None:
+        return get_initial_recommendations(num_results)
+    with metrics.request('trending'):
+        # Lifetime plays only break ties, e.g. between songs with no recent events
+        with metrics.stage('top_k'):
+            top = top_k(scores + 1e-6 * popularity_scores(cat), num_results)
+        with metrics.stage('display_fetch'):
+            return cat.display.records(cat.ids[top])
 
 def search_songs(query, num_results=10):
-    df = get_songs_data()
-    df = create_song_features(df)
-    
-    # Create TF-IDF matrix
-    tfidf = TfidfVectorizer(stop_words='english')
-    tfidf_matrix = tfidf.fit_transform(df['text_features'])
-    
-    # Transform query
-    query_vector = tfidf.transform([query])
+    with metrics.request('search'):
+        cat, top = rank_search(query, num_results)
+        with metrics.stage('display_fetch'):
+            return cat.display.records(cat.ids[top])
+
+def rank_search(query, num_results=10):
+    with metrics.stage('db_fetch'):
+        cat = get_catalog()
     
-    # Calculate similarity
-    cosine_sim = cosine_similarity(query_vector, tfidf_matrix)
+    with metrics.stage('tfidf'):
+        # Query against the catalog's prebuilt TF-IDF matrix
+        if cat.vectorizer is None:
+            cosine_sim = np.zeros(len(cat), dtype=np.float32)
+        else:
+            query_vector = cat.vectorizer.transform([query])
+            cosine_sim = (cat.text_matrix @ query_vector.T).toarray().ravel()
     
-    # Get top matches
-    sim_scores = list(enumerate(cosine_sim[0]))
-    sim_scores = sorted(sim_scores, key=lambda x: x[1], reverse=True)
-    song_indices = [i[0] for i in sim_scores[:num_results]]
+    with metrics.stage('top_k'):
+        return cat, top_k(cosine_sim, num_results)
+
+def get_completions(prefix, limit=10):
+    # Typeahead: titles, artists and genres starting a word with `prefix`, most played first.
+    # Answered from the catalog's prefix index alone, without a display fetch.
+    # Capped at the completions precomputed per busy prefix, so no lookup scans a large key range.
+    limit = min(int(limit), prefix_index.TOP_K)
+    with metrics.request('complete'):
+        cat = get_catalog()
+        index = cat.prefix_index
+        with metrics.stage('prefix_lookup'):
+            suggestions = index.complete(prefix, limit)
+        results = []
+        for suggestion in suggestions.tolist():
+            kind, position = index.kind(suggestion)
+            if kind == 'song':
+                artist = cat.artist_codes[position]
+                results.append({'type': 'song', 'id': int(cat.ids[position]), 'title': index.label(suggestion),
+                                'artist_name': cat.artists[artist] if artist >= 0 else None})
+            else:
+                results.append({'type': kind, 'name': index.label(suggestion)})
+        return results
+
+# Ranked lists behind pagination cursors: the first page ranks RANKED_LIST_SIZE
+# songs once, later pages slice the cached list
+RANKED_LIST_SIZE = int(os.getenv('RANKED_LIST_SIZE', '500'))
+RANKED_LIST_TTL = float(os.getenv('RANKED_LIST_TTL', '900'))
+RANKED_LIST_MAX_BYTES = int(os.getenv('RANKED_LIST_MAX_BYTES', str(32 << 20)))
+_ranked_lists = pagination.RankedListCache(os.path.join(ARTIFACTS_DIR, 'ranked_lists'),
+                                           RANKED_LIST_MAX_BYTES, RANKED_LIST_TTL)
+
+def is_song_id(value):
+    return (isinstance(value, int) and not isinstance(value, bool)) or \
+        (isinstance(value, str) and value.strip().isdigit())
+
+def is_seed_set(value):
+    if not isinstance(value, (str, list, dict)):
+        return False
+    try:
+        return bool(parse_seeds(value))
+    except (ValueError, TypeError, IndexError):
+        return False
+
+# Pageable commands: ranking function (list size first, then the command's args), default page
+# size, and one check per argument, the trailing ones optional beyond the required count.
+# Args read back from a cursor must pass the checks before they reach the ranking function.
+PAGED_COMMANDS = {
+    'search': (lambda size, query: rank_search(query, size), 10, (lambda query: isinstance(query, str),), 1),
+    'recommend': (lambda size, song_id: rank_hybrid(song_id=song_id, num_recommendations=size), 5,
+                  (is_song_id,), 1),
+    'similar': (lambda size, song_id: rank_hybrid(song_id=song_id, num_recommendations=size), 4,
+                (is_song_id,), 1),
+    'initial': (lambda size: rank_hybrid(num_recommendations=size), 10, (), 0),
+    'multi': (lambda size, seeds, mode='centroid':
+              rank_hybrid(num_recommendations=size, seeds=seeds, seed_mode=mode), 10,
+              (is_seed_set, lambda mode: mode in SEED_MODES), 1),
+}
+
+def valid_page_args(command, args):
+    _, _, checks, required = PAGED_COMMANDS[command]
+    return required <= len(args) <= len(checks) and all(check(arg) for check, arg in zip(checks, args))
+
+def get_page(command=None, args=(), limit=None, cursor=None):
+    # One page plus the cursor for the next (None after the last). A cursor is served from
+    # its cached list; it is re-ranked only if that list expired or the catalog changed.
+    offset, list_id, version = 0, None, None
+    if cursor is not None:
+        state = pagination.decode_cursor(cursor)
+        command, args, offset = state['command'], state['args'], state['offset']
+        list_id, version = state['list'], state['catalog']
+        limit = limit or state['limit']
+        # A stale or tampered cursor fails the same way as a malformed one
+        if command not in PAGED_COMMANDS or not valid_page_args(command, args):
+            raise ValueError('Invalid cursor')
+    if command not in PAGED_COMMANDS:
+        raise ValueError(f"Command '{command}' does not support pages")
+    rank, default_limit, _, _ = PAGED_COMMANDS[command]
+    limit = int(limit or default_limit)
+    if limit <= 0:
+        raise ValueError("Page size must be positive")
     
-    return df.iloc[song_indices].to_dict('records')
+    with metrics.request('page'):
+        cat = get_catalog()
+        ids = _ranked_lists.get(list_id) if list_id is not None and version == cat.version else None
+        if ids is None:
+            metrics.inc('ranked_list_misses_total', reason='new' if cursor is None else 'expired')
+            cat, top = rank(RANKED_LIST_SIZE, *args)
+            ids = cat.ids[top]
+            list_id = _ranked_lists.put(ids)
+        
+        end = offset + limit
+        next_cursor = None
+        if end < len(ids):
+            next_cursor = pagination.encode_cursor({
+                'command': command, 'args': list(args), 'offset': end, 'limit': limit,
+                'list': list_id, 'catalog': cat.version,
+            })
+        with metrics.stage('display_fetch'):
+            return {'results': cat.display.records(ids[offset:end]), 'next_cursor': next_cursor}
+
+SERVE_COMMANDS = {
+    'search': search_songs,
+    'recommend': get_recommendations,
+    'initial': get_initial_recommendations,
+    'similar': get_similar_songs,
+    'personal': get_personal_recommendations,
+    'trending': get_trending_songs,
+    'multi': get_seed_set_recommendations,
+    'complete': get_completions,
+    'cold-start': get_cold_start_recommendations,
+}
+
+# Commands that take a latency budget ("budget_ms" in serve, --budget-ms on the command line)
+BUDGETED_COMMANDS = ('recommend', 'initial', 'similar', 'personal', 'multi')
+
+def serve(stdin=sys.stdin, stdout=sys.stdout):
+    # Resident mode: one JSON request per line ({"command": ..., "args": [...]}), one JSON reply per line.
+    # Adding "limit" and/or "cursor" asks for a page: the reply then also carries "next_cursor".
+    # Adding "budget_ms" to a BUDGETED_COMMANDS request: the reply then also carries "degradation".
+    source = event_source_from_env()
+    if source is not None:
+        start_event_ingest(source)
+    try:
+        for line in stdin:
+            if not line.strip():
+                continue
+            try:
+                request = json.loads(line)
+                if request.get('cursor') is not None or request.get('limit') is not None:
+                    page = get_page(request.get('command'), request.get('args', []),
+                                    request.get('limit'), request.get('cursor'))
+                    reply = {'result': page['results'], 'next_cursor': page['next_cursor']}
+                else:
+                    handler = SERVE_COMMANDS.get(request.get('command'))
+                    if handler is None:
+                        raise ValueError(f"Unknown command '{request.get('command')}'")
+                    if request.get('budget_ms') is not None:
+                        if request.get('command') not in BUDGETED_COMMANDS:
+                            raise ValueError(f"Command '{request.get('command')}' does not take a latency budget")
+                        answer = handler(*request.get('args', []), budget_ms=request['budget_ms'])
+                        reply = {'result': answer['results'], 'degradation': answer['degradation']}
+                    else:
+                        reply = {'result': handler(*request.get('args', []))}
+            except Exception as e:
+                print(f"Error in serve: {str(e)}", file=sys.stderr)
+                reply = {'error': str(e)}
+            stdout.write(json.dumps(reply) + '\n')
+            stdout.flush()
+    finally:
+        stop_event_ingest()
+
+def print_startup_report(command):
+    # --profile-startup: where this run's time went, as JSON on stderr so stdout stays parseable
+    print(json.dumps({'startup': startup.report(command=command)}), file=sys.stderr)
 
 if __name__ == '__main__':
+    if '--profile-startup' in sys.argv:
+        sys.argv.remove('--profile-startup')
+        atexit.register(print_startup_report, sys.argv[1] if len(sys.argv) > 1 else None)
+    
+    limit = None
+    if '--limit' in sys.argv:
+        index = sys.argv.index('--limit')
+        if index + 1 >= len(sys.argv):
+            print("Error: --limit needs a page size")
+            sys.exit(1)
+        value = sys.argv[index + 1]
+        if not value.isdigit() or int(value) <= 0:
+            print(f"Error: --limit needs a positive page size, got '{value}'")
+            sys.exit(1)
+        limit = int(value)
+        del sys.argv[index:index + 2]
+    
+    budget_ms = None
+    if '--budget-ms' in sys.argv:
+        index = sys.argv.index('--budget-ms')
+        if index + 1 >= len(sys.argv):
+            print("Error: --budget-ms needs a latency budget in milliseconds")
+            sys.exit(1)
+        value = sys.argv[index + 1]
+        try:
+            budget_ms = float(value)
+        except ValueError:
+            budget_ms = None
+        if budget_ms is None or not np.isfinite(budget_ms) or budget_ms <= 0:
+            print(f"Error: --budget-ms needs a positive number of milliseconds, got '{value}'")
+            sys.exit(1)
+        del sys.argv[index:index + 2]
+    
+    seed_mode = 'centroid'
+    if '--mode' in sys.argv:
+        index = sys.argv.index('--mode')
+        if index + 1 >= len(sys.argv):
+            print(f"Error: --mode needs one of {', '.join(SEED_MODES)}")
+            sys.exit(1)
+        seed_mode = sys.argv[index + 1]
+        del sys.argv[index:index + 2]
+    
     if len(sys.argv) < 2:
         print("Usage: python recommender.py <command> [args]")
         print("Commands:")
         print("  search <query> - Search for songs")
+        print("  complete <prefix> - Suggest song titles, artists and genres as a search is typed")
         print("  recommend <song_id> - Get recommendations for a song")
         print("  initial - Get initial recommendations")
         print("  similar <song_id> - Get similar songs")
+        print("  personal <user_id> - Get recommendations from a user's taste profile")
+        print("  cold-start <genre,...> [randomness] - Get a feed from preferred genres for a user without history")
+        print("  multi <song_id[:weight],...> [--mode centroid|max] - Get recommendations for a playlist or queue")
+        print("  update-profile <user_id> <song_id> [play|like] - Fold one event into a taste profile")
+        print("  build-profiles - Rebuild all taste profiles from play history and likes")
+        print("  trending - Get the songs with the most recent plays and likes")
+        print("  build-trending - Recount trending scores from plays, likes and skips")
+        print("  serve - Answer JSON-line requests on stdin, applying live events from RECOMMENDER_EVENTS(_FILE)")
+        print("  page <cursor> [--limit N] - Get the next page of a paged search/recommend/similar/initial/multi")
+        print("Add --limit N to search, recommend, similar, initial or multi to get one page and a cursor for the next")
+        print("Add --budget-ms N to recommend, initial, similar, personal or multi to answer within N ms,")
+        print("  degrading to cheaper scores if need be; the output then says which degradation level was used")
+        print("Add --profile-startup to any command to print an import/initialisation time breakdown on stderr")
         sys.exit(1)
     
     command = sys.argv[1]
     
-    if command == 'search':
+    if command == 'page':
+        if len(sys.argv) < 3:
+            print("Error: Cursor required")
+            sys.exit(1)
+        print(json.dumps(get_page(cursor=sys.argv[2], limit=limit)))
+    elif limit is not None and command in PAGED_COMMANDS:
+        args = sys.argv[2:3]
+        if command != 'initial' and not args:
+            print(f"Error: {command} needs a query or song ID")
+            sys.exit(1)
+        if command == 'multi':
+            args.append(seed_mode)
+        print(json.dumps(get_page(command, args if command != 'initial' else [], limit)))
+    elif command == 'search':
         if len(sys.argv) < 3:
             print("Error: Search query required")
             sys.exit(1)
         query = sys.argv[2]
         results = search_songs(query)
         print(json.dumps(results))
+    elif command == 'complete':
+        if len(sys.argv) < 3:
+            print("Error: Prefix required")
+            sys.exit(1)
+        print(json.dumps(get_completions(sys.argv[2])))
     elif command == 'recommend':
         if len(sys.argv) < 3:
             print("Error: Song ID required")
             sys.exit(1)
         song_id = sys.argv[2]
-        recommendations = get_recommendations(song_id)
+        recommendations = get_recommendations(song_id, budget_ms=budget_ms)
         print(json.dumps(recommendations))
     elif command == 'initial':
-        recommendations = get_initial_recommendations()
+        recommendations = get_initial_recommendations(budget_ms=budget_ms)
         print(json.dumps(recommendations))
     elif command == 'similar':
         if len(sys.argv) < 3:
             print("Error: Song ID required")
             sys.exit(1)
         song_id = sys.argv[2]
-        similar_songs = get_similar_songs(song_id)
+        similar_songs = get_similar_songs(song_id, budget_ms=budget_ms)
         print(json.dumps(similar_songs))
+    elif command == 'personal':
+        if len(sys.argv) < 3:
+            print("Error: User ID required")
+            sys.exit(1)
+        recommendations = get_personal_recommendations(sys.argv[2], budget_ms=budget_ms)
+        print(json.dumps(recommendations))
+    elif command == 'cold-start':
+        if len(sys.argv) < 3:
+            print("Error: Genres required")
+            sys.exit(1)
+        randomness = sys.argv[3] if len(sys.argv) > 3 else None
+        print(json.dumps(get_cold_start_recommendations(sys.argv[2], randomness=randomness)))
+    elif command == 'multi':
+        if len(sys.argv) < 3:
+            print("Error: Seed song IDs required")
+            sys.exit(1)
+        recommendations = get_seed_set_recommendations(sys.argv[2], mode=seed_mode, budget_ms=budget_ms)
+        print(json.dumps(recommendations))
+    elif command == 'update-profile':
+        if len(sys.argv) < 4:
+            print("Error: User ID and song ID required")
+            sys.exit(1)
+        event = sys.argv[4] if len(sys.argv) > 4 else 'play'
+        with profiles_file_lock():
+            updated = record_user_event(sys.argv[2], sys.argv[3], event)
+            if updated:
+                store = get_profile_store()
+                store.save(PROFILES_DIR, store.catalog_version)
+        print(json.dumps({'updated': updated}))
+    elif command == 'build-profiles':
+        store = build_user_profiles()
+        print(json.dumps({'users': len(store)}))
+    elif command == 'trending':
+        print(json.dumps(get_trending_songs()))
+    elif command == 'build-trending':
+        counters = build_trending()
+        print(json.dumps({'songs': counters.active()}))
+    elif command == 'serve':
+        serve()
     else:
         print(f"Error: Unknown command '{command}'")
         sys.exit(1) 
\ No newline at end of file
@@ -0,0 +1,116 @@
+import logging
+from typing import Callable, Iterable, Iterator, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Length of each analysed stretch of a track, and the step between their starts
+SEGMENT_SECONDS = 10
+SEGMENT_HOP_SECONDS = 5
+
+# A track's final, partial segment is only analysed if it adds at least this much new audio
+MIN_TAIL_SECONDS = 1
+
+# Segments kept per song (about 40 minutes at the default hop); longer tracks are cut
+MAX_SEGMENTS = 512
+
+
+def read_blocks(path: str, block_seconds: float) -> Tuple[Iterator[np.ndarray], int]:
+    """Mono float32 blocks of about `block_seconds` each, decoded lazily, and the sample rate.
+
+    soundfile reads wav, flac, ogg and mp3 without decoding the whole file;
+    anything else goes through audioread (ffmpeg), whose buffers are regrouped
+    into blocks of the same size.
+    """
+    import soundfile as sf
+    try:
+        audio = sf.SoundFile(path)
+    except (RuntimeError, sf.LibsndfileError):
+        return _audioread_blocks(path, block_seconds)
+    block_frames = max(1, int(block_seconds * audio.samplerate))
+
+    def blocks():
+        with audio:
+            for block in audio.blocks(blocksize=block_frames, dtype='float32', always_2d=True):
+                yield block.mean(axis=1)
+
+    return blocks(), audio.samplerate
+
+
+def _audioread_blocks(path: str, block_seconds: float) -> Tuple[Iterator[np.ndarray], int]:
+    import audioread
+    source = audioread.audio_open(path)
+    block_frames = max(1, int(block_seconds * source.samplerate))
+
+    def blocks():
+        with source:
+            pending, size = [], 0
+            for buffer in source:
+                samples = np.frombuffer(buffer, dtype='<i2').astype(np.float32) / 32768.0
+                if source.channels > 1:
+                    samples = samples[:len(samples) - len(samples) % source.channels]
+                    samples = samples.reshape(-1, source.channels).mean(axis=1)
+                pending.append(samples)
+                size += len(samples)
+                if size >= block_frames:
+                    joined = np.concatenate(pending)
+                    cut = len(joined) - len(joined) % block_frames
+                    for start in range(0, cut, block_frames):
+                        yield joined[start:start + block_frames]
+                    pending, size = [joined[cut:]], len(joined) - cut
+            if size:
+                yield np.concatenate(pending)
+
+    return blocks(), source.samplerate
+
+
+def sliding_windows(blocks: Iterable[np.ndarray], window: int, hop: int,
+                    min_tail: int = 0) -> Iterator[Tuple[int, np.ndarray]]:
+    """(start sample, samples) windows of `window` samples every `hop` samples.
+
+    Only one window of audio is held at a time. The end of the stream yields
+    a shorter final window if it adds at least `min_tail` samples past the
+    last full one; a stream shorter than one window yields itself.
+    """
+    buffer = np.zeros(window, dtype=np.float32)
+    filled = 0        # samples of buffer holding audio
+    start = 0         # stream position of buffer[0]
+    emitted_end = 0   # stream position where the last yielded window ended
+    for block in blocks:
+        block = np.asarray(block, dtype=np.float32)
+        while len(block):
+            take = min(window - filled, len(block))
+            buffer[filled:filled + take] = block[:take]
+            filled += take
+            block = block[take:]
+            if filled == window:
+                yield start, buffer.copy()
+                emitted_end = start + window
+                buffer[:window - hop] = buffer[hop:]
+                filled -= hop
+                start += hop
+    if filled and (emitted_end == 0 or start + filled - emitted_end >= max(min_tail, 1)):
+        yield start, buffer[:filled].copy()
+
+
+def segment_matrix(path: str, featurize: Callable[[np.ndarray, int], Optional[np.ndarray]],
+                   segment_seconds: float = SEGMENT_SECONDS, hop_seconds: float = SEGMENT_HOP_SECONDS,
+                   max_segments: int = MAX_SEGMENTS) -> Optional[np.ndarray]:
+    """One feature vector per overlapping segment of the whole track, as a (segments, dims) float32 matrix.
+
+    The file is decoded a hop at a time, so memory stays at one segment of
+    audio whatever the track length. Segments `featurize` rejects (returns
+    None for, e.g. silence) are left out; None if no segment survives.
+    """
+    blocks, sr = read_blocks(path, hop_seconds)
+    window, hop = int(segment_seconds * sr), int(hop_seconds * sr)
+    rows = []
+    for _, samples in sliding_windows(blocks, window, hop, int(MIN_TAIL_SECONDS * sr)):
+        row = featurize(samples, sr)
+        if row is not None and np.isfinite(row).all():
+            rows.append(np.asarray(row, dtype=np.float32))
+        if len(rows) >= max_segments:
+            logger.warning(f"Kept the first {max_segments} segments of {path}")
+            break
+    return np.stack(rows) if rows else None
@@ -0,0 +1,231 @@
+import heapq
+import itertools
+import logging
+import multiprocessing
+import os
+import threading
+from multiprocessing import shared_memory
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from scipy import sparse
+
+logger = logging.getLogger(__name__)
+
+# CompactCatalog arrays the workers score against
+SHARED_ARRAYS = ('features', 'feature_norms', 'genre_codes', 'artist_codes', 'plays', 'created_days')
+
+# Per-worker attachments, set up once by _attach()
+_worker = {}
+
+
+def _attach(layout: Dict[str, Tuple[str, str, tuple]], text_columns: int):
+    """Pool initializer: map every shared array into this process without copying."""
+    _worker.clear()
+    _worker['text_columns'] = text_columns
+    _worker['blocks'] = []
+    _worker['csr'] = {}
+    for name, (block_name, dtype, shape) in layout.items():
+        block = shared_memory.SharedMemory(name=block_name)
+        _worker['blocks'].append(block)
+        _worker[name] = np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf)
+
+
+def _text_rows(start: int, end: int) -> sparse.csr_matrix:
+    # CSR view of rows [start, end); only the small indptr slice is copied
+    key = (start, end)
+    matrix = _worker['csr'].get(key)
+    if matrix is None:
+        indptr = _worker['text_indptr'][start:end + 1]
+        lo, hi = indptr[0], indptr[-1]
+        matrix = sparse.csr_matrix((_worker['text_data'][lo:hi], _worker['text_indices'][lo:hi], indptr - lo),
+                                   shape=(end - start, _worker['text_columns']))
+        _worker['csr'][key] = matrix
+    return matrix
+
+
+def _score_shard(task: Dict[str, Any]) -> Tuple[np.ndarray, np.ndarray]:
+    """Hybrid scores for one shard of one request; returns its top-k positions and scores."""
+    start, end = task['start'], task['end']
+    weights = task['weights']
+    n = end - start
+    scores = np.zeros(n, dtype=np.float32)
+
+    seed = task.get('seed')
+    if seed is not None:
+        indices, data = seed['text']
+        seed_row = sparse.csr_matrix((data, indices, [0, len(indices)]), shape=(1, _worker['text_columns']))
+        text_sim = (_text_rows(start, end) @ seed_row.T).toarray().ravel()
+        features = _worker['features'][start:end]
+        norms = _worker['feature_norms'][start:end] * seed['norm']
+        audio_sim = np.divide(features @ seed['features'], norms, out=np.zeros(n, dtype=np.float32), where=norms > 0)
+        genres = _worker['genre_codes'][start:end]
+        artists = _worker['artist_codes'][start:end]
+        genre_sim = (genres == seed['genre']) & (genres >= 0)
+        artist_sim = (artists == seed['artist']) & (artists >= 0)
+        content = 0.3 * text_sim + 0.3 * audio_sim + 0.2 * genre_sim + 0.2 * artist_sim
+        scores += weights.get('content', 0) * content
+
+    taste = task.get('taste')
+    if taste is not None:
+        features = _worker['features'][start:end]
+        norms = _worker['feature_norms'][start:end] * np.float32(np.linalg.norm(taste))
+        taste_sim = np.divide(features @ taste, norms, out=np.zeros(n, dtype=np.float32), where=norms > 0)
+        scores += weights.get('taste', 0) * taste_sim
+
+    collaborative = task['collaborative']
+    if collaborative[0] == 'dense':
+        scores += weights.get('collaborative', 0) * _worker['scratch'][collaborative[1], start:end]
+    else:
+        _, default, positions, values = collaborative
+        local = np.full(n, default, dtype=np.float32)
+        inside = (positions >= start) & (positions < end)
+        local[positions[inside] - start] = values[inside]
+        scores += weights.get('collaborative', 0) * local
+
+    popularity = task.get('popularity')
+    if popularity is not None:
+        scores += weights.get('popularity', 0) * _worker['popularity'][popularity, start:end]
+    elif task['max_plays'] > 0:
+        scores += weights.get('popularity', 0) * (_worker['plays'][start:end] / task['max_plays'])
+    if task['max_recency'] > 0:
+        recency = task['today'] - _worker['created_days'][start:end]
+        scores += weights.get('recency', 0) * (1 - recency / task['max_recency'])
+    else:
+        scores += weights.get('recency', 0)
+
+    for position in task.get('exclude', ()):
+        if start <= position < end:
+            scores[position - start] = -np.inf
+
+    k = min(task['k'], n)
+    if k <= 0:
+        return np.array([], dtype=np.int64), np.array([], dtype=np.float32)
+    candidates = np.argpartition(-scores, k - 1)[:k] if k < n else np.arange(n)
+    candidates = candidates[np.isfinite(scores[candidates])]
+    order = np.argsort(-scores[candidates], kind='stable')
+    return candidates[order] + start, scores[candidates[order]]
+
+
+def merge_top_k(parts: List[Tuple[np.ndarray, np.ndarray]], k: int) -> np.ndarray:
+    """k-way merge of per-shard best-first lists into the global top-k positions."""
+    streams = [zip((-scores).tolist(), positions.tolist()) for positions, scores in parts]
+    return np.array([position for _, position in itertools.islice(heapq.merge(*streams), k)], dtype=np.int64)
+
+
+class ShardedScorer:
+    """Scores a CompactCatalog across a pool of worker processes.
+
+    The catalog's scoring arrays and TF-IDF CSR are copied once into shared
+    memory; workers map them in place. Each request is split into row shards,
+    every shard returns its local top-k, and the parent merges them. A batch of
+    requests is submitted as one set of shard tasks so all workers stay busy.
+    Dense collaborative and popularity scores are passed through a small set of
+    shared scratch rows.
+    """
+
+    def __init__(self, cat, workers: Optional[int] = None, shards_per_worker: int = 2,
+                 scratch_slots: int = 8):
+        self.workers = workers or os.cpu_count() or 1
+        self.n = len(cat)
+        self.catalog = cat
+        self.scratch_slots = scratch_slots
+        self._blocks: List[shared_memory.SharedMemory] = []
+        self._lock = threading.Lock()
+
+        layout = {}
+        arrays = {name: getattr(cat, name) for name in SHARED_ARRAYS}
+        arrays['text_data'] = cat.text_matrix.data
+        arrays['text_indices'] = cat.text_matrix.indices
+        arrays['text_indptr'] = cat.text_matrix.indptr
+        arrays['scratch'] = np.zeros((scratch_slots, self.n), dtype=np.float32)
+        arrays['popularity'] = np.zeros((scratch_slots, self.n), dtype=np.float32)
+        for name, array in arrays.items():
+            layout[name] = self._share(array)
+        self._scratch = self._view(layout['scratch'])
+        self._popularity = self._view(layout['popularity'])
+
+        n_shards = max(1, min(self.n, self.workers * shards_per_worker))
+        bounds = np.linspace(0, self.n, n_shards + 1).astype(np.int64)
+        self.shards = [(int(a), int(b)) for a, b in zip(bounds[:-1], bounds[1:]) if b > a]
+
+        context = multiprocessing.get_context('fork' if 'fork' in multiprocessing.get_all_start_methods() else 'spawn')
+        self._pool = context.Pool(self.workers, initializer=_attach,
+                                  initargs=(layout, cat.text_matrix.shape[1]))
+        logger.info(f"Sharded scorer: {self.n} songs, {len(self.shards)} shards, {self.workers} workers")
+
+    def _share(self, array: np.ndarray) -> Tuple[str, str, tuple]:
+        array = np.ascontiguousarray(array)
+        block = shared_memory.SharedMemory(create=True, size=max(1, array.nbytes))
+        self._blocks.append(block)
+        np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+        return block.name, array.dtype.str, array.shape
+
+    def _view(self, spec: Tuple[str, str, tuple]) -> np.ndarray:
+        block = next(b for b in self._blocks if b.name == spec[0])
+        return np.ndarray(spec[2], dtype=np.dtype(spec[1]), buffer=block.buf)
+
+    def _seed(self, position: int) -> Dict[str, Any]:
+        cat = self.catalog
+        row = cat.text_matrix[position]
+        return {
+            'text': (row.indices, row.data),
+            'features': cat.features[position],
+            'norm': cat.feature_norms[position],
+            'genre': cat.genre_codes[position],
+            'artist': cat.artist_codes[position],
+        }
+
+    def top_k(self, requests: List[Dict[str, Any]], context: Dict[str, Any]) -> List[np.ndarray]:
+        """Top-k catalog positions for each request.
+
+        A request has `weights`, `k`, optional `seed` (a catalog position), `taste`
+        (a feature-space vector), `exclude` positions, and `collaborative`: either
+        a dense per-song array or ('sparse', default, positions, values). An
+        optional dense `popularity` array replaces the plays-based popularity.
+        `context` carries the catalog-wide max_plays, max_recency and today.
+        """
+        results = []
+        for offset in range(0, len(requests), self.scratch_slots):
+            results.extend(self._run_batch(requests[offset:offset + self.scratch_slots], context))
+        return results
+
+    def _run_batch(self, requests, context):
+        with self._lock:
+            tasks = []
+            for slot, request in enumerate(requests):
+                collaborative = request['collaborative']
+                if not isinstance(collaborative, tuple):
+                    self._scratch[slot] = collaborative
+                    collaborative = ('dense', slot)
+                popularity = request.get('popularity')
+                if popularity is not None:
+                    self._popularity[slot] = popularity
+                    popularity = slot
+                base = {
+                    'weights': request['weights'],
+                    'k': request['k'],
+                    'exclude': list(request.get('exclude') or ()),
+                    'collaborative': collaborative,
+                    'popularity': popularity,
+                    'seed': None if request.get('seed') is None else self._seed(request['seed']),
+                    'taste': request.get('taste'),
+                    **context,
+                }
+                tasks.extend(dict(base, start=start, end=end) for start, end in self.shards)
+
+            parts = self._pool.map(_score_shard, tasks, chunksize=1)
+
+        per_request = len(self.shards)
+        return [merge_top_k(parts[i * per_request:(i + 1) * per_request], request['k'])
+                for i, request in enumerate(requests)]
+
+    def close(self):
+        self._pool.terminate()
+        self._pool.join()
+        self._scratch = None
+        self._popularity = None
+        for block in self._blocks:
+            block.close()
+            block.unlink()
+        self._blocks = []
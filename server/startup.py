@@ -0,0 +1,102 @@
+import importlib
+import os
+import sys
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+# index.js spawns the CLIs once per request, so everything imported at module
+# load is paid on every call. Heavy dependencies go through lazy_module() and
+# are only imported by the commands that touch them; the time each one takes
+# is recorded here for --profile-startup.
+import_seconds: Dict[str, float] = {}
+phase_seconds: Dict[str, float] = {}
+
+
+def process_age() -> Optional[float]:
+    """Seconds since this process started, from /proc; None where unavailable."""
+    try:
+        with open('/proc/self/stat') as f:
+            # Fields after the parenthesised command name start at field 3; starttime is field 22
+            start_ticks = int(f.read().rsplit(')', 1)[1].split()[19])
+        with open('/proc/uptime') as f:
+            uptime = float(f.read().split()[0])
+        return max(0.0, uptime - start_ticks / os.sysconf('SC_CLK_TCK'))
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+# Interpreter start-up plus whatever was imported before this module
+_age_at_import = process_age()
+_imported_at = time.perf_counter()
+
+
+class LazyModule:
+    """Stand-in for a module that imports it on first attribute access."""
+
+    def __init__(self, name: str):
+        self.__dict__['_name'] = name
+        self.__dict__['_module'] = None
+
+    def _load(self):
+        module = self.__dict__['_module']
+        if module is None:
+            # Always go through import_module: it waits for an import another
+            # thread has started, where sys.modules would hand out a half-initialised module
+            name = self.__dict__['_name']
+            loaded = name in sys.modules
+            start = time.perf_counter()
+            module = importlib.import_module(name)
+            if not loaded:
+                import_seconds[name] = time.perf_counter() - start
+            self.__dict__['_module'] = module
+        return module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __repr__(self):
+        state = 'loaded' if self.__dict__['_module'] is not None else 'not loaded'
+        return f"<lazy module '{self.__dict__['_name']}' ({state})>"
+
+
+def lazy_module(name: str) -> LazyModule:
+    return LazyModule(name)
+
+
+@contextmanager
+def phase(name: str):
+    """Add the time spent in the block to `phase_seconds[name]`."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        phase_seconds[name] = phase_seconds.get(name, 0.0) + time.perf_counter() - start
+
+
+_imports_done = None
+
+
+def imports_done():
+    """Mark the end of the caller's module-level imports."""
+    global _imports_done
+    _imports_done = time.perf_counter() - _imported_at
+
+
+def report(**extra) -> dict:
+    """Start-up breakdown for this process, in seconds.
+
+    `interpreter` is everything before this module was imported, `imports` the
+    eager imports up to imports_done() and `run` the rest. Lazy imports and the
+    named phases are part of `run`.
+    """
+    imports = _imports_done or 0.0
+    return {
+        'interpreter': _age_at_import,
+        'imports': imports,
+        'lazy_imports': dict(sorted(import_seconds.items(), key=lambda item: -item[1])),
+        'phases': dict(phase_seconds),
+        'run': time.perf_counter() - _imported_at - imports,
+        'total': process_age(),
+        **extra,
+    }
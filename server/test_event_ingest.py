@@ -0,0 +1,120 @@
+import os
+import tempfile
+import time
+from datetime import datetime
+
+os.environ.setdefault('RECOMMENDER_ARTIFACTS_DIR', tempfile.mkdtemp())
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import benchmark_recommender
+import event_ingest
+import recommender
+
+# A user with no skips of their own, who still sees the anonymous ones
+UNKNOWN_USER = 10 ** 6
+
+
+@pytest.fixture
+def provider():
+    songs = benchmark_recommender.generate_catalog(400)
+    skips = benchmark_recommender.generate_skips(songs['id'].to_numpy(), 3000)
+    provider = benchmark_recommender.InMemoryDataProvider(songs, skips)
+    recommender.set_data_provider(provider)
+    yield provider
+    recommender.stop_event_ingest()
+    recommender.set_data_provider(None)
+
+
+def named_user(provider):
+    return int(provider.skips['user_id'].value_counts().index[0])
+
+
+def add_skip(provider, song_id, user_id, skip_type, created_at):
+    """Insert a skip_history row and return its event, stamped with the row's created_at."""
+    row = pd.DataFrame({'song_id': [song_id], 'skip_type': [skip_type], 'skip_time': [10],
+                        'created_at': [created_at], 'user_id': [np.nan if user_id is None else user_id]})
+    provider.skips = pd.concat([provider.skips, row], ignore_index=True)
+    return {'type': 'skip', 'song_id': song_id, 'user_id': user_id, 'skip_type': skip_type,
+            'timestamp': float(created_at.value // 10 ** 9)}
+
+
+def assert_matches_skip_patterns(aggregates, cat, user_id):
+    expected = recommender.collaborative_scores(cat, recommender.get_skip_patterns(user_id))
+    actual = recommender.collaborative_from_counts(*aggregates.skip_counts(user_id))
+    np.testing.assert_allclose(actual, expected, rtol=1e-6)
+
+
+def snapshot(cat):
+    history = recommender.get_skip_history()
+    positions = cat.positions(pd.to_numeric(history['song_id'], errors='coerce').fillna(-1))
+    return event_ingest.EventAggregates.from_skip_history(history, positions, len(cat), cat.position)
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline, 'events did not arrive in time'
+        time.sleep(0.01)
+
+
+def test_snapshot_cutoff_is_its_newest_skip(provider):
+    aggregates = snapshot(recommender.get_catalog())
+    assert aggregates.since == recommender.get_skip_history()['timestamp'].max()
+
+
+def test_live_skips_match_skip_patterns(provider):
+    cat = recommender.get_catalog()
+    aggregates = snapshot(cat)
+    user_id = named_user(provider)
+    for user in (None, user_id, UNKNOWN_USER):
+        assert_matches_skip_patterns(aggregates, cat, user)
+
+    song_ids = provider.songs['id'].to_numpy()
+    now = pd.Timestamp(datetime.now()).floor('s')
+    events = [
+        add_skip(provider, int(song_ids[0]), None, 'quick', now),
+        add_skip(provider, int(song_ids[1]), user_id, 'late', now),
+        add_skip(provider, int(song_ids[2]), UNKNOWN_USER, 'quick', now),
+        # Songs outside the catalog still count towards the totals
+        add_skip(provider, int(song_ids.max()) + 1, user_id, 'mid', now),
+        {'type': 'play', 'song_id': int(song_ids[0]), 'user_id': user_id, 'skip_type': None,
+         'timestamp': float(now.value // 10 ** 9)},
+    ]
+    for event in events:
+        aggregates.apply(event)
+    for user in (None, user_id, UNKNOWN_USER):
+        assert_matches_skip_patterns(aggregates, cat, user)
+
+
+def test_buffered_events_replay_once_after_snapshot(provider, tmp_path):
+    cat = recommender.get_catalog()
+    user_id = named_user(provider)
+    song_ids = provider.songs['id'].to_numpy()
+    log = str(tmp_path / 'events.jsonl')
+    base = pd.Timestamp(datetime.now()).floor('s') + pd.Timedelta(seconds=60)
+
+    # Both arrive before the snapshot is read, but only the first row is committed by then
+    in_snapshot = add_skip(provider, int(song_ids[0]), user_id, 'quick', base)
+    event_ingest.append_event(log, in_snapshot)
+    not_in_snapshot = {'type': 'skip', 'song_id': int(song_ids[1]), 'user_id': None,
+                       'skip_type': 'quick', 'timestamp': in_snapshot['timestamp'] + 1}
+    event_ingest.append_event(log, not_in_snapshot)
+
+    ingestor = recommender.start_event_ingest(
+        event_ingest.FileEventSource(log, from_start=True, poll_interval=0.01))
+    wait_for(lambda: ingestor.received >= 2)
+    aggregates = recommender.get_event_aggregates(cat)
+    assert aggregates.since == in_snapshot['timestamp']
+    add_skip(provider, not_in_snapshot['song_id'], None, 'quick', base + pd.Timedelta(seconds=1))
+    for user in (None, user_id, UNKNOWN_USER):
+        assert_matches_skip_patterns(aggregates, cat, user)
+
+    event_ingest.append_event(log, add_skip(provider, int(song_ids[2]), user_id, 'late',
+                                            base + pd.Timedelta(seconds=2)))
+    # The replayed event and the live one
+    wait_for(lambda: aggregates.applied >= 2)
+    for user in (None, user_id, UNKNOWN_USER):
+        assert_matches_skip_patterns(aggregates, cat, user)
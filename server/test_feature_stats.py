@@ -0,0 +1,61 @@
+import numpy as np
+import pytest
+
+from feature_stats import FeatureStats
+
+
+def random_values(rows, seed=0):
+    rng = np.random.default_rng(seed)
+    # Columns on very different scales, like tempo next to energy
+    return (rng.normal(size=(rows, 4)) * [60.0, 0.2, 5.0, 1e-3] + [120.0, 0.5, -8.0, 0.0]).astype(np.float32)
+
+
+@pytest.mark.parametrize('sizes', [(1000,), (700, 300), (1, 999), (250, 250, 250, 250), (0, 500, 0, 10)])
+def test_merged_shards_equal_stats_over_concatenation(sizes):
+    shards = [random_values(size, seed) for seed, size in enumerate(sizes)]
+    combined = FeatureStats.combine(FeatureStats.from_values(shard) for shard in shards)
+    data = np.concatenate(shards).astype(np.float64)
+    assert combined.count == len(data)
+    np.testing.assert_allclose(combined.mean, np.mean(data, axis=0), rtol=1e-10, atol=1e-12)
+    np.testing.assert_allclose(combined.variance, np.var(data, axis=0), rtol=1e-10, atol=1e-12)
+
+    sequential = FeatureStats(4)
+    for shard in shards:
+        sequential.update(shard)
+    np.testing.assert_allclose(sequential.mean, combined.mean, rtol=1e-12)
+    np.testing.assert_allclose(sequential.m2, combined.m2, rtol=1e-12)
+
+
+def test_extended_folds_in_only_new_songs():
+    values = random_values(1200)
+    ids = np.arange(1, 1201)
+    stats = FeatureStats.from_values(values[:1000], ids[:1000])
+    assert stats.extended(ids[:1000], values[:1000]) is stats
+
+    extended = stats.extended(ids, values)
+    assert extended is not stats and extended.max_id == 1200
+    np.testing.assert_allclose(extended.mean, values.astype(np.float64).mean(axis=0), rtol=1e-10)
+    np.testing.assert_allclose(extended.variance, values.astype(np.float64).var(axis=0), rtol=1e-10)
+
+
+@pytest.mark.parametrize('edit', ['changed', 'replaced', 'shifted'])
+def test_extended_refits_when_old_songs_change(edit):
+    values = random_values(1000)
+    ids = np.arange(1, 1001)
+    stats = FeatureStats.from_values(values, ids)
+    edited = values.copy()
+    if edit == 'changed':
+        # One song re-analysed: tempo 0.5 BPM off
+        edited[10, 0] += 0.5
+    elif edit == 'replaced':
+        # One song deleted and another with different features inserted under an old id
+        edited[10] = random_values(1, seed=99)[0]
+    else:
+        # Same column sums, different spread
+        edited[10, 1] += 0.05
+        edited[11, 1] -= 0.05
+
+    refitted = stats.extended(ids, edited)
+    assert refitted is not stats
+    np.testing.assert_allclose(refitted.mean, edited.astype(np.float64).mean(axis=0), rtol=1e-10)
+    np.testing.assert_allclose(refitted.variance, edited.astype(np.float64).var(axis=0), rtol=1e-10)
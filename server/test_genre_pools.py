@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+
+import genre_pools
+
+DRAWS = 20000
+
+
+def implied_probabilities(probability, alias):
+    """Chance of each column under alias_table's draw: its own share plus what aliases hand it."""
+    n = len(probability)
+    return (probability + np.bincount(alias, weights=1.0 - probability, minlength=n)) / n
+
+
+@pytest.mark.parametrize('weights', [
+    np.array([1.0, 2.0, 3.0, 4.0]),
+    np.array([0.0, 5.0, 0.0, 1.0, 0.5]),
+    np.array([1e-6, 1.0, 1000.0]),
+    np.zeros(4),
+    np.ones(1),
+])
+def test_alias_table_reproduces_weights(weights):
+    probability, alias = genre_pools.alias_table(weights)
+    total = weights.sum()
+    expected = weights / total if total > 0 else np.full(len(weights), 1.0 / len(weights))
+    np.testing.assert_allclose(implied_probabilities(probability, alias), expected, atol=1e-12)
+
+
+def empirical(pools, genres, randomness, n_songs):
+    rng = np.random.default_rng(42)
+    draws = np.concatenate([pools.sample(genres, 1, rng, randomness) for _ in range(DRAWS)])
+    return np.bincount(draws, minlength=n_songs) / DRAWS
+
+
+@pytest.mark.parametrize('randomness', [0.0, 0.5, 1.0])
+def test_sample_frequencies_follow_scores(randomness):
+    scores = np.array([8.0, 4.0, 2.0, 1.0, 1.0, 0.5, 3.0, 1.0, 0.0, 0.0])
+    genre_codes = np.array([0, 0, 0, 0, 0, 0, 1, 1, 1, -1])
+    pools = genre_pools.GenrePools.build(genre_codes, scores, 2)
+
+    # Each draw picks a genre uniformly, then a song uniformly or by score
+    expected = np.zeros(len(scores))
+    for genre in (0, 1):
+        members = genre_codes == genre
+        weighted = scores[members] / scores[members].sum()
+        uniform = 1.0 / members.sum()
+        expected[members] = 0.5 * (randomness * uniform + (1 - randomness) * weighted)
+
+    frequencies = empirical(pools, [0, 1], randomness, len(scores))
+    tolerance = 4 * np.sqrt(expected * (1 - expected) / DRAWS) + 1e-9
+    assert (np.abs(frequencies - expected) <= tolerance).all(), (frequencies, expected)
+
+
+def test_sample_is_uniform_at_full_randomness():
+    scores = np.array([100.0, 1.0, 0.0, 0.0, 0.0])
+    pools = genre_pools.GenrePools.build(np.zeros(5, dtype=np.int64), scores, 1)
+    frequencies = empirical(pools, [0], 1.0, len(scores))
+    np.testing.assert_allclose(frequencies, 0.2, atol=4 * np.sqrt(0.2 * 0.8 / DRAWS))
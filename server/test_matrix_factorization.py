@@ -0,0 +1,88 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+from scipy import sparse
+
+import matrix_factorization
+
+USERS, ITEMS, FACTORS = 40, 60, 8
+
+
+@pytest.fixture(scope='module')
+def problem():
+    rng = np.random.default_rng(0)
+    dense = np.zeros((USERS, ITEMS))
+    mask = rng.random((USERS, ITEMS)) < 0.15
+    # Plays are positive strengths, skips negative ones
+    dense[mask] = rng.choice([-2.0, -1.0, -0.5, 1.0, 2.0, 5.0], mask.sum())
+    dense[3] = 0.0  # a user with no interactions
+    dense[5, :] = 0.0
+    dense[5, 7] = -1.0  # a user who has only skipped
+    matrix = sparse.csr_matrix(dense)
+    fixed = (rng.standard_normal((ITEMS, FACTORS)) * 0.5).astype(np.float32)
+    return matrix, fixed
+
+
+def exact_rows(model, matrix, fixed):
+    """Per-row np.linalg.solve of (Yt C_u Y + lambda I) x = Yt C_u p_u."""
+    Y = fixed.astype(np.float64)
+    dense = matrix.toarray()
+    solutions = np.zeros((dense.shape[0], model.factors))
+    for u, row in enumerate(dense):
+        confidence = 1.0 + model.alpha * np.abs(row)
+        preference = (row > 0).astype(np.float64)
+        a = Y.T @ (confidence[:, None] * Y) + model.regularization * np.eye(model.factors)
+        solutions[u] = np.linalg.solve(a, Y.T @ (confidence * preference))
+    return solutions
+
+
+def solve_block(model, matrix, fixed, start=0, end=USERS):
+    gram = (fixed.T @ fixed).astype(np.float32) + np.float32(model.regularization) * np.eye(FACTORS, dtype=np.float32)
+    target = np.zeros((USERS, FACTORS), dtype=np.float32)
+    model._solve_block(matrix, fixed, target, gram, start, end)
+    return target
+
+
+def a_norm_errors(model, matrix, fixed, x, exact):
+    Y = fixed.astype(np.float64)
+    errors = []
+    for u, row in enumerate(matrix.toarray()):
+        confidence = 1.0 + model.alpha * np.abs(row)
+        a = Y.T @ (confidence[:, None] * Y) + model.regularization * np.eye(model.factors)
+        error = x[u] - exact[u]
+        errors.append(np.sqrt(error @ a @ error))
+    return np.array(errors)
+
+
+def test_cg_converges_to_exact_solve(problem):
+    matrix, fixed = problem
+    # k steps are exact in exact arithmetic; float32 needs a few more
+    model = matrix_factorization.ImplicitALS(factors=FACTORS, cg_steps=2 * FACTORS)
+    exact = exact_rows(model, matrix, fixed)
+    np.testing.assert_allclose(solve_block(model, matrix, fixed), exact, rtol=1e-4, atol=1e-5)
+    np.testing.assert_array_equal(exact[3], 0.0)
+
+
+def test_each_cg_step_moves_towards_exact_solve(problem):
+    matrix, fixed = problem
+    exact = exact_rows(matrix_factorization.ImplicitALS(factors=FACTORS), matrix, fixed)
+    errors = []
+    for steps in range(FACTORS + 1):
+        model = matrix_factorization.ImplicitALS(factors=FACTORS, cg_steps=steps)
+        errors.append(a_norm_errors(model, matrix, fixed, solve_block(model, matrix, fixed), exact))
+    for fewer, more in zip(errors, errors[1:]):
+        assert np.all(more <= fewer * (1 + 1e-4) + 1e-6)
+    assert errors[-1].sum() < 0.01 * errors[0].sum()
+
+
+def test_blocks_solve_rows_independently(problem, monkeypatch):
+    matrix, fixed = problem
+    model = matrix_factorization.ImplicitALS(factors=FACTORS, cg_steps=3)
+    whole = solve_block(model, matrix, fixed)
+    # Blocks of a few users each
+    monkeypatch.setattr(matrix_factorization, 'BLOCK_BYTES', 20 * FACTORS * 4)
+    target = np.zeros((USERS, FACTORS), dtype=np.float32)
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        model._solve(matrix, fixed, target, executor)
+    np.testing.assert_allclose(target, whole, rtol=1e-5, atol=1e-6)
@@ -0,0 +1,70 @@
+import numpy as np
+import pytest
+
+import prefix_index
+
+WORDS = ['love', 'lovely', 'low', 'night', 'nights', 'light', 'life', 'lie', 'in', 'time',
+         'the', 'a', 'café', 'cafe', 'dream', 'dreamer', 'blue', 'blues']
+# Longer than MAX_KEY_BYTES, so labels starting with it share one truncated key
+LONG_WORD = 'supercalifragilisticexpialidocious'
+
+
+@pytest.fixture(scope='module')
+def index_and_labels():
+    rng = np.random.default_rng(0)
+    titles = [' '.join(rng.choice(WORDS, rng.integers(1, 5))) for _ in range(3000)]
+    titles += [f'{LONG_WORD} {word}' for word in WORDS]
+    artists = [f'{word} {rng.choice(WORDS)}' for word in WORDS]
+    genres = ['Blues', 'Dream Pop', 'Lo-Fi', 'Café Jazz']
+    # Few distinct play counts, so popularity ties are common
+    plays = rng.integers(0, 20, len(titles))
+    artist_codes = rng.integers(-1, len(artists), len(titles))
+    genre_codes = rng.integers(-1, len(genres), len(titles))
+    index = prefix_index.PrefixIndex.build(titles, plays, artist_codes, artists, genre_codes, genres)
+    return index, titles + artists + genres
+
+
+def brute_force(index, label_keys, text):
+    """Every label with a word start matching the typed prefix, most popular first."""
+    prefix = prefix_index.normalize(text, keep_trailing_space=True).encode()[:prefix_index.MAX_KEY_BYTES]
+    if not prefix:
+        return []
+    matches = [i for i, keys in enumerate(label_keys) if any(key.startswith(prefix) for key in keys)]
+    return sorted(matches, key=lambda i: (-index.popularity[i], i))
+
+
+def typed_prefixes(labels):
+    prefixes = set()
+    for label in labels[::7]:
+        for key in prefix_index.word_starts(label):
+            text = key.decode(errors='ignore')
+            prefixes.update(text[:length] for length in (1, 2, 3, 5, 8, len(text)))
+    prefixes.update([
+        'love ', 'love!', 'LOVE', 'lo', 'l', 'cafe', 'café', 'Cafe ', 'dream p', 'zzz', '  ',
+        LONG_WORD, LONG_WORD + ' lo', LONG_WORD + ' love', LONG_WORD[:31], LONG_WORD[:33],
+    ])
+    return sorted(prefixes)
+
+
+def test_complete_matches_brute_force(index_and_labels):
+    index, labels = index_and_labels
+    prefixes = typed_prefixes(labels)
+    encoded = [prefix_index.normalize(text, keep_trailing_space=True).encode()[:prefix_index.MAX_KEY_BYTES]
+               for text in prefixes]
+    precomputed = set(index.prefixes.tolist())
+    # Both lookup paths are exercised
+    assert any(prefix in precomputed for prefix in encoded)
+    assert any(prefix and prefix not in precomputed for prefix in encoded)
+
+    label_keys = [prefix_index.word_starts(label) for label in labels]
+    for text in prefixes:
+        expected = brute_force(index, label_keys, text)
+        for limit in (1, 5, prefix_index.TOP_K, prefix_index.TOP_K + 5):
+            assert index.complete(text, limit).tolist() == expected[:limit], (text, limit)
+
+
+def test_long_prefixes_match_on_truncated_keys(index_and_labels):
+    index, labels = index_and_labels
+    long_titles = {i for i, label in enumerate(labels) if label.startswith(LONG_WORD)}
+    found = set(index.complete(LONG_WORD + ' anything at all', 50).tolist())
+    assert long_titles <= found
@@ -0,0 +1,40 @@
+import numpy as np
+
+from recognition_index import DTW_BAND_FRACTION, SequenceIndex, dtw_band
+
+
+def brute_force(index, query, top_n):
+    """Nearest row per song by full banded DTW, best top_n songs."""
+    band = max(1, int(np.ceil(DTW_BAND_FRACTION * index.length)))
+    distances = dtw_band(query, index.sequences.astype(np.float32), band)
+    best = {}
+    for song_id, distance in zip(index.song_ids, distances):
+        best[int(song_id)] = min(distance, best.get(int(song_id), np.inf))
+    return sorted(best.items(), key=lambda item: (item[1], item[0]))[:top_n]
+
+
+def check_against_brute_force(song_ids, sequences, seed):
+    rng = np.random.default_rng(seed)
+    index = SequenceIndex(song_ids, sequences.astype(np.float16))
+    for _ in range(5):
+        query = rng.normal(size=sequences.shape[1:]).astype(np.float32)
+        for top_n in (1, 5, 10):
+            results, stats = index.search(query, top_n)
+            expected = brute_force(index, query, top_n)
+            assert [song_id for song_id, _ in results] == [song_id for song_id, _ in expected]
+            assert np.allclose([d for _, d in results], [d for _, d in expected], rtol=1e-5)
+            assert stats['full_dtw'] + stats['abandoned'] + stats['pruned'] == stats['candidates']
+
+
+def test_search_matches_brute_force():
+    # Far more songs than the first batch of max(2 * top_n, 16) candidates
+    rng = np.random.default_rng(0)
+    sequences = rng.normal(size=(300, 24, 2))
+    check_against_brute_force(np.arange(300), sequences, seed=1)
+
+
+def test_search_matches_brute_force_with_multi_segment_songs():
+    rng = np.random.default_rng(2)
+    song_ids = np.repeat(np.arange(80), rng.integers(1, 8, size=80))
+    sequences = rng.normal(size=(len(song_ids), 36, 1))
+    check_against_brute_force(song_ids, sequences, seed=3)
@@ -0,0 +1,53 @@
+import os
+import tempfile
+
+os.environ.setdefault('RECOMMENDER_ARTIFACTS_DIR', tempfile.mkdtemp())
+
+import pytest
+
+import benchmark_recommender
+import pagination
+import recommender
+
+
+@pytest.fixture(scope='module')
+def synthetic_catalog():
+    songs = benchmark_recommender.generate_catalog(500)
+    skips = benchmark_recommender.generate_skips(songs['id'].to_numpy(), 2000)
+    recommender.set_data_provider(benchmark_recommender.InMemoryDataProvider(songs, skips))
+    yield songs
+    recommender.set_data_provider(None)
+
+
+def tampered(cursor, **changes):
+    return pagination.encode_cursor({**pagination.decode_cursor(cursor), **changes})
+
+
+def test_cursor_pages_through_ranked_list(synthetic_catalog):
+    first = recommender.get_page('recommend', ['7'], limit=5)
+    second = recommender.get_page(cursor=first['next_cursor'])
+    assert len(first['results']) == len(second['results']) == 5
+    assert not {song['id'] for song in first['results']} & {song['id'] for song in second['results']}
+
+
+@pytest.mark.parametrize('changes', [
+    {'args': []},
+    {'args': ['7', '8']},
+    {'args': ['seven']},
+    {'args': [{'id': 7}]},
+    {'args': [True]},
+    {'command': 'search', 'args': [7]},
+    {'command': 'initial', 'args': ['7']},
+    {'command': 'multi', 'args': ['7:2,12', 'median']},
+    {'command': 'multi', 'args': [[[]]]},
+    {'command': 'personal'},
+])
+def test_malformed_cursor_args_are_invalid(synthetic_catalog, changes):
+    cursor = recommender.get_page('recommend', ['7'], limit=5)['next_cursor']
+    with pytest.raises(ValueError, match='Invalid cursor'):
+        recommender.get_page(cursor=tampered(cursor, **changes))
+
+
+def test_valid_multi_cursor_args_are_accepted(synthetic_catalog):
+    first = recommender.get_page('multi', ['7:2,12', 'max'], limit=3)
+    assert len(recommender.get_page(cursor=first['next_cursor'])['results']) == 3
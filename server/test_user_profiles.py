@@ -0,0 +1,68 @@
+import os
+import tempfile
+
+os.environ.setdefault('RECOMMENDER_ARTIFACTS_DIR', tempfile.mkdtemp())
+
+import numpy as np
+import pytest
+
+import benchmark_recommender
+import recommender
+import user_profiles
+
+
+@pytest.fixture(scope='module')
+def synthetic_catalog():
+    songs = benchmark_recommender.generate_catalog(300)
+    skips = benchmark_recommender.generate_skips(songs['id'].to_numpy(), 1000)
+    recommender.set_data_provider(benchmark_recommender.InMemoryDataProvider(songs, skips))
+    yield songs
+    recommender.set_data_provider(None)
+
+
+def random_store(n_users=50, dimensions=8, seed=0):
+    rng = np.random.default_rng(seed)
+    store = user_profiles.UserProfileStore(dimensions)
+    for user_id in rng.integers(1, 1000, n_users):
+        store.update(user_id, rng.normal(size=dimensions).astype(np.float32), 'play', 1000.0)
+    return store
+
+
+def test_save_writes_versions_and_load_reads_current(tmp_path):
+    assert user_profiles.UserProfileStore.load(str(tmp_path)) is None
+    store = random_store()
+    first = store.save(str(tmp_path), 'v1')
+    store.update(7, np.ones(8, dtype=np.float32), 'like', 2000.0)
+    second = store.save(str(tmp_path), 'v2')
+    assert first != second
+    assert (tmp_path / 'current.json').exists()
+
+    loaded = user_profiles.UserProfileStore.load(str(tmp_path))
+    assert loaded.catalog_version == 'v2'
+    assert loaded.user_index.keys() == store.user_index.keys()
+    for user_id in store.user_index:
+        np.testing.assert_array_equal(loaded.vector(user_id), store.vector(user_id))
+
+
+def test_profiles_rebuild_when_feature_stats_change(synthetic_catalog):
+    store = recommender.get_profile_store()
+    assert store.catalog_version == recommender.profile_catalog_version(recommender.get_catalog())
+    assert recommender.get_profile_store() is store
+    store.catalog_version = 'stale'
+    assert recommender.get_profile_store() is not store
+
+
+def test_ingested_plays_update_profiles(synthetic_catalog):
+    cat = recommender.get_catalog()
+    song_id = int(synthetic_catalog['id'].iloc[0])
+    user_id = 987654
+    recommender.record_profile_event({'type': 'skip', 'song_id': song_id, 'user_id': user_id,
+                                      'skip_type': 'quick', 'timestamp': 1000.0})
+    recommender.record_profile_event({'type': 'like', 'song_id': song_id, 'user_id': None,
+                                      'skip_type': None, 'timestamp': 1000.0})
+    assert user_id not in recommender.get_profile_store()
+
+    recommender.record_profile_event({'type': 'play', 'song_id': song_id, 'user_id': user_id,
+                                      'skip_type': None, 'timestamp': 1000.0})
+    np.testing.assert_allclose(recommender.get_profile_store().vector(user_id),
+                               cat.features[cat.position(song_id)], rtol=1e-6)
@@ -0,0 +1,50 @@
+import os
+
+import numpy as np
+
+from dedupe import DuplicateStore
+from matrix_factorization import FactorStore
+from versioned_store import KEEP_VERSIONS, VersionedArrayStore, lookup_rows
+
+
+def version_dirs(directory):
+    return sorted(name for name in os.listdir(directory) if os.path.isdir(os.path.join(directory, name)))
+
+
+def test_save_repoints_current_and_prunes_old_versions(tmp_path):
+    store = VersionedArrayStore(str(tmp_path))
+    versions = [store.save({'values': np.arange(3) + i}, {'run': i}) for i in range(5)]
+    assert len(set(versions)) == 5
+    assert version_dirs(tmp_path) == sorted(versions[-KEEP_VERSIONS:])
+    manifest, arrays = store.load(['values'])
+    assert manifest['version'] == versions[-1] and manifest['run'] == 4
+    assert arrays['values'].tolist() == [4, 5, 6]
+
+
+def test_load_without_a_save_is_none(tmp_path):
+    assert VersionedArrayStore(str(tmp_path)).load(['values']) is None
+    assert FactorStore(str(tmp_path)).load() is None
+    assert DuplicateStore(str(tmp_path)).load() is None
+
+
+def test_lookup_rows():
+    assert lookup_rows(np.array([2, 5, 9]), [9, 1, 5, 10]).tolist() == [2, -1, 1, -1]
+    assert lookup_rows(np.array([], dtype=np.int64), [1, 2]).tolist() == [-1, -1]
+
+
+def test_factor_and_duplicate_stores_round_trip_and_prune(tmp_path):
+    factors = FactorStore(str(tmp_path / 'factors'))
+    for _ in range(3):
+        factors.save(np.ones((2, 4)), np.eye(3, 4), np.array([10, 20]), np.array([1, 2, 3]), {'k': 4})
+    model = factors.load()
+    assert len(version_dirs(tmp_path / 'factors')) == KEEP_VERSIONS
+    assert model.user_row(20) == 1 and model.user_row(30) == -1
+    assert model.item_rows([3, 4]).tolist() == [2, -1]
+
+    duplicates = DuplicateStore(str(tmp_path / 'duplicates'))
+    for _ in range(3):
+        duplicates.save(np.array([7, 3, 5]), np.array([3, 3, 5]), {})
+    clusters = duplicates.load()
+    assert len(version_dirs(tmp_path / 'duplicates')) == KEEP_VERSIONS
+    assert clusters.manifest['duplicates'] == 1
+    assert clusters.clusters_for([7, 5, 8]).tolist() == [3, 5, 8]
@@ -0,0 +1,191 @@
+import json
+import logging
+import math
+import os
+import threading
+import time
+from typing import Optional
+
+import numpy as np
+
+from locks import file_lock
+
+logger = logging.getLogger(__name__)
+
+# Half-life of a play/like/skip in the trending score, in hours
+DEFAULT_HALF_LIFE_HOURS = 48.0
+
+# Counter columns, in file order
+KINDS = ('play', 'like', 'skip')
+
+# How each decayed counter contributes to a song's trending score
+SCORE_WEIGHTS = {'play': 1.0, 'like': 2.0, 'skip': -0.5}
+
+TRENDING_EVENTS_QUERY = """
+SELECT song_id, 'play', EXTRACT(EPOCH FROM played_at) FROM recently_played WHERE song_id IS NOT NULL
+UNION ALL
+SELECT song_id, 'like', EXTRACT(EPOCH FROM created_at) FROM user_favorite_songs WHERE song_id IS NOT NULL
+UNION ALL
+SELECT song_id, 'skip', EXTRACT(EPOCH FROM created_at) FROM skip_history WHERE song_id IS NOT NULL
+"""
+
+
+class TrendingCounters:
+    """Exponentially decayed play/like/skip counts per song, updated in O(1).
+
+    Instead of decaying every counter as time passes, each event is stored
+    already scaled to a fixed reference time (the epoch): an event at time t
+    adds 2^(t / half_life), and the count as of `now` is the sum times
+    2^(-now / half_life). Nothing has to be touched when time passes, and
+    events can arrive in any order. The sums are kept as logarithms
+    (np.logaddexp), so the scale never overflows and needs no renormalising.
+
+    Counters are a (songs, len(KINDS)) float64 array indexed by song id and
+    stored as `counters.npy`. The file is memory-mapped read-write, so an
+    update writes one row in place and other processes mapping the file see
+    it. `trending.json` holds the half-life the sums were built with.
+    `version` changes whenever this process sees the counters change.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.path = os.path.join(directory, 'counters.npy')
+        with open(os.path.join(directory, 'trending.json')) as f:
+            meta = json.load(f)
+        self.half_life = meta['half_life_hours'] * 3600.0
+        self.rate = math.log(2) / self.half_life
+        self._lock = threading.Lock()
+        self._counters = None
+        self._inode = None
+        self.version = 0
+        self._remap()
+
+    @classmethod
+    def create(cls, directory: str, half_life_hours: float = DEFAULT_HALF_LIFE_HOURS,
+               counters: Optional[np.ndarray] = None) -> 'TrendingCounters':
+        """Write a new store (empty, or the given log-sum counters) over any existing one."""
+        os.makedirs(directory, exist_ok=True)
+        if counters is None:
+            counters = np.full((1024, len(KINDS)), -np.inf)
+        with file_lock(os.path.join(directory, 'counters.lock')):
+            meta_path = os.path.join(directory, 'trending.json')
+            tmp_path = f'{meta_path}.{os.getpid()}.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump({'half_life_hours': half_life_hours, 'kinds': list(KINDS),
+                           'created_at': time.time()}, f)
+            os.replace(tmp_path, meta_path)
+            _write_counters(os.path.join(directory, 'counters.npy'), counters)
+        return cls(directory)
+
+    @classmethod
+    def load(cls, directory: str) -> Optional['TrendingCounters']:
+        if not os.path.exists(os.path.join(directory, 'trending.json')):
+            return None
+        return cls(directory)
+
+    def _remap(self):
+        # The file is replaced when it grows (or is rebuilt); follow it to the new inode
+        inode = os.stat(self.path).st_ino
+        if inode != self._inode:
+            self._counters = np.load(self.path, mmap_mode='r+')
+            self._inode = inode
+            self.version += 1
+
+    def __len__(self):
+        return len(self._counters)
+
+    def add(self, song_id: int, kind: str, timestamp: Optional[float] = None, count: float = 1.0) -> bool:
+        """Count one event; False for unknown kinds or invalid ids."""
+        column = KINDS.index(kind) if kind in KINDS else -1
+        song_id = int(song_id)
+        if column < 0 or song_id < 0 or count <= 0:
+            return False
+        value = (time.time() if timestamp is None else timestamp) * self.rate + math.log(count)
+        with self._lock, file_lock(os.path.join(self.directory, 'counters.lock')):
+            self._remap()
+            if song_id >= len(self._counters):
+                grown = np.full((max(2 * len(self._counters), song_id + 1), len(KINDS)), -np.inf)
+                grown[:len(self._counters)] = self._counters
+                _write_counters(self.path, grown)
+                self._remap()
+            row = self._counters[song_id]
+            row[column] = np.logaddexp(row[column], value)
+            self.version += 1
+        return True
+
+    def apply(self, event: dict) -> bool:
+        """Fold one parsed event (see event_ingest.parse_event) into the counters."""
+        return self.add(event['song_id'], event['type'], event.get('timestamp'))
+
+    def counts(self, song_ids, now: Optional[float] = None) -> np.ndarray:
+        """Decayed (len(song_ids), len(KINDS)) counts as of `now`; 0 for unseen songs."""
+        song_ids = np.asarray(song_ids, dtype=np.int64)
+        now = time.time() if now is None else now
+        with self._lock:
+            self._remap()
+            counters = self._counters
+            known = (song_ids >= 0) & (song_ids < len(counters))
+            logs = np.full((len(song_ids), len(KINDS)), -np.inf)
+            logs[known] = counters[song_ids[known]]
+        return np.exp(logs - now * self.rate)
+
+    def scores(self, song_ids, now: Optional[float] = None) -> Optional[np.ndarray]:
+        """Weighted trending score scaled to [0, 1], or None if none of the songs has any.
+
+        Every counter decays at the same rate, so the ranking only changes when
+        events arrive; `now` just sets the absolute level before scaling.
+        """
+        counts = self.counts(song_ids, now)
+        weights = np.array([SCORE_WEIGHTS[kind] for kind in KINDS])
+        scores = np.maximum(counts @ weights, 0)
+        top = scores.max() if len(scores) else 0
+        if top <= 0:
+            return None
+        return (scores / top).astype(np.float32)
+
+    def active(self) -> int:
+        """Number of songs with at least one counted event."""
+        with self._lock:
+            self._remap()
+            return int(np.isfinite(self._counters).any(axis=1).sum())
+
+    def flush(self):
+        with self._lock:
+            if self._counters is not None:
+                self._counters.flush()
+
+
+def _write_counters(path: str, counters: np.ndarray):
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        np.save(f, np.ascontiguousarray(counters, dtype=np.float64))
+    os.replace(tmp_path, path)
+
+
+def log_counters(song_ids: np.ndarray, kinds: np.ndarray, timestamps: np.ndarray,
+                 half_life_hours: float = DEFAULT_HALF_LIFE_HOURS) -> np.ndarray:
+    """Log-sum counters for a batch of events, as TrendingCounters.add() would build them."""
+    song_ids = np.asarray(song_ids, dtype=np.int64)
+    columns = np.array([KINDS.index(kind) if kind in KINDS else -1 for kind in kinds], dtype=np.int64)
+    valid = (song_ids >= 0) & (columns >= 0)
+    size = int(song_ids[valid].max()) + 1 if valid.any() else 0
+    counters = np.full((max(1024, size), len(KINDS)), -np.inf)
+    rate = math.log(2) / (half_life_hours * 3600.0)
+    values = np.asarray(timestamps, dtype=np.float64)[valid] * rate
+    np.logaddexp.at(counters, (song_ids[valid], columns[valid]), values)
+    return counters
+
+
+def rebuild_from_database(conn, directory: str,
+                          half_life_hours: float = DEFAULT_HALF_LIFE_HOURS) -> TrendingCounters:
+    """Recount every play, like and skip in the tables into a fresh store."""
+    with conn.cursor() as cursor:
+        cursor.execute(TRENDING_EVENTS_QUERY)
+        rows = cursor.fetchall()
+    rows = [row for row in rows if row[2] is not None]
+    song_ids = np.array([row[0] for row in rows], dtype=np.int64)
+    kinds = [row[1] for row in rows]
+    timestamps = np.array([float(row[2]) for row in rows], dtype=np.float64)
+    counters = log_counters(song_ids, kinds, timestamps, half_life_hours)
+    logger.info(f"Rebuilt trending counters from {len(rows)} events")
+    return TrendingCounters.create(directory, half_life_hours, counters)
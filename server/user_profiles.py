@@ -0,0 +1,208 @@
+from __future__ import annotations
+
+import threading
+import time
+from typing import Dict, Optional
+
+import numpy as np
+
+from startup import lazy_module
+from versioned_store import VersionedArrayStore
+
+# Only needed to rebuild profiles from history; loading them doesn't import it
+pd = lazy_module('pandas')
+
+# Half-life of a play or like in the taste vector, in days
+DEFAULT_HALF_LIFE_DAYS = 30.0
+
+# How much each kind of event pulls the taste vector towards the song
+EVENT_WEIGHTS = {
+    'play': 1.0,
+    'like': 3.0,
+}
+
+# Arrays in each saved version, one row per user
+PROFILE_ARRAYS = ('user_ids', 'vectors', 'weights', 'updated_at')
+
+PLAY_HISTORY_QUERY = """
+SELECT user_id, song_id, EXTRACT(EPOCH FROM played_at)
+FROM user_play_history
+WHERE user_id IS NOT NULL AND song_id IS NOT NULL
+"""
+
+FAVORITES_QUERY = """
+SELECT user_id, song_id, EXTRACT(EPOCH FROM created_at)
+FROM user_favorite_songs
+WHERE user_id IS NOT NULL AND song_id IS NOT NULL
+"""
+
+
+class UserProfileStore:
+    """Exponentially decayed average of the songs each user plays and likes.
+
+    Each user has a vector in the catalog's feature space, the total (decayed)
+    weight behind it and the time it was last updated. Decay is applied lazily:
+    an update first ages the stored weight to the event time, then folds the
+    new song in, so every update is O(dimensions) and nothing is recomputed.
+    """
+
+    def __init__(self, dimensions: int, half_life_days: float = DEFAULT_HALF_LIFE_DAYS,
+                 capacity: int = 1024):
+        self.dimensions = dimensions
+        self.half_life = half_life_days * 86400.0
+        self.user_index: Dict[int, int] = {}
+        self.vectors = np.zeros((capacity, dimensions), dtype=np.float32)
+        self.weights = np.zeros(capacity, dtype=np.float64)
+        self.updated_at = np.zeros(capacity, dtype=np.float64)
+        self.catalog_version = None
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.user_index)
+
+    def __contains__(self, user_id):
+        return int(user_id) in self.user_index
+
+    def _row(self, user_id: int) -> int:
+        row = self.user_index.get(user_id)
+        if row is None:
+            row = len(self.user_index)
+            if row == len(self.vectors):
+                self._grow(max(1024, 2 * len(self.vectors)))
+            self.user_index[user_id] = row
+        return row
+
+    def _grow(self, capacity: int):
+        vectors = np.zeros((capacity, self.dimensions), dtype=np.float32)
+        vectors[:len(self.vectors)] = self.vectors
+        weights = np.zeros(capacity, dtype=np.float64)
+        weights[:len(self.weights)] = self.weights
+        updated_at = np.zeros(capacity, dtype=np.float64)
+        updated_at[:len(self.updated_at)] = self.updated_at
+        self.vectors, self.weights, self.updated_at = vectors, weights, updated_at
+
+    def _decay(self, elapsed):
+        return np.power(0.5, np.maximum(elapsed, 0) / self.half_life)
+
+    def update(self, user_id: int, song_vector: np.ndarray, event: str = 'play',
+               timestamp: Optional[float] = None):
+        """Fold one play/like of a song (given by its feature vector) into the user's taste."""
+        strength = EVENT_WEIGHTS[event]
+        timestamp = time.time() if timestamp is None else timestamp
+        with self._lock:
+            row = self._row(int(user_id))
+            last = self.updated_at[row]
+            if timestamp >= last:
+                old_weight = self.weights[row] * self._decay(timestamp - last)
+                new_weight = strength
+                self.updated_at[row] = timestamp
+            else:
+                # Late event: age it to the stored timestamp instead
+                old_weight = self.weights[row]
+                new_weight = strength * self._decay(last - timestamp)
+            total = old_weight + new_weight
+            self.vectors[row] = (old_weight * self.vectors[row] + new_weight * song_vector) / total
+            self.weights[row] = total
+
+    def vector(self, user_id) -> Optional[np.ndarray]:
+        row = self.user_index.get(int(user_id))
+        if row is None or self.weights[row] <= 0:
+            return None
+        return self.vectors[row]
+
+    def save(self, directory: str, catalog_version: Optional[str] = None) -> str:
+        """Write the profiles as a new VersionedArrayStore version; returns its name."""
+        with self._lock:
+            n = len(self.user_index)
+            user_ids = np.fromiter(self.user_index.keys(), dtype=np.int64, count=n)
+            rows = np.fromiter(self.user_index.values(), dtype=np.int64, count=n)
+            arrays = {
+                'user_ids': user_ids,
+                'vectors': self.vectors[rows],
+                'weights': self.weights[rows],
+                'updated_at': self.updated_at[rows],
+            }
+        self.catalog_version = catalog_version
+        return VersionedArrayStore(directory).save(arrays, {
+            'dimensions': self.dimensions,
+            'half_life_days': self.half_life / 86400.0,
+            'users': n,
+            'catalog_version': catalog_version,
+        })
+
+    @classmethod
+    def load(cls, directory: str) -> Optional['UserProfileStore']:
+        """The current saved version, or None if nothing has been saved."""
+        loaded = VersionedArrayStore(directory).load(PROFILE_ARRAYS, mmap_mode=None)
+        if loaded is None:
+            return None
+        manifest, arrays = loaded
+        user_ids = arrays['user_ids']
+        store = cls(manifest['dimensions'], manifest['half_life_days'], capacity=max(1024, len(user_ids)))
+        n = len(user_ids)
+        store.vectors[:n] = arrays['vectors']
+        store.weights[:n] = arrays['weights']
+        store.updated_at[:n] = arrays['updated_at']
+        store.user_index = {int(user_id): row for row, user_id in enumerate(user_ids)}
+        store.catalog_version = manifest.get('catalog_version')
+        return store
+
+    @classmethod
+    def from_events(cls, events: pd.DataFrame, item_vectors: np.ndarray, positions: np.ndarray,
+                    half_life_days: float = DEFAULT_HALF_LIFE_DAYS,
+                    now: Optional[float] = None) -> 'UserProfileStore':
+        """Build every profile in one vectorised pass.
+
+        `events` has user_id, event ('play'/'like') and timestamp columns, and
+        `positions` gives each event's row in `item_vectors` (-1 for unknown songs).
+        The result equals replaying the events one by one through update().
+        """
+        store = cls(item_vectors.shape[1], half_life_days)
+        known = positions >= 0
+        events = events.loc[known]
+        positions = positions[known]
+        if events.empty:
+            return store
+
+        timestamps = events['timestamp'].to_numpy(dtype=np.float64)
+        now = timestamps.max() if now is None else now
+        strength = events['event'].map(EVENT_WEIGHTS).fillna(0).to_numpy(dtype=np.float64)
+        weights = strength * store._decay(now - timestamps)
+
+        user_ids, rows = np.unique(events['user_id'].to_numpy(dtype=np.int64), return_inverse=True)
+        store._grow(max(1024, len(user_ids)))
+        totals = np.bincount(rows, weights=weights, minlength=len(user_ids))
+        vectors = item_vectors[positions]
+        sums = np.column_stack([
+            np.bincount(rows, weights=weights * vectors[:, d], minlength=len(user_ids))
+            for d in range(store.dimensions)
+        ])
+
+        n = len(user_ids)
+        store.vectors[:n] = np.divide(sums, totals[:, None], out=np.zeros_like(sums),
+                                      where=totals[:, None] > 0)
+        store.weights[:n] = totals
+        store.updated_at[:n] = now
+        store.user_index = {int(user_id): row for row, user_id in enumerate(user_ids)}
+        return store
+
+
+def load_history_events(conn) -> pd.DataFrame:
+    """Plays and likes from Postgres as one (user_id, song_id, event, timestamp) frame."""
+    frames = []
+    with conn.cursor() as cursor:
+        for query, event in ((PLAY_HISTORY_QUERY, 'play'), (FAVORITES_QUERY, 'like')):
+            cursor.execute(query)
+            frame = pd.DataFrame(cursor.fetchall(), columns=['user_id', 'song_id', 'timestamp'])
+            frame['event'] = event
+            frames.append(frame)
+    events = pd.concat(frames, ignore_index=True)
+    events['timestamp'] = events['timestamp'].astype(np.float64)
+    return events
+
+
+def taste_scores(item_vectors: np.ndarray, item_norms: np.ndarray, user_vector: np.ndarray) -> np.ndarray:
+    """Cosine between the user's taste vector and every song: one matrix-vector product."""
+    norms = item_norms * np.float32(np.linalg.norm(user_vector))
+    return np.divide(item_vectors @ user_vector, norms,
+                     out=np.zeros(len(item_vectors), dtype=np.float32), where=norms > 0)
@@ -0,0 +1,87 @@
+import json
+import os
+import shutil
+import time
+from typing import Dict, Optional, Sequence, Tuple
+
+import numpy as np
+
+# Versions kept on disk: the current one and the one before, so a reader that has
+# just resolved current.json still finds its files
+KEEP_VERSIONS = 2
+
+
+def new_version() -> str:
+    """Sortable, unique name for a new version directory."""
+    now = time.time()
+    stamp = time.strftime('%Y%m%d%H%M%S', time.localtime(now))
+    return f'{stamp}.{int(now % 1 * 1e6):06d}-{os.getpid()}'
+
+
+class VersionedArrayStore:
+    """Named numpy arrays plus a JSON manifest, versioned on disk and memory-mapped back.
+
+    Each save writes a new `<version>/` directory, atomically repoints
+    `current.json` at it and then deletes all but the newest KEEP_VERSIONS
+    versions, so readers never see a half-written set of arrays.
+    """
+
+    def __init__(self, directory: str, keep: int = KEEP_VERSIONS):
+        self.directory = directory
+        self.keep = keep
+
+    def save(self, arrays: Dict[str, np.ndarray], manifest: Dict, version: Optional[str] = None) -> str:
+        version = version or new_version()
+        path = os.path.join(self.directory, version)
+        os.makedirs(path, exist_ok=True)
+        for name, array in arrays.items():
+            array = np.ascontiguousarray(array)
+            out = np.lib.format.open_memmap(os.path.join(path, f'{name}.npy'), mode='w+',
+                                            dtype=array.dtype, shape=array.shape)
+            out[...] = array
+            out.flush()
+            del out
+        with open(os.path.join(path, 'manifest.json'), 'w') as f:
+            json.dump({'version': version, 'created_at': time.time(), **manifest}, f)
+
+        tmp_path = os.path.join(self.directory, f'.current.json.{os.getpid()}.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump({'version': version}, f)
+        os.replace(tmp_path, os.path.join(self.directory, 'current.json'))
+        self.prune(version)
+        return version
+
+    def prune(self, current: str):
+        """Delete all but the newest `keep` version directories, never `current`."""
+        versions = sorted((name for name in os.listdir(self.directory)
+                           if os.path.isfile(os.path.join(self.directory, name, 'manifest.json'))),
+                          key=lambda name: (os.path.getmtime(os.path.join(self.directory, name)), name))
+        for name in versions[:-self.keep]:
+            if name != current:
+                shutil.rmtree(os.path.join(self.directory, name), ignore_errors=True)
+
+    def current_path(self) -> Optional[str]:
+        current = os.path.join(self.directory, 'current.json')
+        if not os.path.exists(current):
+            return None
+        with open(current) as f:
+            return os.path.join(self.directory, json.load(f)['version'])
+
+    def load(self, names: Sequence[str], mmap_mode: Optional[str] = 'r') -> Optional[Tuple[Dict, Dict[str, np.ndarray]]]:
+        """(manifest, arrays) of the current version, or None if nothing has been saved."""
+        path = self.current_path()
+        if path is None:
+            return None
+        with open(os.path.join(path, 'manifest.json')) as f:
+            manifest = json.load(f)
+        arrays = {name: np.load(os.path.join(path, f'{name}.npy'), mmap_mode=mmap_mode) for name in names}
+        return manifest, arrays
+
+
+def lookup_rows(sorted_ids: np.ndarray, ids) -> np.ndarray:
+    """Rows of `ids` in the sorted id array `sorted_ids`, -1 for ids it doesn't hold."""
+    ids = np.asarray(ids, dtype=np.int64)
+    if len(sorted_ids) == 0:
+        return np.full(ids.shape, -1, dtype=np.int64)
+    rows = np.minimum(np.searchsorted(sorted_ids, ids), len(sorted_ids) - 1)
+    return np.where(sorted_ids[rows] == ids, rows, -1)